@@ -0,0 +1,319 @@
+# domains.py
+
+# ANALYSIS (helpers): TWITTER
+# getting the host and registrable domain ("bbc.co.uk" for
+# "https://www.bbc.co.uk/sport/football") of every url in a table, in one
+# go. the notebooks used to derive `resolved_domain` row by row, and what
+# came out of malformed urls (`t`, `t.`, `t.c`, ...) had to be picked out
+# of the domain counts by hand.
+
+# how:
+# - the public suffix list (publicsuffix.org - what browsers use to know
+#   that `co.uk` isn't a domain anyone owns) goes into a trie of reversed
+#   labels: `uk` -> `co` -> ... a host gets walked from its last label
+#   backwards, and its public suffix is the longest rule that matches,
+#   wildcards (`*.ck`) and exceptions (`!www.ck`) included. the registrable
+#   domain is the suffix plus one label.
+# - unlike the browsers' default rule, a host whose last label isn't a
+#   known suffix has no registrable domain - that's what makes `t.c`
+#   invalid. so are hosts that are a public suffix themselves, ip
+#   addresses, and hosts with broken labels.
+# - `DomainExtractor.extract` pulls hosts out of a whole column of urls
+#   with one vectorized regex (in arrow, if pyarrow is around), works out
+#   each distinct host once, and maps the results back. hosts it has seen
+#   before (in earlier calls too) come from a memo. works the same on
+#   object and arrow-backed string columns.
+# - with a `DomainClassifier` (`data_collection/domain_categories.py`),
+#   the same pass adds an `is_<category>` column per category - matching
+#   subdomains too, unlike `isin` on a list.
+
+# the list gets downloaded once to `PUBLIC_SUFFIX_LIST` and read from there.
+
+############
+# IMPORTS
+############
+import os
+import re
+import sys
+import logging
+import numpy as np
+import pandas as pd
+import requests
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data_collection'))
+from domain_categories import DomainClassifier
+
+############
+# CONSTANTS
+############
+PUBLIC_SUFFIX_LIST = os.getenv('PUBLIC_SUFFIX_LIST', '/home/nikloynes/projects/world_cup_misinfo_tracking/data/exports/public_suffix_list.dat')
+PUBLIC_SUFFIX_URL = 'https://publicsuffix.org/list/public_suffix_list.dat'
+
+# `scheme://`, then the authority (`user@host:port`) - up to the path,
+# query or fragment. authorities get taken apart per distinct one.
+AUTHORITY_PATTERN = r'^[A-Za-z][A-Za-z0-9+.\-]*://(?P<authority>[^/?#\s]*)'
+# the same with scheme and `//` optional, for what the first doesn't
+# match (`www.bbc.co.uk/sport`, `mailto:...`). a lot slower.
+LENIENT_AUTHORITY_PATTERN = r'^\s*(?:[A-Za-z][A-Za-z0-9+.\-]*:)?(?://)?(?P<authority>[^/?#\s]*)'
+
+# dns labels: ascii letters, digits, `_` and `-`, or anything non-ascii
+# (idns). no `-` at either end.
+LABEL = r'(?!-)(?:[a-z0-9_-]|[^\x00-\x7f]){1,63}(?<!-)'
+HOSTNAME_PATTERN = re.compile(rf'^(?:{LABEL}\.)*{LABEL}$')
+IPV4_PATTERN = re.compile(r'^\d{1,3}(\.\d{1,3}){3}$')
+
+# trie node keys that can't be labels
+RULE = '.'
+EXCEPTION = '!'
+
+# hosts we remember results for, across calls
+DEFAULT_MEMO_SIZE = 2000000
+
+############
+# FUNCTIONS
+############
+def download_public_suffix_list(path:str=PUBLIC_SUFFIX_LIST, url:str=PUBLIC_SUFFIX_URL):
+    '''
+    fetches the current list to `path`, atomically
+    '''
+    response = requests.get(url, timeout=30)
+    response.raise_for_status()
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as outfile:
+        outfile.write(response.text)
+    os.replace(tmp_path, path)
+    logging.info(f'downloaded the public suffix list to {path}.')
+
+
+def read_rules(path:str, include_private:bool=False) -> list:
+    '''
+    the rules in a public suffix list file, as strings (`co.uk`, `*.ck`,
+    `!www.ck`). `include_private` takes the suffixes companies hand out
+    subdomains of (`blogspot.com`, `github.io`, ...) too - by default
+    those count as ordinary domains.
+    '''
+    rules = []
+    private = False
+    with open(path, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            line = line.strip()
+            if line.startswith('// VERSION:'):
+                logging.info(f'public suffix list {path}: {line[3:]}')
+            elif line.startswith('// ===BEGIN PRIVATE DOMAINS==='):
+                private = True
+            if not line or line.startswith('//'):
+                continue
+            if private and not include_private:
+                break
+            rules.append(line.split()[0].lower())
+
+    return rules
+
+
+def authority_host(authority:str) -> str:
+    '''
+    the host of a url's authority (`user:pw@Example.com.:8080`), lowercased,
+    without the trailing dot of a fully qualified name. None if it's empty.
+    '''
+    host = authority.rpartition('@')[2]
+    if host.startswith('['):
+        # ipv6
+        host = host[:host.find(']')+1] or host
+    else:
+        host = host.partition(':')[0]
+    host = host.lower()
+    if host.endswith('.'):
+        host = host[:-1]
+
+    return host or None
+
+
+def factorize_authorities(urls:pd.Series):
+    '''
+    (codes, distinct authorities) of a column of urls, codes -1 for urls
+    without one. with pyarrow, the regex and the factorizing run
+    vectorized in arrow, on arrow-backed columns without a copy.
+    '''
+    if pa is None:
+        authorities = urls.astype(object).str.extract(LENIENT_AUTHORITY_PATTERN, expand=False)
+        return pd.factorize(authorities.where(authorities.str.len() > 0))
+
+    array = pa.array(urls, type=pa.string(), from_pandas=True)
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    authorities = pc.struct_field(pc.extract_regex(array, AUTHORITY_PATTERN), [0])
+
+    missing = pc.and_(pc.is_null(authorities), pc.is_valid(array))
+    if pc.any(missing).as_py():
+        lenient = pc.extract_regex(pc.filter(array, missing), LENIENT_AUTHORITY_PATTERN)
+        authorities = pc.replace_with_mask(authorities, missing, pc.struct_field(lenient, [0]))
+
+    authorities = pc.if_else(pc.equal(authorities, ''), pa.scalar(None, pa.string()), authorities)
+    encoded = pc.dictionary_encode(authorities)
+    codes = pc.fill_null(encoded.indices, -1).to_numpy(zero_copy_only=False)
+
+    return codes, encoded.dictionary.to_numpy(zero_copy_only=False)
+
+
+############
+# THE THING!
+############
+class PublicSuffixTrie:
+
+    def __init__(self, rules:list):
+        '''
+        the rules of a public suffix list (see `read_rules`) as a trie of
+        reversed labels. every node is a dict of child labels, plus `RULE`
+        if a rule ends there and `EXCEPTION` for exception rules. rules
+        with non-ascii labels go in as they are and as punycode, so hosts
+        match in either form.
+        '''
+        self.root = {}
+        self.n_rules = 0
+        for rule in rules:
+            forms = {rule}
+            try:
+                forms.add(rule.encode('idna').decode('ascii'))
+            except UnicodeError:
+                pass
+            for form in forms:
+                self.add(form)
+
+    def add(self, rule:str):
+        kind = RULE
+        if rule.startswith('!'):
+            kind, rule = EXCEPTION, rule[1:]
+
+        node = self.root
+        for label in reversed(rule.split('.')):
+            node = node.setdefault(label, {})
+        node[kind] = True
+        self.n_rules += 1
+
+    def suffix_length(self, labels:list) -> int:
+        '''
+        how many of `labels` (a host split on dots) make up its public
+        suffix, by the longest matching rule. 0 if none matches.
+        '''
+        n = 0
+        node = self.root
+        for depth, label in enumerate(reversed(labels)):
+            child = node.get(label)
+            if child is not None and EXCEPTION in child:
+                # the rule minus its leftmost label
+                return depth
+            if child is None:
+                child = node.get('*')
+                if child is None:
+                    break
+            if RULE in child:
+                n = depth + 1
+            node = child
+
+        return n
+
+
+class DomainExtractor:
+
+    def __init__(self, trie:PublicSuffixTrie=None, memo_size:int=DEFAULT_MEMO_SIZE):
+        '''
+        hosts and registrable domains of urls, see the top of this file.
+
+        args:
+            - trie: `PublicSuffixTrie`, built from `PUBLIC_SUFFIX_LIST` if None
+              (downloaded first, if need be)
+            - memo_size: int, distinct hosts we remember results for. the
+              memo gets emptied when it's full.
+        '''
+        if trie is None:
+            if not os.path.isfile(PUBLIC_SUFFIX_LIST):
+                download_public_suffix_list()
+            trie = PublicSuffixTrie(read_rules(PUBLIC_SUFFIX_LIST))
+        self.trie = trie
+        self.memo_size = memo_size
+        self.memo = {}
+
+    def registrable_domain(self, host:str) -> str:
+        '''
+        the registrable domain of a (normalized) host, None if it has none
+        '''
+        domain = self.memo.get(host, False)
+        if domain is not False:
+            return domain
+
+        domain = None
+        if len(host) <= 253 and HOSTNAME_PATTERN.match(host) and not IPV4_PATTERN.match(host):
+            labels = host.split('.')
+            n = self.trie.suffix_length(labels)
+            if 0 < n < len(labels):
+                domain = '.'.join(labels[-n-1:])
+
+        if len(self.memo) >= self.memo_size:
+            self.memo.clear()
+        self.memo[host] = domain
+
+        return domain
+
+    def extract(self, urls, classifier:DomainClassifier=None) -> pd.DataFrame:
+        '''
+        one row per url, on the index of `urls`.
+
+        args:
+            - urls: pandas series (object or arrow strings) or list of urls.
+              missing values are fine.
+            - classifier: optional `DomainClassifier`, for category columns
+
+        returns:
+            - dataframe with `host` (lowercased, without port or trailing
+              dot; None if there's no host at all), `registrable_domain`
+              (None if the host has none) and `is_valid` (whether there's
+              a registrable domain). with a `classifier`, plus a bool
+              `is_<category>` column per category, and the versions of
+              the category lists in `attrs['domain_categories']`.
+        '''
+        if not isinstance(urls, pd.Series):
+            urls = pd.Series(urls, dtype=object)
+
+        # every distinct authority once
+        codes, authorities = factorize_authorities(urls)
+        hosts = np.array([None]+[authority_host(authority) for authority in authorities], dtype=object)
+        domains = np.array([None]+[self.registrable_domain(host) if host else None for host in hosts[1:]], dtype=object)
+
+        # slot 0 is for urls without an authority
+        codes = np.asarray(codes, dtype=np.int64) + 1
+        host_column = hosts[codes]
+        domain_column = domains[codes]
+
+        out = pd.DataFrame({'host': host_column,
+                            'registrable_domain': domain_column,
+                            'is_valid': pd.notna(domain_column)},
+                           index=urls.index)
+
+        if classifier is not None:
+            # one row per distinct host and category, then mapped back
+            host_categories = [classifier.classify_host(host) if host else () for host in hosts]
+            for category in classifier.categories:
+                flags = np.array([category in found for found in host_categories], dtype=bool)
+                out[f'is_{category}'] = flags[codes]
+            out.attrs['domain_categories'] = dict(classifier.versions)
+
+        return out
+
+
+def extract_domains(urls, extractor:DomainExtractor=None, classifier:DomainClassifier=None) -> pd.DataFrame:
+    '''
+    `DomainExtractor.extract` with a fresh extractor (on the full public
+    suffix list), unless you pass one
+    '''
+    if extractor is None:
+        extractor = DomainExtractor()
+    return extractor.extract(urls, classifier=classifier)
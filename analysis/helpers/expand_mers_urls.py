@@ -10,28 +10,45 @@
 ############
 # IMPORTS
 ############
-import urlexpander
+import os
+import logging
+from url_resolver import expand
+from url_cache import UrlCache
+from domains import extract_domains, DomainClassifier
 import pandas as pd
 
 ############
 # PATHS & CONSTANTS
 ############
 URLS_PATH = '/home/nikloynes/projects/world_cup_misinfo_tracking/data/exports/mers_tweets/unique_urls_freqs.csv'
-CACHE_PATH = '/home/nikloynes/projects/world_cup_misinfo_tracking/data/exports/mers_tweets/tmp_expanded.json'
+# our old per-corpus urlexpander cache, taken over into the shared one
+OLD_CACHE_PATH = '/home/nikloynes/projects/world_cup_misinfo_tracking/data/exports/mers_tweets/tmp_expanded.json'
 OUT_PATH = '/home/nikloynes/projects/world_cup_misinfo_tracking/data/exports/mers_tweets/expanded.csv'
 
 ############
 # THE THING!
 ############
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
 # read in our urls
 unique_urls_freqs_df = pd.read_csv(URLS_PATH)
 
-resolved_links = urlexpander.expand(unique_urls_freqs_df['url'], 
-                                    chunksize=1280,
-                                    n_workers=64, 
-                                    cache_file=CACHE_PATH, 
-                                    verbose=1)
+# every url we've resolved, for any corpus, lives in the shared cache
+cache = UrlCache()
+if os.path.isfile(OLD_CACHE_PATH):
+    cache.import_urlexpander(OLD_CACHE_PATH)
+
+resolved_links = expand(unique_urls_freqs_df['url'],
+                        cache=cache,
+                        max_concurrent=64,
+                        max_per_host=8,
+                        follow_all=True)
+cache.close()
 
 unique_urls_freqs_df['expanded'] = resolved_links
 
+# host, registrable_domain, is_valid and the is_<category> flags (streaming,
+# crypto_nft, ...) of where each url leads
+unique_urls_freqs_df = unique_urls_freqs_df.join(extract_domains(unique_urls_freqs_df['expanded'], classifier=DomainClassifier()))
+
 unique_urls_freqs_df.to_csv(OUT_PATH, index=False)
\ No newline at end of file
@@ -9,20 +9,27 @@
 ############
 # IMPORTS
 ############
+import os
+import logging
 import json
-import urlexpander
+from url_resolver import expand
+from url_cache import UrlCache
+from domains import extract_domains, DomainClassifier
 import pandas as pd
 
 ############
 # PATHS & CONSTANTS
 ############
 URLS_PATH = '/home/nikloynes/projects/world_cup_misinfo_tracking/data/exports/tweets/urls_counts.json'
-CACHE_PATH = '/home/nikloynes/projects/world_cup_misinfo_tracking/data/exports/tweets/tmp_expanded.json'
+# our old per-corpus urlexpander cache, taken over into the shared one
+OLD_CACHE_PATH = '/home/nikloynes/projects/world_cup_misinfo_tracking/data/exports/tweets/tmp_expanded.json'
 OUT_PATH = '/home/nikloynes/projects/world_cup_misinfo_tracking/data/exports/tweets/expanded.csv'
 
 ############
 # THE THING!
 ############
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
 # read in our urls
 with open(URLS_PATH, 'r') as infile:
     urls = json.load(infile)
@@ -30,12 +37,22 @@ with open(URLS_PATH, 'r') as infile:
 out_df = pd.DataFrame.from_dict(urls, 
                        orient='index').reset_index().rename(columns={'index' : 'url', 0 : 'count'})
 
-resolved_links = urlexpander.expand(out_df['url'], 
-                                    chunksize=1280,
-                                    n_workers=64, 
-                                    cache_file=CACHE_PATH, 
-                                    verbose=1)
+# every url we've resolved, for any corpus, lives in the shared cache
+cache = UrlCache()
+if os.path.isfile(OLD_CACHE_PATH):
+    cache.import_urlexpander(OLD_CACHE_PATH)
+
+resolved_links = expand(out_df['url'],
+                        cache=cache,
+                        max_concurrent=64,
+                        max_per_host=8,
+                        follow_all=True)
+cache.close()
 
 out_df['expanded'] = resolved_links
 
+# host, registrable_domain, is_valid and the is_<category> flags (streaming,
+# crypto_nft, ...) of where each url leads
+out_df = out_df.join(extract_domains(out_df['expanded'], classifier=DomainClassifier()))
+
 out_df.to_csv(OUT_PATH, index=False)
\ No newline at end of file
@@ -0,0 +1,375 @@
+# url_cache.py
+
+# ANALYSIS (helpers): TWITTER
+# the cache of resolved urls shared by all corpora (see `url_resolver.py`),
+# crash-safe without cron jobs copying it around. urlexpander kept its
+# results in one `tmp_expanded.json`, and a crash mid-write could take hours
+# of resolving with it - hence `copy_tmp_expanded_urls.py`.
+
+# how:
+# - the cache is an append-only log. every record is one line,
+#   `<crc32>\t<key>\t<json>`, where `key` is a 64 bit hash of the url and
+#   the crc covers key and json. a crash can only ever tear the last line,
+#   which we spot (no newline) and cut off on the next open. records with
+#   a bad crc (a flipped bit, a half-flushed page) get skipped.
+# - lookups go through an in-memory index, key -> offset of the url's
+#   latest record in the log. records are read off disk when asked for.
+# - on close, the index gets snapshotted to `<log>.idx`, with how many
+#   bytes of the log it covers. opening loads the snapshot and only scans
+#   the log past that point - a full scan (no json decoding, just keys
+#   and crcs) only happens when the snapshot is missing or belongs to
+#   another log. that's what makes a cache of tens of millions of urls
+#   cheap to open.
+# - a url that gets resolved again (e.g. `retry_errors`) gets a new record;
+#   the old one is garbage. `compact` rewrites the log with the latest
+#   record per url only, in a background thread while we keep appending,
+#   and swaps it in atomically.
+# - every expand_*_urls.py run shares the one log, so a cache holds an
+#   exclusive lock (`<log>.lock`) from open to close. a second run waits
+#   for the first to close the cache, rather than appending under its
+#   feet or losing its records to a compaction.
+
+############
+# IMPORTS
+############
+import os
+import json
+import zlib
+import uuid
+import fcntl
+import struct
+import hashlib
+import logging
+import threading
+from array import array
+
+############
+# CONSTANTS
+############
+URL_CACHE = os.getenv('URL_CACHE', '/home/nikloynes/projects/world_cup_misinfo_tracking/data/exports/url_cache.log')
+
+INDEX_SUFFIX = '.idx'
+LOCK_SUFFIX = '.lock'
+
+# first line of every log: magic + the log's id, which its index snapshot
+# has to match
+LOG_MAGIC = b'# url cache log v1 '
+INDEX_MAGIC = b'URLIDX1\n'
+
+# after the magic: log id (32 hex chars), bytes covered, records in the log
+INDEX_HEADER = struct.Struct('<32sQQ')
+
+# compact on open once this share of the log's records is garbage
+DEFAULT_COMPACT_AT = 0.5
+
+############
+# FUNCTIONS
+############
+def url_key(url:str) -> int:
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def encode_record(record:dict) -> bytes:
+    body = f'{url_key(record["url"]):016x}\t{json.dumps(record)}'.encode('utf-8')
+    return f'{zlib.crc32(body):08x}\t'.encode('ascii') + body + b'\n'
+
+
+def decode_line(line:bytes):
+    '''
+    (key, json bytes) of one log line, None if it's torn or corrupt
+    '''
+    if not line.endswith(b'\n') or len(line) < 27 or line[8:9]!=b'\t' or line[25:26]!=b'\t':
+        return None
+    body = line[9:-1]
+    try:
+        if int(line[:8], 16)!=zlib.crc32(body):
+            return None
+        return int(body[:16], 16), body[17:]
+    except ValueError:
+        return None
+
+
+def index_path(path:str) -> str:
+    return path + INDEX_SUFFIX
+
+
+def lock_path(path:str) -> str:
+    return path + LOCK_SUFFIX
+
+
+############
+# THE THING!
+############
+class UrlCache:
+
+    def __init__(self, path:str=URL_CACHE, compact_at:float=DEFAULT_COMPACT_AT):
+        '''
+        resolved urls by url, in an append-only log at `path` - see the top
+        of this file. records are whatever `UrlResolver.resolve` gives us,
+        plus `resolved_at`. safe to use from several threads. blocks while
+        another process has the same log open.
+
+        args:
+            - path: str, the log. created if missing.
+            - compact_at: float, compact in the background right after
+              opening if at least this share of the log is garbage. None
+              to never compact by ourselves.
+        '''
+        self.path = path
+        self.lock = threading.RLock()
+        self.compactor = None
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.lockfile = open(lock_path(path), 'a')
+        try:
+            fcntl.flock(self.lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logging.info(f'url cache {path} is in use by another process, waiting for it to close it.')
+            fcntl.flock(self.lockfile, fcntl.LOCK_EX)
+
+        if not os.path.isfile(path) or os.path.getsize(path)==0:
+            self._new_log(path)
+        self._load()
+
+        self.outfile = open(path, 'ab')
+        self.reader = open(path, 'rb')
+
+        logging.info(f'url cache {path}: {len(self.index)} urls in {self.n_records} records.')
+        if compact_at is not None and self.garbage() >= compact_at:
+            self.compact(background=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, url:str):
+        return self.get(url) is not None
+
+    def _new_log(self, path:str) -> str:
+        log_id = uuid.uuid4().hex
+        with open(path, 'wb') as outfile:
+            outfile.write(LOG_MAGIC + log_id.encode('ascii') + b'\n')
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        return log_id
+
+    def _load(self):
+        '''
+        sets `index`, `n_records`, `log_id` and `size` from the index
+        snapshot plus a scan of the log past it. cuts off a torn last record.
+        '''
+        with open(self.path, 'rb') as infile:
+            header = infile.readline()
+            if not header.startswith(LOG_MAGIC):
+                raise ValueError(f'{self.path} is not one of our url cache logs - please pick another path.')
+            self.log_id = header[len(LOG_MAGIC):].strip().decode('ascii')
+
+            self.index, self.n_records, covered = self._load_index(len(header))
+            infile.seek(covered)
+            offset = covered
+
+            n_scanned = n_corrupt = 0
+            for line in infile:
+                decoded = decode_line(line)
+                if decoded is None:
+                    if not line.endswith(b'\n'):
+                        # torn by a crash mid-write. the next append starts here.
+                        break
+                    n_corrupt += 1
+                else:
+                    self.index[decoded[0]] = offset
+                    self.n_records += 1
+                    n_scanned += 1
+                offset += len(line)
+
+        if offset < os.path.getsize(self.path):
+            logging.warning(f'cutting a torn record off the end of {self.path} (at byte {offset}).')
+            os.truncate(self.path, offset)
+        if n_corrupt:
+            logging.warning(f'skipped {n_corrupt} corrupt records in {self.path}.')
+        if n_scanned:
+            logging.info(f'scanned {n_scanned} records in {self.path} past its index snapshot.')
+
+        self.size = offset
+
+    def _load_index(self, header_size:int):
+        '''
+        (index, n_records, bytes covered) from the snapshot, or an empty
+        index covering just the log's header if there's no usable one
+        '''
+        empty = {}, 0, header_size
+        try:
+            with open(index_path(self.path), 'rb') as infile:
+                if infile.read(len(INDEX_MAGIC))!=INDEX_MAGIC:
+                    return empty
+                log_id, covered, n_records = INDEX_HEADER.unpack(infile.read(INDEX_HEADER.size))
+                entries = array('Q')
+                entries.frombytes(infile.read())
+        except (OSError, struct.error, ValueError):
+            return empty
+
+        if log_id.decode('ascii')!=self.log_id or covered > os.path.getsize(self.path):
+            logging.info(f'index snapshot of {self.path} is stale, rebuilding.')
+            return empty
+
+        return dict(zip(entries[::2], entries[1::2])), n_records, covered
+
+    def _save_index(self):
+        '''
+        snapshots the index, atomically
+        '''
+        entries = array('Q')
+        for key, offset in self.index.items():
+            entries.append(key)
+            entries.append(offset)
+
+        tmp_path = index_path(self.path) + '.tmp'
+        with open(tmp_path, 'wb') as outfile:
+            outfile.write(INDEX_MAGIC)
+            outfile.write(INDEX_HEADER.pack(self.log_id.encode('ascii'), self.size, self.n_records))
+            entries.tofile(outfile)
+        os.replace(tmp_path, index_path(self.path))
+
+    def _read(self, reader, offset:int) -> bytes:
+        reader.seek(offset)
+        return reader.readline()
+
+    def garbage(self) -> float:
+        '''
+        share of the log's records that have been superseded
+        '''
+        return 1 - len(self.index)/self.n_records if self.n_records else 0.0
+
+    def get(self, url:str) -> dict:
+        key = url_key(url)
+        with self.lock:
+            offset = self.index.get(key)
+            if offset is None:
+                return None
+            decoded = decode_line(self._read(self.reader, offset))
+
+        # a record gone bad on disk, or a hash collision - as good as a miss
+        if decoded is None:
+            return None
+        record = json.loads(decoded[1])
+        return record if record['url']==url else None
+
+    def put(self, record:dict):
+        line = encode_record(record)
+        with self.lock:
+            offset = self.outfile.tell()
+            self.outfile.write(line)
+            self.outfile.flush()
+            self.index[url_key(record['url'])] = offset
+            self.size = offset + len(line)
+            self.n_records += 1
+
+    def compact(self, background:bool=False):
+        '''
+        rewrites the log with only the latest record per url, see the top
+        of this file. with `background`, in a thread - `put` and `get` keep
+        working meanwhile, `close` waits for it.
+        '''
+        if self.compactor is not None and self.compactor.is_alive():
+            return
+        if background:
+            self.compactor = threading.Thread(target=self._compact, name='url-cache-compactor', daemon=True)
+            self.compactor.start()
+        else:
+            self._compact()
+
+    def _compact(self):
+        tmp_path = self.path + '.compact'
+        log_id = self._new_log(tmp_path)
+        n_before = self.n_records
+
+        with self.lock:
+            entries = list(self.index.items())
+            snapshot_end = self.size
+
+        new_index = {}
+        n_copied = 0
+        with open(tmp_path, 'ab') as outfile, open(self.path, 'rb') as reader:
+            offset = outfile.tell()
+
+            def copy(key:int, line:bytes):
+                nonlocal offset, n_copied
+                outfile.write(line)
+                new_index[key] = offset
+                offset += len(line)
+                n_copied += 1
+
+            # everything up to the snapshot, while `put` keeps appending.
+            # records that went bad since they were indexed get dropped.
+            for key, old_offset in entries:
+                line = self._read(reader, old_offset)
+                if decode_line(line) is not None:
+                    copy(key, line)
+            del entries
+
+            with self.lock:
+                # whatever came in meanwhile, then swap. skipping what
+                # doesn't decode, the same as `_load`.
+                reader.seek(snapshot_end)
+                for line in reader:
+                    decoded = decode_line(line)
+                    if decoded is not None:
+                        copy(decoded[0], line)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+
+                os.replace(tmp_path, self.path)
+                self.outfile.close()
+                self.reader.close()
+                self.outfile = open(self.path, 'ab')
+                self.reader = open(self.path, 'rb')
+                self.index = new_index
+                self.log_id = log_id
+                self.size = offset
+                self.n_records = n_copied
+                self._save_index()
+
+        logging.info(f'compacted {self.path}: {n_before} records down to {self.n_records}.')
+
+    def import_urlexpander(self, path:str) -> int:
+        '''
+        takes over the results in one of urlexpander's cache files (our old
+        `tmp_expanded.json`s), for the urls we don't have yet. returns how
+        many it took.
+        '''
+        n = 0
+        with open(path, 'r', encoding='utf-8') as infile:
+            for line in infile:
+                try:
+                    record = json.loads(line)
+                    url, expanded = record['original_url'], record['resolved_url']
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+                if not expanded or url in self:
+                    continue
+                self.put({'url': url, 'expanded': expanded, 'hops': None, 'status': None, 'error': None,
+                          'resolved_at': None, 'source': 'urlexpander'})
+                n += 1
+
+        logging.info(f'imported {n} urls from {path}.')
+        return n
+
+    def close(self):
+        if self.compactor is not None:
+            self.compactor.join()
+        with self.lock:
+            self.outfile.flush()
+            os.fsync(self.outfile.fileno())
+            self.outfile.close()
+            self.reader.close()
+            self._save_index()
+            fcntl.flock(self.lockfile, fcntl.LOCK_UN)
+            self.lockfile.close()
@@ -0,0 +1,304 @@
+# url_resolver.py
+
+# ANALYSIS (helpers): TWITTER
+# expanding shortened links (t.co, bit.ly, ...) to where they actually
+# point, for all our corpora at once. we used to hand every corpus to
+# `urlexpander.expand(n_workers=64)`: a thread per request, a full GET of
+# every page (including the final one), and one tmp cache file per corpus,
+# so a link shared in both the world cup and the epl tweets got resolved twice.
+
+# how:
+# - asyncio + aiohttp. one connection pool, with a cap on connections in
+#   flight overall and per host, so we never hammer bit.ly with 64
+#   requests at once.
+# - HEAD first - we only need the status and the `Location` header. hosts
+#   that don't do HEAD (405, 501) get a GET, whose body we never read.
+# - redirects get followed by hand, at most `max_redirects` hops. by
+#   default only while we're on a known shortener (`KNOWN_SHORTENERS`):
+#   once a hop leaves the shorteners we stop, and don't ask the news site
+#   where it redirects its cookie walls to. that also means a chain
+#   through a shortener that isn't on the list stops at its short link.
+#   `follow_all` follows every hop to the end of the chain, like
+#   urlexpander did - our expand_*_urls.py scripts use it.
+# - without `follow_all`, urls that aren't on a shortener to begin with
+#   don't get requested at all.
+# - records say whether they were resolved with `follow_all`. a
+#   `follow_all` run re-resolves cached urls that were resolved without it.
+# - every result goes into one `UrlCache` shared by all corpora (see
+#   `url_cache.py`), so a url gets resolved once, ever. results are
+#   appended to the cache as soon as they're in.
+
+# needs aiohttp (`pip install aiohttp`).
+
+############
+# IMPORTS
+############
+import time
+import asyncio
+import logging
+from urllib.parse import urlsplit, urljoin
+import aiohttp
+from url_cache import UrlCache
+
+############
+# CONSTANTS
+############
+KNOWN_SHORTENERS = {'t.co', 'bit.ly', 'bitly.com', 'tinyurl.com', 'ow.ly', 'buff.ly', 'dlvr.it', 'goo.gl', 'is.gd',
+                    'fb.me', 'trib.al', 'lnkd.in', 'youtu.be', 'tiny.cc', 'shorturl.at', 'cutt.ly', 'rebrand.ly',
+                    'rb.gy', 'bl.ink', 't.ly', 'amzn.to', 'spoti.fi', 'wp.me', 'ift.tt', 'ln.is', 'mol.im',
+                    'bbc.in', 'cnn.it', 'nyti.ms', 'reut.rs', 'wapo.st', 'hill.cm', 'gu.com', 'ind.pn',
+                    'dailym.ai', 'trib.in', 'apne.ws', 'econ.st', 'on.ft.com', 'politi.co', 'n.pr', 'ti.me',
+                    'tmblr.co', 'instagr.am', 'redd.it', 'flip.it', 'linktr.ee', 'qr.ae', 'po.st', 'shar.es'}
+
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+# statuses on a HEAD that just mean "ask me with a GET" - method not
+# allowed, not implemented. a 404 or 403 is an answer, not a refusal of HEAD.
+HEAD_FALLBACK_STATUSES = {405, 501}
+
+DEFAULT_MAX_REDIRECTS = 10
+
+# seconds per request
+DEFAULT_TIMEOUT = 15
+
+# some shorteners answer bots differently
+HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0 Safari/537.36'}
+
+############
+# FUNCTIONS
+############
+def host_of(url:str) -> str:
+    '''
+    lowercased host of `url`, without `www.` or port. '' if it has none.
+    '''
+    try:
+        host = urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def is_shortener(url:str, shorteners:set=KNOWN_SHORTENERS) -> bool:
+    return host_of(url) in shorteners
+
+
+def stopped_early(record:dict) -> bool:
+    '''
+    whether a cached record may have stopped short of the end of its
+    chain - resolved by us without `follow_all`. urlexpander's followed
+    every hop.
+    '''
+    return not record.get('follow_all') and record.get('source')!='urlexpander'
+
+
+def is_resolvable(url:str) -> bool:
+    '''
+    whether `url` is something we can send a request to at all - an
+    http(s) url with a host that has a dot in it
+    '''
+    if not isinstance(url, str):
+        return False
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    return parts.scheme in ('http', 'https') and '.' in (parts.hostname or '').strip('.')
+
+
+############
+# THE THING!
+############
+class UrlResolver:
+
+    def __init__(self,
+                 max_concurrent:int=64,
+                 max_per_host:int=8,
+                 max_redirects:int=DEFAULT_MAX_REDIRECTS,
+                 timeout:float=DEFAULT_TIMEOUT,
+                 follow_all:bool=False,
+                 shorteners:set=KNOWN_SHORTENERS):
+        '''
+        resolves urls, see the top of this file. use as `async with`.
+
+        args:
+            - max_concurrent: int, requests in flight at once, overall
+            - max_per_host: int, requests in flight at once, per host
+            - max_redirects: int, hops we follow per url
+            - timeout: float, seconds per request
+            - follow_all: bool, follow redirects off the shorteners too, to
+              the very end of the chain
+            - shorteners: set of shortener hosts (without `www.`)
+        '''
+        self.max_concurrent = max_concurrent
+        self.max_per_host = max_per_host
+        self.max_redirects = max_redirects
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.follow_all = follow_all
+        self.shorteners = shorteners
+        self.session = None
+        self.counters = {'requests': 0, 'head_fallbacks': 0}
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrent,
+                                         limit_per_host=self.max_per_host,
+                                         ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, headers=HEADERS, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _request(self, method:str, url:str):
+        '''
+        (status, location) of one request, without following redirects or
+        reading the body
+        '''
+        self.counters['requests'] += 1
+        async with self.session.request(method, url, allow_redirects=False) as response:
+            return response.status, response.headers.get('Location')
+
+    async def hop(self, url:str):
+        '''
+        (status, location) for `url`: HEAD, or GET if the host won't do HEAD
+        '''
+        try:
+            status, location = await self._request('HEAD', url)
+        except (aiohttp.ClientResponseError, aiohttp.ServerDisconnectedError):
+            status, location = None, None
+        if status is None or status in HEAD_FALLBACK_STATUSES:
+            self.counters['head_fallbacks'] += 1
+            status, location = await self._request('GET', url)
+
+        return status, location
+
+    async def resolve(self, url:str) -> dict:
+        '''
+        where `url` leads.
+
+        returns:
+            - dict with the `url`, where it `expanded` to (as far as we got,
+              on errors), the `hops` we followed, the last `status` and an
+              `error` (None if all went well)
+        '''
+        record = {'url': url, 'expanded': url, 'hops': 0, 'status': None, 'error': None,
+                  'follow_all': self.follow_all}
+        if not is_resolvable(url):
+            record['error'] = 'invalid url'
+            return record
+
+        current = url
+        try:
+            while self.follow_all or host_of(current) in self.shorteners:
+                if record['hops'] >= self.max_redirects:
+                    record['error'] = 'too many redirects'
+                    break
+                status, location = await self.hop(current)
+                record['status'] = status
+                if status not in REDIRECT_STATUSES or not location:
+                    break
+                current = urljoin(current, location)
+                record['hops'] += 1
+                record['expanded'] = current
+                if not is_resolvable(current):
+                    record['error'] = 'invalid redirect'
+                    break
+        except asyncio.TimeoutError:
+            record['error'] = 'timeout'
+        except aiohttp.ClientError as e:
+            record['error'] = f'{type(e).__name__}: {e}'
+
+        return record
+
+
+async def expand_async(urls,
+                       cache:UrlCache,
+                       retry_errors:bool=False,
+                       report_interval:int=10000,
+                       **resolver_kwargs) -> dict:
+    '''
+    resolves every url in `urls` that `cache` doesn't have yet into the
+    cache - with `follow_all`, also those it only has part of the chain
+    for (see `stopped_early`). duplicates get resolved once.
+
+    args:
+        - urls: iterable of urls
+        - cache: `UrlCache`
+        - retry_errors: bool, have another go at urls that failed last time
+        - report_interval: int, log progress every this many urls
+        - resolver_kwargs: passed to `UrlResolver`
+
+    returns:
+        - counters dict: `resolved`, `cached`, `failed` and `requests`
+    '''
+    counters = {'resolved': 0, 'cached': 0, 'failed': 0}
+    follow_all = resolver_kwargs.get('follow_all', False)
+    todo = []
+    seen = set()
+    for url in urls:
+        if not isinstance(url, str) or url in seen:
+            # missing values in a url column
+            continue
+        seen.add(url)
+        hit = cache.get(url)
+        if hit is not None and not (retry_errors and hit.get('error')) and not (follow_all and stopped_early(hit)):
+            counters['cached'] += 1
+        else:
+            todo.append(url)
+    del seen
+
+    logging.info(f'resolving {len(todo)} urls, {counters["cached"]} already cached.')
+    start = time.monotonic()
+
+    async with UrlResolver(**resolver_kwargs) as resolver:
+        pending = iter(todo)
+
+        # as many workers as requests may be in flight, all pulling from
+        # the same iterator - no task per url
+        async def worker():
+            for url in pending:
+                record = await resolver.resolve(url)
+                record['resolved_at'] = time.time()
+                cache.put(record)
+                counters['failed' if record['error'] else 'resolved'] += 1
+
+                n_done = counters['resolved'] + counters['failed']
+                if n_done % report_interval==0:
+                    rate = n_done/(time.monotonic() - start)
+                    logging.info(f'resolved {n_done} of {len(todo)} urls ({rate:.1f}/s), {counters["failed"]} failed.')
+
+        await asyncio.gather(*[worker() for _ in range(resolver.max_concurrent)])
+        counters['requests'] = resolver.counters['requests']
+
+    logging.info(f'done resolving: {counters}')
+
+    return counters
+
+
+def expand(urls:list, cache:UrlCache=None, **kwargs) -> list:
+    '''
+    what each of `urls` expands to, in order - a drop-in for
+    `urlexpander.expand`. resolves what `cache` (the shared one by
+    default) doesn't have yet, see `expand_async` for kwargs. urls we
+    couldn't resolve all the way come back as far as we got, urls the
+    cache can't give us back (a corrupt record, a hash collision) as they are.
+    '''
+    urls = list(urls)
+    own_cache = cache is None
+    if own_cache:
+        cache = UrlCache()
+
+    try:
+        asyncio.run(expand_async(urls, cache, **kwargs))
+        expanded = []
+        n_missing = 0
+        for url in urls:
+            record = cache.get(url) if isinstance(url, str) else None
+            if record is None and isinstance(url, str):
+                n_missing += 1
+            expanded.append(url if record is None else record['expanded'])
+        if n_missing:
+            logging.warning(f'{n_missing} urls missing from the cache after resolving, kept them unexpanded.')
+        return expanded
+    finally:
+        if own_cache:
+            cache.close()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# bench_jsonl_writer.py
+
+# BENCHMARKS: DATA COLLECTION
+# tweets/sec for writing a synthetic run of tweets to jsonl:
+# - BEFORE: `open(path, 'a')` + write + close per tweet, as our collectors used to
+# - AFTER: the shared, buffered `JsonlWriter`, with and without fsync on flush
+
+# usage (from the repo root):
+#   python3 benchmarks/bench_jsonl_writer.py -n 1000000
+
+############
+# IMPORTS
+############
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_collection'))
+from jsonl_writer import JsonlWriter
+
+############
+# FUNCTIONS
+############
+def synthetic_tweet(i:int) -> dict:
+    '''
+    a tweet shaped like the output records of our search collectors
+    '''
+    return {
+        'author_id': str(1000000+i%50000),
+        'created_at': '2022-12-18T15:00:00.000Z',
+        'id': str(1604000000000000000+i),
+        'public_metrics': {'retweet_count': i%7, 'reply_count': 0, 'like_count': i%13, 'quote_count': 0},
+        'source': 'Twitter for iPhone',
+        'text': f'What a final! #worldcup #qatar2022 https://t.co/abc{i%1000:04d}',
+        'urls': [f'https://t.co/abc{i%1000:04d}'],
+        'domains': {'Sport': 1, 'Events [Entity Service]': 1},
+        'entities': {'FIFA World Cup': 1, 'Qatar': 1},
+        'user': {'id': str(1000000+i%50000), 'name': 'a fan', 'username': f'fan_{i%50000}'}
+    }
+
+
+def run_naive(path:str, tweets:list) -> float:
+    start = time.perf_counter()
+    for tweet in tweets:
+        with open(path, 'a') as o:
+            o.write(json.dumps(tweet)+'\n')
+    return time.perf_counter() - start
+
+
+def run_writer(path:str, tweets:list, **kwargs) -> float:
+    start = time.perf_counter()
+    with JsonlWriter(path, **kwargs) as writer:
+        for tweet in tweets:
+            writer.write(tweet)
+    return time.perf_counter() - start
+
+
+############
+# CLI
+############
+parser = argparse.ArgumentParser(description='Benchmark per-tweet open/append vs buffered jsonl writing.')
+
+parser.add_argument("-n", "--n_tweets", dest="n_tweets",
+                    default=1000000, type=int,
+                    help="number of synthetic tweets to write")
+
+args = parser.parse_args()
+
+############
+# THE THING!
+############
+tweets = [synthetic_tweet(i) for i in range(args.n_tweets)]
+
+runs = [
+    ('open/append/close per tweet', run_naive, {}),
+    ('JsonlWriter (fsync=never)', run_writer, {}),
+    ('JsonlWriter (fsync=flush)', run_writer, {'fsync': 'flush'}),
+]
+
+print(f'writing {args.n_tweets} synthetic tweets\n')
+baseline = None
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for i, (name, func, kwargs) in enumerate(runs):
+        path = os.path.join(tmp_dir, f'run_{i}.json')
+        elapsed = func(path, tweets, **kwargs)
+        rate = args.n_tweets/elapsed
+        if baseline is None:
+            baseline = rate
+        print(f'{name:<32} {elapsed:8.2f}s {rate:12,.0f} tweets/sec  ({rate/baseline:.1f}x)')
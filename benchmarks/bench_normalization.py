@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# bench_normalization.py
+
+# BENCHMARKS: DATA COLLECTION
+# times the tweet normalisation hot path in isolation, on synthetic pages
+# shaped like `search_recent_tweets` responses (100 tweets + includes):
+# - BEFORE: the per-tweet loop our search collectors used to carry
+#   (uncompiled regex, positional user match with linear fallback,
+#   field-by-field projection)
+# - AFTER: `tweet_normalization.normalize_page` on the same pages
+
+# usage (from the repo root):
+#   python3 benchmarks/bench_normalization.py -p 2000
+
+############
+# IMPORTS
+############
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_collection'))
+from tweet_normalization import normalize_page, OUT_CORE_FIELDS, OUT_USER_FIELDS
+
+############
+# FUNCTIONS
+############
+class Obj:
+    '''
+    stands in for tweepy's Tweet/User objects - all we use is `.data`
+    '''
+    def __init__(self, data:dict):
+        self.data = data
+
+
+def synthetic_page(page:int, shuffle_users:bool) -> tuple:
+    '''
+    a page of 100 tweets by 60 distinct authors, a third of them with
+    context annotations and a url
+    '''
+    tweets = []
+    users = {}
+    for i in range(100):
+        author_id = str(1000+(page*60+i%60))
+        tweet = {
+            'id': str(1604000000000000000+page*100+i),
+            'author_id': author_id,
+            'created_at': '2022-12-18T15:00:00.000Z',
+            'edit_history_tweet_ids': [str(1604000000000000000+page*100+i)],
+            'public_metrics': {'retweet_count': i, 'reply_count': 0, 'like_count': 2, 'quote_count': 0},
+            'source': 'Twitter for Android',
+            'text': f'RT @someone: Messi lifts the trophy #worldcup #qatar2022 tweet number {i}'
+        }
+        if i%3==0:
+            tweet['text'] += f' https://t.co/xyz{i:04d}'
+            tweet['context_annotations'] = [
+                {'domain': {'id': '6', 'name': 'Sports Event'}, 'entity': {'id': '1', 'name': 'FIFA World Cup'}},
+                {'domain': {'id': '11', 'name': 'Sport'}, 'entity': {'id': '2', 'name': 'Soccer'}},
+                {'domain': {'id': '60', 'name': 'Athlete'}, 'entity': {'id': '3', 'name': 'Lionel Messi'}}
+            ]
+        tweets.append(tweet)
+        users[author_id] = {
+            'id': author_id, 'name': 'a fan', 'username': f'fan_{author_id}',
+            'created_at': '2015-01-01T00:00:00.000Z', 'description': 'football',
+            'location': 'Doha', 'protected': False,
+            'public_metrics': {'followers_count': 10, 'following_count': 20, 'tweet_count': 30, 'listed_count': 0}
+        }
+    users = list(users.values())
+    if shuffle_users:
+        random.Random(page).shuffle(users)
+
+    return tweets, {'users': users}
+
+
+def extract_count_domains_entities_before(context_field:list):
+    domains = {}
+    entities = {}
+    for context in context_field:
+        if context['domain']['name'] not in domains.keys():
+            domains[context['domain']['name']] = 1
+        else:
+            domains[context['domain']['name']] += 1
+        if context['entity']['name'] not in entities.keys():
+            entities[context['entity']['name']] = 1
+        else:
+            entities[context['entity']['name']] += 1
+    return domains, entities
+
+
+def total_domain_entity_counts_before(domains_tweet, domains_session, entities_tweet, entities_session):
+    for domain in domains_tweet.keys():
+        if domain not in domains_session.keys():
+            domains_session[domain] = 1
+        else:
+            domains_session[domain] += 1
+    for entity in entities_tweet.keys():
+        if entity not in entities_session.keys():
+            entities_session[entity] = 1
+        else:
+            entities_session[entity] += 1
+    return domains_session, entities_session
+
+
+def normalize_before(tweets:tuple, chunk_domains:dict, chunk_entities:dict) -> list:
+    '''
+    the loop body of the old search collectors, minus logging and writing
+    '''
+    records = []
+    for i in range(len(tweets[0])):
+        tmp_dict = tweets[0][i].data
+        author_id = tmp_dict['author_id']
+        tmp_user = {}
+        try:
+            tmp_user = tweets[1]['users'][i].data
+            if tmp_user['id']!=author_id:
+                for user_obj in tweets[1]['users']:
+                    if user_obj.data['id']==author_id:
+                        tmp_user = user_obj.data
+        except IndexError:
+            for user_obj in tweets[1]['users']:
+                if user_obj.data['id']==author_id:
+                    tmp_user = user_obj.data
+
+        out = {}
+        for field in OUT_CORE_FIELDS:
+            if field in tmp_dict:
+                out[field] = tmp_dict[field]
+
+        urls = re.findall("http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+", tmp_dict['text'])
+        if len(urls)>0:
+            out['urls'] = urls
+
+        if 'context_annotations' in tmp_dict.keys():
+            domains, entities = extract_count_domains_entities_before(tmp_dict['context_annotations'])
+            out['domains'] = domains
+            out['entities'] = entities
+            chunk_domains, chunk_entities = total_domain_entity_counts_before(domains, chunk_domains,
+                                                                              entities, chunk_entities)
+        user = {}
+        for field in OUT_USER_FIELDS:
+            if field in tmp_user:
+                user[field] = tmp_user[field]
+        out['user'] = user
+        records.append(out)
+
+    return records
+
+
+############
+# CLI
+############
+parser = argparse.ArgumentParser(description='Benchmark the tweet normalisation hot path.')
+
+parser.add_argument("-p", "--pages", dest="pages",
+                    default=2000, type=int,
+                    help="number of synthetic 100-tweet pages")
+
+parser.add_argument("-s", "--shuffle_users", dest="shuffle_users",
+                    action="store_true",
+                    help="""shuffle `includes.users` so positional matching
+                    mostly misses (the worst case for the old loop)""")
+
+args = parser.parse_args()
+
+############
+# THE THING!
+############
+pages = [synthetic_page(p, args.shuffle_users) for p in range(args.pages)]
+wrapped = [([Obj(t) for t in data], {'users': [Obj(u) for u in includes['users']]}) for data, includes in pages]
+n_tweets = 100*args.pages
+
+start = time.perf_counter()
+domains, entities = {}, {}
+for page in wrapped:
+    normalize_before(page, domains, entities)
+before = time.perf_counter() - start
+
+start = time.perf_counter()
+domains, entities = {}, {}
+for data, includes in pages:
+    normalize_page(data, includes, domains_session=domains, entities_session=entities)
+after = time.perf_counter() - start
+
+print(f'normalising {n_tweets} synthetic tweets (shuffled users: {args.shuffle_users})\n')
+print(f'{"before (per-collector loop)":<32} {before:8.2f}s {n_tweets/before:12,.0f} tweets/sec')
+print(f'{"after (normalize_page)":<32} {after:8.2f}s {n_tweets/after:12,.0f} tweets/sec  ({before/after:.1f}x)')
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# bench_url_extraction.py
+
+# BENCHMARKS: DATA COLLECTION
+# compares the two ways we get urls out of a tweet:
+# - regex: scanning the tweet text with `URL_PATTERN` (the old default,
+#   now only a fallback). only ever sees `t.co` links.
+# - entities: reading `unwound_url`/`expanded_url` off the api's url entities.
+# reports per-tweet cpu time for both, and how many downstream url
+# expansions the entities path saves: with the regex path every unique
+# `t.co` link has to go through urlexpander, with the entities path only
+# the urls still sitting on a shortener do.
+
+# usage (from the repo root):
+#   python3 benchmarks/bench_url_extraction.py -n 200000
+#   python3 benchmarks/bench_url_extraction.py -f ../data/tweets/tweets_2023_02_01-12_00_00.json
+# with `-f`, the savings are measured on a collected (post-change) tweet file
+# instead of on synthetic tweets.
+
+############
+# IMPORTS
+############
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_collection'))
+from tweet_normalization import extract_urls, extract_entity_urls
+
+############
+# CONSTANTS
+############
+# hosts whose links still need resolving downstream
+SHORTENERS = {'t.co', 'bit.ly', 'tinyurl.com', 'ow.ly', 'buff.ly', 'dlvr.it', 'goo.gl', 'is.gd', 'fb.me', 'trib.al', 'lnkd.in', 'youtu.be'}
+
+TARGETS = ['https://www.bbc.co.uk/sport/football/63925431', 'https://www.fifa.com/fifaplus/en/tournaments/mens/worldcup/qatar2022',
+           'https://twitter.com/FIFAWorldCup/status/1604530539939868672/photo/1', 'https://www.theguardian.com/football/2022/dec/18/argentina-france-world-cup-final',
+           'https://streamssports.live/wc-final', 'https://bit.ly/3WxYz12', 'https://youtu.be/abcdEFGh123']
+
+############
+# FUNCTIONS
+############
+def synthetic_tweet(i:int, rng:random.Random) -> dict:
+    '''
+    a raw v2 tweet with 0-3 urls, both in the text (as t.co) and as entities
+    '''
+    n_urls = rng.choice([0, 0, 1, 1, 1, 2, 3])
+    text = f'Unbelievable scenes in Doha #worldcup #qatar2022 tweet {i} '
+    url_entities = []
+    for j in range(n_urls):
+        tco = f'https://t.co/{i%997:03d}{j}{rng.randrange(10**6):06d}'
+        target = rng.choice(TARGETS)
+        entity = {'start': len(text), 'end': len(text)+len(tco), 'url': tco,
+                  'expanded_url': target, 'display_url': target[8:30]}
+        if 'bit.ly' not in target and 'youtu.be' not in target and rng.random() < 0.7:
+            entity['unwound_url'] = target
+        url_entities.append(entity)
+        text += tco+' '
+
+    return {'id': str(i), 'text': text, 'entities': {'urls': url_entities, 'hashtags': []}}
+
+
+def needs_expansion(url:str) -> bool:
+    return urlparse(url).netloc.lower() in SHORTENERS
+
+
+def cpu_per_tweet(func, tweets:list) -> float:
+    '''
+    cpu microseconds per tweet
+    '''
+    start = time.process_time()
+    for tweet in tweets:
+        func(tweet)
+    return (time.process_time() - start)/len(tweets)*1e6
+
+
+############
+# CLI
+############
+parser = argparse.ArgumentParser(description='Benchmark regex vs url-entity url extraction.')
+
+parser.add_argument("-n", "--n_tweets", dest="n_tweets",
+                    default=200000, type=int,
+                    help="number of synthetic tweets")
+
+parser.add_argument("-f", "--tweets_file", dest="tweets_file",
+                    help="""optional collected tweet file (jsonl) to measure
+                    expansion savings on, instead of synthetic tweets""")
+
+args = parser.parse_args()
+
+############
+# THE THING!
+############
+rng = random.Random(0)
+tweets = [synthetic_tweet(i, rng) for i in range(args.n_tweets)]
+
+regex_us = cpu_per_tweet(lambda tweet: extract_urls(tweet['text']), tweets)
+entities_us = cpu_per_tweet(extract_entity_urls, tweets)
+
+print(f'cpu per tweet over {args.n_tweets} synthetic tweets\n')
+print(f'{"regex over text":<20} {regex_us:8.2f} us/tweet')
+print(f'{"url entities":<20} {entities_us:8.2f} us/tweet  ({regex_us/entities_us:.1f}x)\n')
+
+# expansion savings. synthetic tweets share a handful of targets, so treat
+# the synthetic numbers as illustrative and use `-f` for the real picture.
+if args.tweets_file:
+    urls = set()
+    with open(args.tweets_file, 'r') as infile:
+        for line in infile:
+            urls.update(json.loads(line).get('urls', []))
+    # every one of these used to be a distinct t.co link
+    before = len(urls)
+    after = sum(needs_expansion(url) for url in urls)
+    source = args.tweets_file
+else:
+    before = len({url for tweet in tweets for url in extract_urls(tweet['text'])})
+    after = sum(needs_expansion(url) for url in {url for tweet in tweets for url in extract_entity_urls(tweet)})
+    source = 'synthetic tweets'
+
+print(f'unique urls needing downstream expansion ({source})\n')
+print(f'{"regex over text":<20} {before:10,}')
+print(f'{"url entities":<20} {after:10,}  ({(before-after)/max(before, 1)*100:.1f}% fewer expansions)')
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# bench_url_resolver.py
+
+# BENCHMARKS: ANALYSIS
+# times `url_resolver.expand` against a local stand-in for the shorteners,
+# so we can tune concurrency without hammering (or depending on) the real
+# ones. the stand-in is a threaded `http.server` on 127.0.0.1 that plays
+# a shortener: every `/s/<i>` redirects to `/t/<i>` (a second shortener
+# hop, relative `Location`), which redirects off to an "article" on
+# 127.0.0.2. every request waits `--latency` ms first. a share of the urls
+# sits on a host that refuses HEAD, so we see the GET fallback too.
+
+# reports urls per second and requests per url, and checks every url
+# ended up on its article without the article itself being requested.
+
+# usage (from the repo root, needs aiohttp):
+#   python3 benchmarks/bench_url_resolver.py -n 5000 -c 64 --latency 50
+
+############
+# IMPORTS
+############
+import os
+import sys
+import time
+import tempfile
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis', 'helpers'))
+from url_resolver import expand
+from url_cache import UrlCache
+
+############
+# FUNCTIONS
+############
+def make_handler(latency:float, hits:list):
+
+    class StandIn(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def respond(self):
+            time.sleep(latency)
+            hits.append(self.path)
+            if self.path.startswith('/nohead/') and self.command=='HEAD':
+                self.send_response(405)
+            elif self.path.startswith('/s/'):
+                self.send_response(301)
+                self.send_header('Location', '/t/'+self.path[3:])
+            elif self.path.startswith(('/t/', '/nohead/')):
+                self.send_response(302)
+                self.send_header('Location', f'http://127.0.0.2:{self.server.server_port}/article/{self.path.split("/")[-1]}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        do_HEAD = respond
+        do_GET = respond
+
+    return StandIn
+
+
+############
+# CLI
+############
+parser = argparse.ArgumentParser(description='Benchmark url_resolver against a local stand-in shortener.')
+
+parser.add_argument("-n", "--n_urls", dest="n_urls",
+                    default=5000, type=int,
+                    help="number of distinct short urls")
+
+parser.add_argument("-c", "--max_concurrent", dest="max_concurrent",
+                    default=64, type=int,
+                    help="requests in flight at once")
+
+parser.add_argument("--latency", dest="latency",
+                    default=50, type=float,
+                    help="milliseconds the stand-in waits before every response")
+
+parser.add_argument("--nohead_share", dest="nohead_share",
+                    default=0.1, type=float,
+                    help="share of urls on a host that refuses HEAD")
+
+args = parser.parse_args()
+
+############
+# THE THING!
+############
+hits = []
+server = ThreadingHTTPServer(('0.0.0.0', 0), make_handler(args.latency/1000, hits))
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base = f'http://127.0.0.1:{server.server_port}'
+
+n_nohead = int(args.n_urls*args.nohead_share)
+urls = [f'{base}/nohead/{i}' if i < n_nohead else f'{base}/s/{i}' for i in range(args.n_urls)]
+
+with tempfile.TemporaryDirectory() as tmp:
+    cache = UrlCache(os.path.join(tmp, 'url_cache.log'))
+    start = time.monotonic()
+    expanded = expand(urls, cache=cache, shorteners={'127.0.0.1'},
+                      max_concurrent=args.max_concurrent, max_per_host=args.max_concurrent)
+    seconds = time.monotonic() - start
+    cache.close()
+
+server.shutdown()
+
+wrong = sum(not url.endswith(f'/article/{i}') for i, url in enumerate(expanded))
+print(f'{args.n_urls} urls, {args.latency:.0f} ms latency, {args.max_concurrent} in flight\n')
+print(f'{"seconds":<20} {seconds:10.2f}')
+print(f'{"urls/s":<20} {args.n_urls/seconds:10.1f}')
+print(f'{"requests/url":<20} {len(hits)/args.n_urls:10.2f}')
+print(f'{"articles requested":<20} {sum(path.startswith("/article/") for path in hits):10,}')
+print(f'{"wrong expansions":<20} {wrong:10,}')
@@ -0,0 +1,185 @@
+# domain_categories.py
+
+# DATA COLLECTION: SHARED
+# labelling urls with the categories of site they point to - streaming,
+# crypto/nft, staying on twitter/reddit, ... the notebooks used to keep
+# these as python lists (`streaming`, `crypto_nft`, `on_reddit_domains`,
+# `streaming_domains`) and check them with `isin`, which only matches
+# exact domains: `foo.blogspot.com` wasn't streaming, `blogspot.com` was.
+
+# the categories live in `domain_categories/`, one text file per category,
+# named after it (`streaming.txt` -> `streaming`). one domain per line,
+# `#` comments, and a `# version: n` line - bump it on every change, so
+# labelled data can say which lists it was labelled with. a domain
+# matches itself and all its subdomains, unless it starts with `=`:
+# `=wordpress.com` is wordpress.com only, not every blog hosted on it.
+
+# all lists get compiled into one trie of reversed labels (`com` ->
+# `blogspot` -> ...). a host gets walked from its last label backwards,
+# picking up the categories of every node it passes that ends a listed
+# domain, plus those of exact-only domains where it stops - one walk,
+# however many categories and domains there are.
+# results are memoized per host.
+
+# no dependencies beyond the standard library, so the collectors can
+# label urls as they come in. `analysis/helpers/domains.py` labels whole
+# url tables with it.
+
+############
+# IMPORTS
+############
+import os
+import re
+import glob
+import logging
+from urllib.parse import urlsplit
+
+############
+# CONSTANTS
+############
+CATEGORIES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'domain_categories')
+CATEGORY_SUFFIX = '.txt'
+
+VERSION_PATTERN = re.compile(r'^#\s*version:\s*(\S+)', re.IGNORECASE)
+DOMAIN_PATTERN = re.compile(r'^[^\s/:@?#*=]+$')
+
+# trie node keys for the categories of the domain ending there, with and
+# without its subdomains - can't be labels
+CATEGORIES = '#'
+EXACT = '='
+
+# hosts we remember results for
+DEFAULT_MEMO_SIZE = 1000000
+
+############
+# FUNCTIONS
+############
+def read_category(path:str):
+    '''
+    (version, domains) of one category file, domains as (domain, exact)
+    pairs - `exact` for the ones marked with `=`. `*.` in front of a
+    domain is allowed and changes nothing.
+    '''
+    version = None
+    domains = []
+    with open(path, 'r', encoding='utf-8') as infile:
+        for n, line in enumerate(infile, 1):
+            line = line.strip()
+            match = VERSION_PATTERN.match(line)
+            if match:
+                version = match.group(1)
+            if not line or line.startswith('#'):
+                continue
+
+            domain = line.lower().rstrip('.')
+            exact = domain.startswith('=')
+            if exact:
+                domain = domain[1:]
+            elif domain.startswith('*.'):
+                domain = domain[2:]
+            if not DOMAIN_PATTERN.match(domain):
+                raise ValueError(f'{path}, line {n}: `{line}` is not a domain.')
+            domains.append((domain, exact))
+
+    if version is None:
+        raise ValueError(f'{path} has no `# version:` line.')
+
+    return version, domains
+
+
+def host_of(url:str) -> str:
+    '''
+    lowercased host of `url`, without port or trailing dot. None if it has none.
+    '''
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    return host[:-1] if host.endswith('.') else host
+
+
+############
+# THE THING!
+############
+class DomainClassifier:
+
+    def __init__(self, categories_dir:str=CATEGORIES_DIR, categories:list=None, memo_size:int=DEFAULT_MEMO_SIZE):
+        '''
+        args:
+            - categories_dir: str, dir with one `<category>.txt` per category
+            - categories: list of category names to load, all if None
+            - memo_size: int, distinct hosts we remember results for. the
+              memo gets emptied when it's full.
+        '''
+        self.root = {}
+        self.versions = {}
+        self.memo_size = memo_size
+        self.memo = {}
+
+        paths = sorted(glob.glob(os.path.join(categories_dir, '*'+CATEGORY_SUFFIX)))
+        available = {os.path.basename(path)[:-len(CATEGORY_SUFFIX)]: path for path in paths}
+        if categories is None:
+            categories = list(available)
+        missing = [category for category in categories if category not in available]
+        if missing:
+            raise ValueError(f'no category file for {missing} in {categories_dir}.')
+
+        for category in categories:
+            version, domains = read_category(available[category])
+            self.versions[category] = version
+            for domain, exact in domains:
+                self.add(category, domain, exact=exact)
+
+        logging.info(f'domain categories: {self.versions}')
+
+    @property
+    def categories(self) -> list:
+        return list(self.versions)
+
+    def add(self, category:str, domain:str, exact:bool=False):
+        node = self.root
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, {})
+        node.setdefault(EXACT if exact else CATEGORIES, set()).add(category)
+        self.memo.clear()
+
+    def classify_host(self, host:str) -> tuple:
+        '''
+        the categories of a (lowercased) host, sorted. () for none.
+        '''
+        found = self.memo.get(host)
+        if found is not None:
+            return found
+
+        matched = set()
+        node = self.root
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            matched.update(node.get(CATEGORIES, ()))
+        else:
+            matched.update(node.get(EXACT, ()))
+        found = tuple(sorted(matched))
+
+        if len(self.memo) >= self.memo_size:
+            self.memo.clear()
+        self.memo[host] = found
+
+        return found
+
+    def classify_url(self, url:str) -> tuple:
+        host = host_of(url)
+        return self.classify_host(host) if host else ()
+
+    def classify_urls(self, urls:list) -> list:
+        '''
+        the categories of any of `urls`, sorted - e.g. for a tweet's `urls`
+        '''
+        matched = set()
+        for url in urls:
+            matched.update(self.classify_url(url))
+
+        return sorted(matched)
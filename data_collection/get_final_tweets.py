@@ -2,13 +2,13 @@
 # get_final_tweets.py
 
 # DATA COLLECTION: TWITTER
-# pulling all the relevant tweets for the world cup final 
-# on 18/12/22 -- retroactively as there was an issue with 
+# pulling all the relevant tweets for the world cup final
+# on 18/12/22 -- retroactively as there was an issue with
 # the server during target collection
 
-# we will achieve this by wrapping a bunch of shell-commands
-# called through os.system in order to loop over our
-# `get_tweets_search.py` script with our target params.
+# we will achieve this by running consecutive search windows
+# through the `SearchScheduler` in `search_scheduler.py`: all windows
+# run concurrently in this process, on one client and rate-limit budget.
 
 # NL, 19/12/22 -- adapting from `get_mers_tweets.py` -- abandoned for now
 
@@ -16,8 +16,13 @@
 # IMPORTS
 ############
 import os
+import sys
+from dotenv import load_dotenv
 from dateutil import parser as date_parser
 import datetime
+import logging
+from rate_limit import GovernedClient
+from search_scheduler import SearchScheduler, build_queries, build_windows
 
 ############
 # PATHS & CONSTANTS
@@ -27,57 +32,50 @@ META_DIR = '/home/nikloynes/projects/world_cup_misinfo_tracking/data/tweets_meta
 SEARCH_TERMS = '/home/nikloynes/projects/world_cup_misinfo_tracking/data_collection/twitter_search_terms.txt'
 N_ITS = 8
 START_DATE = '2022-12-18'
-DT_START_DATE = date_parser.parse(START_DATE) 
 START_TIME = '14:00'
-DELTA = 60
-DELTA_UNIT = 'hours'
+DELTA = datetime.timedelta(hours=60)
+MAX_CONCURRENT = 4
 
-# dict of chunks
-# we are going to use the abbreviated cli flags for the 
-# script get_tweets_search.py here.
+# DATETIME STUFF
+TODAY = datetime.datetime.now().strftime('%Y_%m_%d-%H_%M_%S')
 
-time_chunks = []
-for i in range(N_ITS):
-    # format our delta
-    if DELTA_UNIT=='hours':
-        delta = datetime.timedelta(hours=DELTA)
-    elif DELTA_UNIT=='minutes':
-        delta = datetime.timedelta(minutes=DELTA)
-    elif DELTA_UNIT=='seconds':
-        delta = datetime.timedelta(seconds=DELTA)
+# logging
+LOG_FILE_PATH = f'../data/logfiles/twitter/final_search_{TODAY}.log'
+LOG_FORMAT = '%(asctime)s [%(filename)s:%(lineno)s - %(funcName)20s() ] - %(name)s - %(levelname)s - %(message)s'
 
-    # format our date
-    tmp_date = (DT_START_DATE+delta).strftime('%Y_%m_%d')
-    tmp_date2 = (DT_START_DATE+delta).strftime('%Y-%m-%d')
+############
+# INIT
+############
+load_dotenv()
+bearer_token = os.getenv('TWITTER_BEARER_TOKEN')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format=LOG_FORMAT,
+    handlers=[logging.FileHandler(filename=LOG_FILE_PATH), logging.StreamHandler(sys.stdout)])
 
-    tmp = {
-        '-d' : tmp_date2,
-        '-t' : START_TIME,
-        '-e' : DELTA,
-        '-u' : DELTA_UNIT,
-        '-s' : SEARCH_TERMS,
-        '-o' : f'{TWEETS_DIR}tweets_{tmp_date}-.json',
-        '-m' : META_DIR
-    }
+for path in [TWEETS_DIR, META_DIR]:
+    if not os.path.isdir(path):
+        os.makedirs(path)
 
-    if date_parser.parse(f'{tmp_date2}-{START_TIME}') > datetime.datetime.now():
-        tmp['-d'] = datetime.datetime.now().strftime('%Y-%m-%d')
-        tmp['-t'] = (datetime.datetime.now()-datetime.timedelta(hours=2)).strftime('%H:%M')
-    
-    time_chunks.append(tmp)
+# N_ITS consecutive windows of DELTA each, one tweet file per window
+time_chunks = build_windows(start=date_parser.parse(f'{START_DATE} {START_TIME}'),
+                            window=DELTA,
+                            count=N_ITS,
+                            tweets_dir=TWEETS_DIR,
+                            meta_dir=META_DIR)
+
+############
+# THE THING!
+############
+client = GovernedClient(bearer_token=bearer_token, wait_on_rate_limit=True)
 
-for day in time_chunks:
-    cmd = f"""python3 get_tweets_search.py 
-    -d {day["-d"]} 
-    -t {day["-t"]} 
-    -e {day["-e"]} 
-    -u {day["-u"]}
-    -s {day["-s"]}
-    -o {day["-o"]}
-    -m {day["-m"]}
-    """
-    cmd = cmd.replace('\n', '').replace('    ', ' ')
+scheduler = SearchScheduler(client=client,
+                            query=build_queries(SEARCH_TERMS),
+                            windows=time_chunks,
+                            max_concurrent=MAX_CONCURRENT)
+report = scheduler.run()
 
-    res = os.system(cmd)
-    if res != 0:
-        raise ValueError(f'There was an error while running get_mers_tweets.py - check logfiles.')
\ No newline at end of file
+failed = [window for window in report if window['status']!='done']
+if failed:
+    raise ValueError(f'{len(failed)} windows failed while running get_final_tweets.py - check logfiles: {failed}')
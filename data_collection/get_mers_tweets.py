@@ -2,12 +2,12 @@
 # get_mers_tweets.py
 
 # DATA COLLECTION: TWITTER
-# as part of our project, we're keen to get all 'mers'-related 
-# tweets for the week starting 10/12/22. 
+# as part of our project, we're keen to get all 'mers'-related
+# tweets for the week starting 10/12/22.
 
-# we will achieve this by wrapping a bunch of shell-commands
-# called through os.system in order to loop over our
-# `get_tweets_search.py` script with our target params.
+# we will achieve this by running one search window per day
+# through the `SearchScheduler` in `search_scheduler.py`: all windows
+# run concurrently in this process, on one client and rate-limit budget.
 
 # NL, 17/12/22
 # NL, 19/12/22 -- slightly amending this to pull some missing tweets.
@@ -18,8 +18,13 @@
 # IMPORTS
 ############
 import os
+import sys
+from dotenv import load_dotenv
 from dateutil import parser as date_parser
 import datetime
+import logging
+from rate_limit import GovernedClient
+from search_scheduler import SearchScheduler, build_queries, build_windows
 
 ############
 # PATHS & CONSTANTS
@@ -29,49 +34,53 @@ META_DIR = '/home/nikloynes/projects/world_cup_misinfo_tracking/data/mers_tweets
 SEARCH_TERMS = '/home/nikloynes/projects/world_cup_misinfo_tracking/data_collection/mers_search_terms.txt'
 N_DAYS = 2
 START_DATE = '2022-12-16'
-DT_START_DATE = date_parser.parse(START_DATE) 
 START_TIME = '18:00'
-DELTA = 24
-DELTA_UNIT = 'hours'
+DELTA = datetime.timedelta(hours=24)
+MAX_CONCURRENT = 4
 
-# dict of chunks
-# we are going to use the abbreviated cli flags for the 
-# script get_tweets_search.py here.
+# DATETIME STUFF
+TODAY = datetime.datetime.now().strftime('%Y_%m_%d-%H_%M_%S')
 
-time_chunks = []
-for i in range(N_DAYS):
-    # format our date
-    tmp_date = (DT_START_DATE+datetime.timedelta(i)).strftime('%Y_%m_%d')
-    tmp_date2 = (DT_START_DATE+datetime.timedelta(i)).strftime('%Y-%m-%d')
+# logging
+LOG_FILE_PATH = f'../data/logfiles/twitter/mers_search_{TODAY}.log'
+LOG_FORMAT = '%(asctime)s [%(filename)s:%(lineno)s - %(funcName)20s() ] - %(name)s - %(levelname)s - %(message)s'
 
-    tmp = {
-        '-d' : tmp_date2,
-        '-t' : START_TIME,
-        '-e' : DELTA,
-        '-u' : DELTA_UNIT,
-        '-s' : SEARCH_TERMS,
-        '-o' : f'{TWEETS_DIR}mers_tweets_{tmp_date}.json',
-        '-m' : META_DIR
-    }
+############
+# INIT
+############
+load_dotenv()
+bearer_token = os.getenv('TWITTER_BEARER_TOKEN')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format=LOG_FORMAT,
+    handlers=[logging.FileHandler(filename=LOG_FILE_PATH), logging.StreamHandler(sys.stdout)])
+
+for path in [TWEETS_DIR, META_DIR]:
+    if not os.path.isdir(path):
+        os.makedirs(path)
 
-    if date_parser.parse(f'{tmp_date2}-{START_TIME}') > datetime.datetime.now():
-        tmp['-d'] = datetime.datetime.now().strftime('%Y-%m-%d')
-        tmp['-t'] = (datetime.datetime.now()-datetime.timedelta(hours=2)).strftime('%H:%M')
-    
-    time_chunks.append(tmp)
+# one window per day. windows reaching into the future get clipped
+# to now by the scheduler.
+time_chunks = build_windows(start=date_parser.parse(f'{START_DATE} {START_TIME}'),
+                            window=DELTA,
+                            count=N_DAYS,
+                            tweets_dir=TWEETS_DIR,
+                            meta_dir=META_DIR,
+                            prefix='mers_tweets_',
+                            stamp_format='%Y_%m_%d')
+
+############
+# THE THING!
+############
+client = GovernedClient(bearer_token=bearer_token, wait_on_rate_limit=True)
 
-for day in time_chunks:
-    cmd = f"""python3 get_tweets_search.py 
-    -d {day["-d"]} 
-    -t {day["-t"]} 
-    -e {day["-e"]} 
-    -u {day["-u"]}
-    -s {day["-s"]}
-    -o {day["-o"]}
-    -m {day["-m"]}
-    """
-    cmd = cmd.replace('\n', '').replace('    ', ' ')
+scheduler = SearchScheduler(client=client,
+                            query=build_queries(SEARCH_TERMS),
+                            windows=time_chunks,
+                            max_concurrent=MAX_CONCURRENT)
+report = scheduler.run()
 
-    res = os.system(cmd)
-    if res != 0:
-        raise ValueError(f'There was an error while running get_mers_tweets.py - check logfiles.')
\ No newline at end of file
+failed = [window for window in report if window['status']!='done']
+if failed:
+    raise ValueError(f'{len(failed)} windows failed while running get_mers_tweets.py - check logfiles: {failed}')
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# get_reddit_comments.py
+
+# DATA COLLECTION: REDDIT
+# pulling the comments of selected reddit submissions - e.g. the match
+# threads in r/worldcup, where a lot of the misinformation lives.
+
+# submissions get selected either from a file of submission ids, or from
+# the posts we've collected with `get_reddit_posts.py` (by number of
+# comments and/or a title pattern). the actual collecting happens in
+# `reddit_comments.py`: several submissions at once, comments written out
+# as they come in.
+
+############
+# IMPORTS
+############
+import os
+import re
+import sys
+import glob
+import json
+import argparse
+import asyncio
+from dotenv import load_dotenv
+import logging
+import datetime as dt
+from reddit_comments import collect_comments, DEFAULT_REPLACE_MORE
+from reddit_authors import AuthorCache
+
+############
+# FUNCTIONS
+############
+def select_submissions(posts_path:str, min_comments:int=0, title_pattern:str=None) -> list:
+    '''
+    ids of the posts in our collected post files (one dir per sub, see
+    `get_reddit_posts.py`) with at least `min_comments` comments and, if
+    given, a title matching `title_pattern` (case-insensitive)
+    '''
+    pattern = re.compile(title_pattern, re.IGNORECASE) if title_pattern else None
+
+    ids = []
+    seen = set()
+    for path in sorted(glob.glob(os.path.join(posts_path, '*', '*.json'))):
+        with open(path, 'r') as infile:
+            for line in infile:
+                post = json.loads(line)
+                if post['id'] in seen:
+                    continue
+                if post.get('num_comments', 0) < min_comments:
+                    continue
+                if pattern is not None and not pattern.search(post.get('title') or ''):
+                    continue
+                seen.add(post['id'])
+                ids.append(post['id'])
+
+    return ids
+
+
+############
+# CLI
+############
+parser = argparse.ArgumentParser(description='Parameters for pulling reddit comments.')
+
+parser.add_argument("-i", "--ids_file", dest = "ids_file",
+                    default=None,
+                    help="""a text file containing reddit submission ids,
+                    separated by newlines. if not set, submissions get
+                    selected from posts_path.""")
+
+parser.add_argument("-p", "--posts_path", dest = "posts_path",
+                    default="../data/reddit_posts/",
+                    help="directory holding our collected reddit posts")
+
+parser.add_argument("-m", "--min_comments", dest = "min_comments",
+                    default=0,
+                    help="only pull submissions with at least this many comments")
+
+parser.add_argument("-t", "--title_pattern", dest = "title_pattern",
+                    default=None,
+                    help="""only pull submissions whose title matches this
+                    regex (case-insensitive), e.g. 'match thread'""")
+
+parser.add_argument("-o", "--out_path", dest = "out_path",
+                    default="../data/reddit_comments/",
+                    help="directory to which to write reddit comments")
+
+parser.add_argument("-r", "--replace_more", dest = "replace_more",
+                    default=DEFAULT_REPLACE_MORE,
+                    help="""max number of 'load more comments' stubs to expand
+                    per submission. -1 expands all of them.""")
+
+parser.add_argument("--threshold", dest = "threshold",
+                    default=0,
+                    help="""only expand 'load more comments' stubs standing for
+                    at least this many comments.""")
+
+parser.add_argument("-c", "--max_concurrent", dest = "max_concurrent",
+                    default=4,
+                    help="number of submissions to collect at once")
+
+parser.add_argument("-l", "--log_to_stdout", dest = "log_to_stdout",
+					action = "store_true",
+					help= """a flag that indicates whether to print logging
+					messages to stdout as well as file.""")
+
+args = parser.parse_args()
+
+############
+# PATHS & CONSTANTS
+############
+OUT_PATH = os.path.join(args.out_path, '')
+if not os.path.isdir(OUT_PATH):
+    os.mkdir(OUT_PATH)
+
+# DATETIME STUFF
+DT_TODAY = dt.datetime.now()
+TODAY = DT_TODAY.strftime('%Y_%m_%d-%H_%M_%S')
+
+OUTFILE = OUT_PATH+f'comments_{TODAY}.json'
+
+# logging
+LOG_FILE_PATH = f'../data/logfiles/reddit/comments_{TODAY}.log'
+LOG_FORMAT = '%(asctime)s [%(filename)s:%(lineno)s - %(funcName)20s() ] - %(name)s - %(levelname)s - %(message)s'
+
+############
+# INIT
+############
+load_dotenv()
+
+# Logger
+file_handler = logging.FileHandler(filename=LOG_FILE_PATH)
+stdout_handler = logging.StreamHandler(sys.stdout)
+
+if args.log_to_stdout:
+	handlers = [file_handler, stdout_handler]
+else:
+	handlers = [file_handler]
+
+logging.basicConfig(
+    level=logging.INFO,
+    format=LOG_FORMAT,
+    handlers=handlers)
+
+logger = logging.getLogger('LOGGER')
+
+# which submissions to pull comments for
+if args.ids_file:
+    with open(args.ids_file, 'r') as infile:
+        submission_ids = [line.strip() for line in infile if line.strip()]
+else:
+    submission_ids = select_submissions(args.posts_path,
+                                        min_comments=int(args.min_comments),
+                                        title_pattern=args.title_pattern)
+logging.info(f'pulling comments for {len(submission_ids)} submissions into {OUTFILE}')
+
+############
+# THE THING!
+############
+reddit_kwargs = {
+    'client_id': os.getenv('REDDIT_ID'),
+    'client_secret': os.getenv('REDDIT_SECRET'),
+    'user_agent': os.getenv('REDDIT_USER_AGENT'),
+    'username': os.getenv('REDDIT_USERNAME'),
+    'password': os.getenv('REDDIT_PASSWORD')
+}
+
+replace_more = int(args.replace_more)
+report = asyncio.run(collect_comments(submission_ids,
+                                      outfile=OUTFILE,
+                                      reddit_kwargs=reddit_kwargs,
+                                      max_concurrent=int(args.max_concurrent),
+                                      replace_more=None if replace_more < 0 else replace_more,
+                                      threshold=int(args.threshold),
+                                      cache=AuthorCache()))
+
+failed = [stats for stats in report if stats['status']!='done']
+if failed:
+    logging.error(f'{len(failed)} submissions failed: {failed}')
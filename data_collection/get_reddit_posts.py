@@ -14,115 +14,76 @@
 
 # NL, 29/11/22
 
+# with `--async`, all subreddits get collected concurrently on one client
+# (see `reddit_async.py`), with no sleeps between them. with `--stream`,
+# we keep a submission stream open across all subreddits instead of
+# polling from cron (see `reddit_stream.py`). otherwise, they're collected
+# one by one, as before - with `--sweep`, from several listings per sub
+# rather than just `new` (see `reddit_sweep.py`).
+
 ############
 # IMPORTS
 ############
 import os
 import sys
 import argparse
+import asyncio
 from dotenv import load_dotenv
-import json
 import logging
 import datetime as dt
 from dateutil import parser as date_parser
 import praw
-from prawcore.exceptions import NotFound
 from time import sleep
+from jsonl_writer import JsonlWriter
+from manifest import coverage
+from reddit_normalization import reddit_post_to_dict
+from reddit_authors import AuthorCache, BULK_LIMIT
+from reddit_sweep import sweep, known_ids, coverage_report
 
 ############
 # FUNCTIONS
 ############
-def get_user_attribute(user:praw.models.reddit.redditor.Redditor,
-                       attribute:str):
-    '''  
-    helper function for getting user-level attributes from a praw
-    redditor object. this function avoids breaking code due to 
-    missing attributes when throwing an attribute error
-    '''
-    try:
-        val = getattr(user, attribute, None)
-    except NotFound:
-        val = None
-        
-    return val
-
-
-def reddit_post_to_dict(post:praw.models.reddit.submission.Submission,
-                        custom_fields:list=None,
-                        overwrite_core_fields:bool=False,
-                        convert_timestamp:bool=True) -> dict:
+def extract_newest_date(sub_dir:str) -> dt.datetime:
     '''
-    function that converts an object of the praw.submission type
-    into a dict. this is useful primarily in order to serialise this
-    to json and write out to file.
-
-    args:
-        - post, a submission ('post') in a subreddit retrieved via praw
-        - custom_fields, a list of strings containing additional fields returned by 
-          praw which are to be retained
-        - overwrite_core_fields, bool, indicates whether core (standard) fields
-          of the output dict are to be retained, or whether they should be replaced
-          entirely by 'custom_fields'
-    '''    
-    if not isinstance(post, praw.models.reddit.submission.Submission):
-        raise TypeError('post must be a praw submission object')
-
-    if overwrite_core_fields:
-        if not custom_fields:
-            raise ValueError('custom_fields is not defined')
-
-    core_fields = ['id', 'created_utc', 'title', 'selftext', 'domain', 'url', 'num_comments', 'score', 'ups', 'downs', 'author']
-    if overwrite_core_fields:
-        core_fields = custom_fields
-    elif isinstance(custom_fields, list) and len(custom_fields)>0:
-        core_fields += custom_fields
-
-    core_user_fields = ['name', 'id', 'total_karma', 'verified', 'created_utc']
-
-    tmp_dict = vars(post)
-    out = {field:tmp_dict[field] for field in core_fields if field in tmp_dict.keys()}
-
-    if 'created_utc' in out.keys():
-        if convert_timestamp:
-            out['created_utc'] = dt.datetime.fromtimestamp(out['created_utc']).strftime('%Y/%m/%d %H:%M:%S')
-
-    if 'author' in out.keys():
-        # we will now process the author object and append to our out object
-        user_dict = {'user_'+field:get_user_attribute(user=post.author, attribute=field) for field in core_user_fields}
-        
-        del out['author']
-
-        out.update(user_dict)
-
-        if convert_timestamp:
-            if 'user_created_utc' in out.keys() and isinstance(out['user_created_utc'], float):
-                out['user_created_utc'] = dt.datetime.fromtimestamp(out['user_created_utc']).strftime('%Y/%m/%d %H:%M:%S')
-
-    return out
-
-
-def extract_newest_date_from_json(reddit_post_json:str) -> dt.datetime:
-    ''' 
     when we re-start collecting reddit post data, 
     we want to make sure we don't collect any posts we've already
     retrieved. so, we'll get the date/time of when the most recently
-    collected post was published.
+    collected post was published - from the files' manifests, without
+    opening the files themselves (see `manifest.py`).
 
     args:  
-        - reddit_post_json: full filepath to the json we want to 
-          extract a date from.  
+        - sub_dir: the subreddit's out dir
+
+    returns:
+        - the newest post's datetime, None if there are no posts yet
     '''
-    if not os.path.isfile(reddit_post_json):
-        raise ValueError(f'{reddit_post_json} is not a valid file. Please supply a valid reddit json file')
+    newest = coverage(sub_dir, build_missing=True, time_field='created_utc')['max_time']
+    if newest is None:
+        return None
 
-    with open(reddit_post_json, 'r') as infile:
-        for line in infile:
-            tmp = json.loads(line)
-            break
+    return date_parser.parse(newest)
+
+
+def write_posts(posts:list,
+                writer:JsonlWriter,
+                outfile:str,
+                reddit:praw.Reddit,
+                cache:AuthorCache) -> JsonlWriter:
+    '''
+    writes a batch of posts, with their authors' fields resolved through
+    `cache` in bulk. opens the writer on the first batch, so we don't
+    leave empty files.
 
-    date = date_parser.parse(tmp['created_utc'])
+    returns:
+        - the (now open) writer
+    '''
+    authors = cache.resolve(reddit, posts)
+    if writer is None:
+        writer = JsonlWriter(outfile, time_field='created_utc')
+    for post in posts:
+        writer.write(reddit_post_to_dict(post, authors=authors))
 
-    return date
+    return writer
 
 
 ############
@@ -140,6 +101,55 @@ parser.add_argument("-o", "--out_path", dest = "out_path",
                     default="../data/reddit_posts/",
                     help="directory to which to write reddit posts")
 
+parser.add_argument("-a", "--async", dest = "async_mode",
+                    action = "store_true",
+                    help="""a flag that indicates whether to collect all
+                    subreddits concurrently (needs asyncpraw), rather than
+                    one after the other.""")
+
+parser.add_argument("-c", "--max_concurrent", dest = "max_concurrent",
+                    default=0,
+                    help="""in async mode, max number of subreddits to
+                    collect at once. 0 collects all of them at once.""")
+
+parser.add_argument("--stream", dest = "stream_mode",
+                    action = "store_true",
+                    help="""a flag that indicates whether to keep streaming
+                    new posts from all subreddits, rather than collecting
+                    what's new once.""")
+
+parser.add_argument("-r", "--rotate_minutes", dest = "rotate_minutes",
+                    default=60,
+                    help="""in stream mode, start new files every n minutes
+                    (on the clock).""")
+
+parser.add_argument("-k", "--kill_time", dest = "kill_time",
+                    default=0,
+                    help="""in stream mode, stop after this many minutes.
+                    0 streams until stopped.""")
+
+parser.add_argument("--state_file", dest = "state_file",
+                    default=None,
+                    help="""in stream mode, file recording where we're up to
+                    in every subreddit. defaults to stream_state.json in
+                    out_path.""")
+
+parser.add_argument("--sweep", dest = "sweep_mode",
+                    action = "store_true",
+                    help="""a flag that indicates whether to go through the
+                    hot, rising, top and controversial listings as well as
+                    new, to get past the 1000 post cap of a single listing.""")
+
+parser.add_argument("--sweep_days", dest = "sweep_days",
+                    default=3,
+                    help="""in sweep mode, also pick up posts we missed in
+                    this many days before the newest post we've got.""")
+
+parser.add_argument("--author_ttl", dest = "author_ttl",
+                    default=24,
+                    help="""hours for which cached author fields (karma etc.)
+                    are reused before being fetched again.""")
+
 parser.add_argument("-l", "--log_to_stdout", dest = "log_to_stdout", 
 					action = "store_true",
 					help= """a flag that indicates whether to print logging 
@@ -201,28 +211,21 @@ for sub in subreddits:
     else:
         logging.info(f'sub-level out-dir {OUT_PATH+sub} already exists.')
         # now getting our cutoff dates for newly incoming posts
-        already_collected = os.listdir(OUT_PATH+sub+'/')
-        if len(already_collected)>0:
-            already_collected.sort(key=lambda x: os.path.getmtime(OUT_PATH+sub+'/'+x))
-            cutoff = extract_newest_date_from_json(OUT_PATH+sub+'/'+already_collected[-1])
-        else:
-            cutoff = MIN_DATE
+        cutoff = extract_newest_date(OUT_PATH+sub+'/') or MIN_DATE
         sub_newest_posts.update({sub : cutoff})
         logging.info(f'cutoff date for newly incoming posts in {sub}: {cutoff}')
-        logging.info(f'number of files in {OUT_PATH+sub}: {len(already_collected)}.')
     sub_out_paths.update({sub : OUT_PATH+sub+'/'})
 
 ############
 # THE THING!
 ############
-# let's start by instantiating our reddit instance
-reddit = praw.Reddit(
-    client_id=os.getenv('REDDIT_ID'),
-    client_secret=os.getenv('REDDIT_SECRET'),
-    user_agent=os.getenv('REDDIT_USER_AGENT'),
-    username=os.getenv('REDDIT_USERNAME'),
-    password=os.getenv('REDDIT_PASSWORD')
-)
+reddit_kwargs = {
+    'client_id': os.getenv('REDDIT_ID'),
+    'client_secret': os.getenv('REDDIT_SECRET'),
+    'user_agent': os.getenv('REDDIT_USER_AGENT'),
+    'username': os.getenv('REDDIT_USERNAME'),
+    'password': os.getenv('REDDIT_PASSWORD')
+}
 
 # just some logging for potential debugging... 
 logging.info('sub_out_paths:')
@@ -231,25 +234,82 @@ logging.info(sub_out_paths)
 logging.info('sub_date_cutoffs:')
 logging.info(sub_newest_posts)
 
+# author fields for every post, shared by all subs and runs
+author_cache = AuthorCache(ttl=float(args.author_ttl)*60*60)
+
+if args.stream_mode:
+    from reddit_stream import StreamState, stream_subreddits
+
+    stream_subreddits(praw.Reddit(**reddit_kwargs),
+                      subreddits,
+                      out_dirs=sub_out_paths,
+                      state=StreamState(args.state_file or OUT_PATH+'stream_state.json'),
+                      cutoffs=sub_newest_posts,
+                      cache=author_cache,
+                      rotate_minutes=int(args.rotate_minutes),
+                      kill_time=float(args.kill_time))
+    sys.exit(0)
+
+if args.async_mode:
+    # imported here, so the sequential mode doesn't need asyncpraw
+    from reddit_async import collect_subreddits
+
+    report = asyncio.run(collect_subreddits(subreddits,
+                                            outfiles={sub: sub_out_paths[sub]+sub+'_'+TODAY+'.json' for sub in subreddits},
+                                            cutoffs=sub_newest_posts,
+                                            reddit_kwargs=reddit_kwargs,
+                                            max_concurrent=int(args.max_concurrent),
+                                            cache=author_cache))
+    for stats in report:
+        logging.info(f'subreddit stats: {stats}')
+    sys.exit(0)
+
+# let's start by instantiating our reddit instance
+reddit = praw.Reddit(**reddit_kwargs)
+
+sweep_reports = {}
 for sub in subreddits:
     # start by creating the cursor
     logging.info(f'now collecting posts in subreddit {sub}')
-    res = reddit.subreddit(sub).new(limit=1000)
+    if args.sweep_mode:
+        # everything since the cutoff, plus whatever we missed shortly before it
+        since = min(sub_newest_posts[sub], DT_TODAY - dt.timedelta(days=float(args.sweep_days)))
+        sweep_reports[sub] = {}
+        res = sweep(reddit.subreddit(sub), known_ids(sub_out_paths[sub], since), since, sweep_reports[sub])
+    else:
+        res = reddit.subreddit(sub).new(limit=1000)
 
     sub_counter = 0
     outfile = sub_out_paths[sub]+sub+'_'+TODAY+'.json'
+    writer = None
+    # posts wait here until we've got their authors' fields in bulk
+    batch = []
     for post in res:
-        # first check our time-cutoff:
-        if dt.datetime.fromtimestamp(post.created) < sub_newest_posts[sub]:
+        # first check our time-cutoff (a sweep does its own):
+        if not args.sweep_mode and dt.datetime.fromtimestamp(post.created) < sub_newest_posts[sub]:
             logging.info(f'no new posts retrievable from {sub}. moving on to next sub.')
             break
-        else:
-            tmp = reddit_post_to_dict(post)
-            with open(outfile, 'a') as o:
-                o.write(json.dumps(tmp)+'\n')
-            sub_counter += 1
+        batch.append(post)
+
+        if len(batch) >= BULK_LIMIT:
+            writer = write_posts(batch, writer, outfile, reddit, author_cache)
+            sub_counter += len(batch)
+            batch = []
+
+    if batch:
+        writer = write_posts(batch, writer, outfile, reddit, author_cache)
+        sub_counter += len(batch)
+
+    if writer is not None:
+        writer.close()
 
     logging.info(f'collected a total of {sub_counter} posts for {sub}.')
     logging.info(f'Now sleeping before moving onto next sub.')
     sleep(30)
 
+if args.sweep_mode:
+    # how much each listing added on top of the ones before it
+    for name, stats in coverage_report(sweep_reports).items():
+        logging.info(f'sweep coverage of {name}: {stats}')
+
+author_cache.log_stats()
@@ -17,116 +17,12 @@ import os
 import sys
 from dotenv import load_dotenv
 import argparse
-import json
 import logging
-import re
 import datetime
-import tweepy
-
-############
-# FUNCTIONS
-############
-def check_path_exists(filepath:str):
-    '''
-    checks if a supplied filepath 
-    (dir + filename) exists. if the full path
-    with file is not a file, checks for 
-    just the dir path and creates file if exists, 
-    raises error if not
-    
-    args:
-        - filepath: str, full file path
-    '''
-    if filepath is None:
-        raise TypeError(f'specified path is None.')
-
-    if not isinstance(filepath, str):
-        raise TypeError(f'filepath object must be\
-            str. Please re-specify.')
-
-    if os.path.isdir(filepath):
-        raise ValueError(f'Need to provide a full path to a file,\
-            not a dir.')
-
-    if not os.path.isfile(filepath):
-        # split and check if everything before the last 
-        # `/` is a dir
-        splits = filepath.split('/')
-        concat = '/'.join(splits[:-1])+'/'
-        if not os.path.isdir(concat):
-            raise NotADirectoryError(f'Directory path \
-                {concat} does not exist. Please re-specify\
-                    `out_path`.')
-        else:
-            logging.info(f'{concat}, the dir in for\
-                specified filepath is a directory, but\
-                    file {splits[-1:]} does not exist.\
-                        Thats fine for us.')
-            return filepath
-    
-    else: 
-        return filepath
-
-
-def extract_count_domains_entities(context_field:list):
-    '''
-    entracts the counts of domains and entities in 
-    a given tweet.
-
-    returns:
-        - domains, dict
-        - entities, dict
-    '''
-    domains = {}
-    entities = {}
-
-    for context in context_field:
-        # domain
-        if context['domain']['name'] not in domains.keys():
-            domains[context['domain']['name']] = 1
-        else:
-            domains[context['domain']['name']] += 1
-
-        # entity
-        if context['entity']['name'] not in entities.keys():
-            entities[context['entity']['name']] = 1
-        else:
-            entities[context['entity']['name']] += 1
-
-    return domains, entities
-
-
-def total_domain_entity_counts(domains_tweet:dict,
-                               domains_session:dict,
-                               entities_tweet:dict,
-                               entities_session:dict):
-    ''' 
-    accumulates counts for domains and entities
-    for the entire streaming session.  
-    '''
-    for domain in domains_tweet.keys():
-        if domain not in domains_session.keys():
-            domains_session[domain] = 1
-        else:
-            domains_session[domain] += 1
-
-    for entity in entities_tweet.keys():
-        if entity not in entities_session.keys():
-            entities_session[entity] = 1
-        else:
-            entities_session[entity] += 1
-
-    return domains_session, entities_session
-
-
-def extract_urls(tweet_text:str) -> list:
-    '''
-    extracts urls from tweet text
-    returns all urls in tweet text in list
-    '''
-    urls = re.findall("http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+", tweet_text)
-
-    return urls
+from stream_supervisor import TweetStreamer
+from domain_categories import DomainClassifier
+from stream_rules import sync_rules
+from query_planner import read_terms
 
 ############
 # CLI 
@@ -157,6 +53,57 @@ parser.add_argument("-t", "--time_unit", dest = "time_unit",
                     help="""measurement of time for the kill-time
                     parameter - either `minutes` or `seconds`""")
 
+parser.add_argument("-p", "--persistent", dest = "persistent",
+                    action = "store_true",
+                    help="""stream until stopped instead of for `kill_time`,
+                    rotating the tweet file (and domain/entity counts)
+                    every `rotate_minutes`.""")
+
+parser.add_argument("-r", "--rotate_minutes", dest = "rotate_minutes",
+                    default=60,
+                    help="""in persistent mode, start a new tweet file every
+                    this many minutes, on the clock (60: on the hour).""")
+
+parser.add_argument("--rotate_mb", dest = "rotate_mb",
+                    default=0,
+                    help="""if set, also start a new tweet file once the
+                    current one holds this many MB.""")
+
+parser.add_argument("-b", "--backfill_minutes", dest = "backfill_minutes",
+                    default=0,
+                    help="""minutes of tweets to backfill when reconnecting
+                    after a dropped connection (needs academic research
+                    access).""")
+
+parser.add_argument("-w", "--workers", dest = "workers",
+                    default=0,
+                    help="""number of processing worker threads. 0 (default)
+                    processes every tweet on the streaming thread; anything
+                    above 0 only enqueues tweets there.""")
+
+parser.add_argument("-q", "--max_queue", dest = "max_queue",
+                    default=10000,
+                    help="""max number of raw tweets held in memory in
+                    worker mode before spilling to disk.""")
+
+parser.add_argument("--top_k", dest = "top_k",
+                    default=0,
+                    help="""if set, count session domains/entities with a
+                    memory-bounded top-k counter tracking at most this many
+                    of each, instead of exact (unbounded) dicts.""")
+
+parser.add_argument("--classify_urls", dest = "classify_urls",
+                    action = "store_true",
+                    help="""a flag to label every tweet with the categories
+                    (streaming, crypto_nft, ...) of its urls, see
+                    domain_categories.py.""")
+
+parser.add_argument("--max_rules", dest = "max_rules",
+                    default=5,
+                    help="""max number of stream rules our api access level
+                    allows (5 for essential, 25 for elevated). our search
+                    terms get packed into at most this many rules.""")
+
 parser.add_argument("-l", "--log_to_stdout", dest = "log_to_stdout", 
 					action = "store_true",
 					help= """a flag that indicates whether to print logging 
@@ -173,12 +120,6 @@ KILL_TIME = args.kill_time
 
 SEARCH_TERMS = args.search_terms
 
-# fields to return in tweets
-EXPANSTIONS = ['author_id', 'referenced_tweets.id']
-TWEET_FIELDS = ['created_at', 'public_metrics', 'source', 'context_annotations']
-MEDIA_FIELDS = ['media_key', 'type', 'url', 'duration_ms']
-USER_FIELDS = ['id', 'name', 'username', 'created_at', 'description', 'location', 'public_metrics']
-
 # check our out dirs exist - create if no
 if not os.path.isdir(TWEETS_DIR):
     os.mkdir(TWEETS_DIR)
@@ -189,9 +130,6 @@ if not os.path.isdir(META_DIR):
 # DATETIME STUFF
 DT_TODAY = datetime.datetime.now()
 TODAY = DT_TODAY.strftime('%Y_%m_%d-%H_%M_%S')
-OUTFILE = TWEETS_DIR+'tweets_'+TODAY+'.json'
-DOMAINS_FILE = META_DIR+'domains_'+TODAY+'.json'
-ENTITIES_FILE = META_DIR+'entities_'+TODAY+'.json'
 
 # logging
 LOG_FILE_PATH = f'../data/logfiles/twitter/{TODAY}.log'
@@ -204,8 +142,7 @@ load_dotenv()
 bearer_token = os.getenv('TWITTER_BEARER_TOKEN')
 
 # pull in search terms
-with open(SEARCH_TERMS, 'r') as infile:
-    search_terms = [line.rstrip() for line in infile]
+search_terms = read_terms(SEARCH_TERMS)
 
 # Logger
 file_handler = logging.FileHandler(filename=LOG_FILE_PATH)
@@ -226,133 +163,26 @@ logger = logging.getLogger('LOGGER')
 ############
 # THE THING!
 ############
-# first, our streamer class
-class TweetStreamer(tweepy.StreamingClient):
-
-    def __init__(self, 
-                 out_path:str,
-                 out_path_domains:str,
-                 out_path_entities:str,
-                 kill_time:int=59,
-                 time_unit:str='minutes',
-                 **kwargs):
-        '''
-        adding custom params
-        '''
-        # out path for our tweet json
-        out_path = check_path_exists(out_path)
-        self.outfile = out_path 
-
-        # out path for our domains/entities jsons
-        out_path_domains = check_path_exists(out_path_domains)
-        out_path_entities = check_path_exists(out_path_entities)
-        self.out_path_domains = out_path_domains
-        self.out_path_entities = out_path_entities
-
-        # timing stuff
-        self.start_time = datetime.datetime.now()
-
-        if time_unit not in ['seconds', 'minutes']:
-            raise ValueError(f'time_unit must be either `minutes` or `seconds`.')
-
-        if time_unit=='minutes':
-            self.kill_time = datetime.timedelta(seconds=60*kill_time)
-        else:
-            self.kill_time = datetime.timedelta(seconds=kill_time)
-
-        self.domains = {}
-        self.entities = {}
-
-        self.counter = 0
-
-        # using super here makes sure we get all the attributes
-        # from our super-class. we do have to pass **kwargs both in
-        # the init method and here for this to work.
-        super(TweetStreamer, self).__init__(**kwargs)
-    
-    def on_data(self, data):
-        '''
-        1. clean the returned tweet object
-        2. write it out
-        '''
-        # pull core fields we want
-        if (datetime.datetime.now() - self.start_time) <= self.kill_time:
-            self.counter += 1
-            obj = json.loads(data)
-            tweet = obj['data']
-            if 'edit_history_tweet_ids' in tweet.keys():
-                del tweet['edit_history_tweet_ids']
-
-            urls = extract_urls(tweet['text'])
-            if len(urls)>0:
-                tweet['urls'] = urls
-
-            if 'context_annotations' in tweet.keys():
-                domains, entities = extract_count_domains_entities(tweet['context_annotations'])
-                self.domains, self.entities = total_domain_entity_counts(domains_tweet=domains,
-                                                                         domains_session=self.domains,
-                                                                         entities_tweet=entities,
-                                                                         entities_session=self.entities)
-                                
-                del tweet['context_annotations']
-                tweet['domains'] = domains
-                tweet['entities'] = entities
-
-            tweet['user'] = obj['includes']['users'][0]
-            
-            with open(self.outfile, 'a') as o:
-                o.write(json.dumps(tweet)+'\n')
-
-        # encountered the time limit
-        else:
-            # write out our domain and entity counts
-            self.domains = dict(sorted(self.domains.items(), key=lambda x:x[1], reverse=True))
-            self.entities = dict(sorted(self.entities.items(), key=lambda x:x[1], reverse=True))
-
-            with open(self.out_path_domains, 'w') as o:
-                o.write(json.dumps(self.domains))
-
-            with open(self.out_path_entities, 'w') as o:
-                o.write(json.dumps(self.entities))
-
-            # number of tweets collected to log file
-            logging.info(f'Collected a total of {self.counter} tweets.')
-            
-            # this kills the streaming process
-            self.disconnect()
-            return False
-
-
-    def on_errors(self, errors):
-        return super().on_errors(errors)
-
-
-# instantiate the class
+# instantiate our streamer, see `stream_supervisor.py`. `max_retries=0`
+# hands dropped connections back to `run`, which reconnects with backoff
+# and backfill.
 streamer = TweetStreamer(bearer_token=bearer_token, 
-                         out_path=OUTFILE, 
-                         out_path_domains=DOMAINS_FILE, 
-                         out_path_entities=ENTITIES_FILE,
-                         kill_time=int(KILL_TIME),
-                         time_unit=args.time_unit)
-
-# # delte existing streaming rules
-existing_rules = streamer.get_rules()
-logging.info(f'Current rules: {existing_rules}')
-if not existing_rules.data==None:
-    streamer.delete_rules([x.id for x in existing_rules.data])
-
-# # add our target rules
-for item in search_terms:
-    try:
-        streamer.add_rules(tweepy.StreamRule(item))
-    except tweepy.HTTPException:
-        break
-
-# start filtering
-streamer.filter(
-    # backfill_minutes=1,
-    expansions=EXPANSTIONS, 
-    tweet_fields=TWEET_FIELDS,
-    media_fields=MEDIA_FIELDS,
-    user_fields=USER_FIELDS
-)
\ No newline at end of file
+                         tweets_dir=TWEETS_DIR, 
+                         meta_dir=META_DIR, 
+                         prefix='',
+                         kill_time=0 if args.persistent else int(KILL_TIME),
+                         time_unit=args.time_unit,
+                         rotate_minutes=int(args.rotate_minutes) if args.persistent else 0,
+                         rotate_bytes=int(float(args.rotate_mb)*1024*1024),
+                         n_workers=int(args.workers),
+                         max_queue=int(args.max_queue),
+                         top_k=int(args.top_k),
+                         classifier=DomainClassifier() if args.classify_urls else None,
+                         max_retries=0)
+
+# bring the live rules in line with our search terms: one batched add and
+# one batched delete, unchanged rules stay in place. see `stream_rules.py`.
+sync_rules(streamer, search_terms, max_rules=int(args.max_rules))
+
+# start streaming
+streamer.run(backfill_minutes=int(args.backfill_minutes))
@@ -0,0 +1,232 @@
+# heavy_hitters.py
+
+# DATA COLLECTION: SHARED
+# memory-bounded top-k counting for our session domain/entity aggregates.
+# by default the collectors count domains/entities in plain dicts, which
+# grow with the vocabulary - fine for an hour, not for a week-long stream.
+# `SpaceSavingCounter` keeps at most `capacity` keys, no matter how many
+# distinct ones it sees.
+
+# the algorithm is SpaceSaving (Metwally, Agrawal & El Abbadi, 2005):
+# - a key we already track gets its count incremented
+# - a new key, while we have room, starts at 1
+# - a new key, once full, replaces the key with the smallest count `m`, and
+#   starts at m+1 with an error of m
+
+# error bounds, with n the total number of increments and k the capacity:
+# - every tracked count over-estimates: count - error <= true count <= count
+# - error <= min tracked count <= n/k
+# - every key whose true count exceeds n/k is guaranteed to be tracked
+# merging two summaries (see `merge`) keeps the same guarantees with
+# n = n1 + n2, so chunks/processes can each keep their own counter and
+# get combined at the end.
+
+# `restore_counts`/`load_counts` bring a session counter (dict or top-k)
+# back from the `sort_counts` output we wrote out, for resumed runs.
+
+############
+# IMPORTS
+############
+import os
+import json
+import heapq
+
+############
+# THE THING!
+############
+class SpaceSavingCounter:
+
+    def __init__(self, capacity:int):
+        '''
+        args:
+            - capacity: int, max number of keys to track. memory is O(capacity).
+        '''
+        if capacity < 1:
+            raise ValueError(f'capacity must be at least 1.')
+
+        self.capacity = capacity
+        self.n = 0
+        self.counts = {}
+        self.errors = {}
+
+        # min-heap of (count, key). entries go stale when a key's count
+        # moves on; they get skipped on pop and the heap is rebuilt when it
+        # gets too big.
+        self._heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def __getitem__(self, key):
+        return self.counts[key]
+
+    def get(self, key, default=None):
+        return self.counts.get(key, default)
+
+    def add(self, key, count:int=1):
+        '''
+        counts `key` another `count` times
+        '''
+        self.n += count
+
+        if key in self.counts:
+            self.counts[key] += count
+            self._push(key)
+            return
+
+        if len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+            self._push(key)
+            return
+
+        # full - replace the key with the smallest count
+        min_key, min_count = self._pop_min()
+        del self.counts[min_key]
+        del self.errors[min_key]
+        self.counts[key] = min_count + count
+        self.errors[key] = min_count
+        self._push(key)
+
+    def update(self, keys):
+        '''
+        counts every key in `keys` once
+        '''
+        for key in keys:
+            self.add(key)
+
+    def min_count(self) -> int:
+        '''
+        smallest tracked count, 0 while there's still room. this is the
+        max over-estimate of any tracked key, and the max true count of
+        any key we're not tracking.
+        '''
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def error_bound(self) -> float:
+        '''
+        the worst-case over-estimate, n/k
+        '''
+        return self.n/self.capacity
+
+    def most_common(self, n:int=None) -> list:
+        '''
+        (key, count) tuples, highest count first
+        '''
+        items = sorted(self.counts.items(), key=lambda x:x[1], reverse=True)
+        return items if n is None else items[:n]
+
+    def guaranteed(self) -> list:
+        '''
+        the keys whose count is exact enough to be sure they're in the true
+        top-k: their lower bound beats the largest possible untracked count
+        '''
+        floor = self.min_count()
+        return [key for key, count in self.most_common() if count - self.errors[key] >= floor]
+
+    def merge(self, other):
+        '''
+        merges `other` into this counter in place. keys missing from a full
+        summary are assumed to have that summary's min count (its max
+        possible untracked count), which keeps the error bounds intact.
+        '''
+        if not isinstance(other, SpaceSavingCounter):
+            raise TypeError(f'can only merge another SpaceSavingCounter.')
+
+        self_floor = self.min_count()
+        other_floor = other.min_count()
+
+        counts = {}
+        errors = {}
+        for key in set(self.counts) | set(other.counts):
+            counts[key] = self.counts.get(key, self_floor) + other.counts.get(key, other_floor)
+            errors[key] = self.errors.get(key, self_floor) + other.errors.get(key, other_floor)
+
+        keep = heapq.nlargest(self.capacity, counts.items(), key=lambda x:x[1])
+        self.counts = {key: count for key, count in keep}
+        self.errors = {key: errors[key] for key in self.counts}
+        self.n += other.n
+        self._rebuild()
+
+        return self
+
+    def to_dict(self) -> dict:
+        '''
+        json-serialisable state, counts highest first
+        '''
+        return {
+            'capacity': self.capacity,
+            'n': self.n,
+            'error_bound': self.error_bound(),
+            'counts': dict(self.most_common()),
+            'errors': self.errors
+        }
+
+    @classmethod
+    def from_dict(cls, state:dict):
+        '''
+        rebuilds a counter from `to_dict` output (e.g. another process'
+        meta file), so it can be merged
+        '''
+        counter = cls(state['capacity'])
+        counter.n = state['n']
+        counter.counts = dict(state['counts'])
+        counter.errors = {key: state['errors'].get(key, 0) for key in counter.counts}
+        counter._rebuild()
+
+        return counter
+
+    def _push(self, key):
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > 4*self.capacity:
+            self._rebuild()
+
+    def _rebuild(self):
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        '''
+        pops the tracked key with the smallest count, skipping stale entries
+        '''
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key)==count:
+                return key, count
+
+
+def new_counter(top_k:int=0):
+    '''
+    a fresh session counter: a plain dict (exact, unbounded) for top_k=0,
+    otherwise a `SpaceSavingCounter` tracking at most `top_k` keys
+    '''
+    if top_k:
+        return SpaceSavingCounter(top_k)
+    return {}
+
+
+def restore_counts(counts, top_k:int=0):
+    '''
+    rebuilds a domain/entity session counter from its `sort_counts` output
+    '''
+    if counts is None:
+        return new_counter(top_k)
+    if 'capacity' in counts and 'errors' in counts:
+        return SpaceSavingCounter.from_dict(counts)
+    return dict(counts)
+
+
+def load_counts(path:str):
+    '''
+    the `sort_counts` output written to `path`, for `restore_counts`. None
+    if there's no such file.
+    '''
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as infile:
+        return json.load(infile)
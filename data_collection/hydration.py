@@ -0,0 +1,379 @@
+# hydration.py
+
+# DATA COLLECTION: TWITTER
+# hydrating tweets by id in bulk. `get_tweets_by_id.py` used to read every id
+# into memory, call `get_tweets` for one chunk of 100 after the other, drop
+# the `errors` part of every response (so deleted/protected tweets just
+# vanished), and start from scratch on every rerun.
+
+# here:
+# - ids get streamed from the ids file, in batches of up to 100
+# - an on-disk `IdIndex` next to the outfile records every id we're done
+#   with - hydrated or unresolvable - so a rerun skips them and picks up
+#   where the last one stopped
+# - several batches are in flight at once. pacing is left to the client's
+#   rate-limit governor (see `rate_limit.py`), or a shared `TokenBucket`
+# - ids the api can't resolve (deleted, protected, suspended, ...) go to a
+#   separate errors file, one json line each, with the api's reason
+
+# batches get written, flushed and only then marked done in the index. if
+# we die in between, the index catches up from the outfile on the next
+# run (it remembers how far into the outfile it has read), so nothing is
+# fetched or written twice.
+
+############
+# IMPORTS
+############
+import os
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import tweepy
+from jsonl_writer import JsonlWriter
+from search_scheduler import RETRYABLE
+from rate_limit import TokenBucket, ENDPOINT_LIMITS
+from tweet_normalization import (normalize_response, EXPANSIONS, TWEET_FIELDS, MEDIA_FIELDS, USER_FIELDS)
+
+############
+# CONSTANTS
+############
+# max ids per `get_tweets` call
+BATCH_SIZE = 100
+
+INDEX_SUFFIX = '.ids.sqlite'
+ERRORS_SUFFIX = '.errors'
+
+# what we put in the index for every id we're done with
+FOUND = 'found'
+ERROR = 'error'
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS ids (id TEXT PRIMARY KEY, status TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, indexed_bytes INTEGER NOT NULL)'
+]
+
+############
+# FUNCTIONS
+############
+def read_ids(ids_path:str):
+    '''
+    yields the ids in an ids file (one per line), skipping blank lines.
+    never holds more than one line in memory.
+    '''
+    with open(ids_path, 'r') as infile:
+        for line in infile:
+            tweet_id = line.strip()
+            if tweet_id:
+                yield tweet_id
+
+
+def index_path(tweets_path:str) -> str:
+    return tweets_path+INDEX_SUFFIX
+
+
+def errors_path(tweets_path:str) -> str:
+    return tweets_path+ERRORS_SUFFIX
+
+
+def error_records(response, requested:list) -> list:
+    '''
+    one record for every id in `requested` that didn't come back as a tweet:
+    the api's error for it if there is one (`Not Found Error`, `Authorization
+    Error`, ...), a bare `missing` otherwise.
+    '''
+    found = {str(tweet.id) for tweet in (response.data or [])}
+
+    errors = {}
+    for error in (response.errors or []):
+        error_id = str(error.get('resource_id') or error.get('value') or '')
+        if error_id and error_id not in found:
+            errors[error_id] = {
+                'id': error_id,
+                'title': error.get('title'),
+                'type': error.get('type'),
+                'detail': error.get('detail')
+            }
+
+    return [errors.get(tweet_id, {'id': tweet_id, 'title': 'missing', 'type': None, 'detail': None})
+            for tweet_id in requested if tweet_id not in found]
+
+
+############
+# THE THING!
+############
+class IdIndex:
+
+    def __init__(self, path:str):
+        '''
+        the set of ids we're done with, in a sqlite db at `path`.
+        only use it from one thread.
+        '''
+        self.path = path
+        self.db = sqlite3.connect(path)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM ids').fetchone()[0]
+
+    def done(self, ids:list) -> set:
+        '''
+        the ids in `ids` that are already in the index
+        '''
+        out = set()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i+500]
+            rows = self.db.execute(f'SELECT id FROM ids WHERE id IN ({",".join("?"*len(chunk))})', chunk)
+            out.update(row[0] for row in rows)
+
+        return out
+
+    def counts(self) -> dict:
+        return dict(self.db.execute('SELECT status, COUNT(*) FROM ids GROUP BY status').fetchall())
+
+    def mark(self, ids:list, status:str, path:str=None, indexed_bytes:int=None):
+        '''
+        adds `ids` with `status`. with `path`/`indexed_bytes`, also records
+        how far into `path` the index is up to date - in the same transaction.
+        '''
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO ids (id, status) VALUES (?, ?)',
+                                [(tweet_id, status) for tweet_id in ids])
+            if path is not None:
+                self.db.execute('INSERT OR REPLACE INTO files (path, indexed_bytes) VALUES (?, ?)',
+                                (os.path.basename(path), indexed_bytes))
+
+    def indexed_bytes(self, path:str) -> int:
+        row = self.db.execute('SELECT indexed_bytes FROM files WHERE path=?', (os.path.basename(path),)).fetchone()
+        return 0 if row is None else row[0]
+
+    def catch_up(self, path:str, status:str) -> int:
+        '''
+        indexes the ids in data file `path` that were written after the
+        index last saw it, e.g. because we died between writing a batch and
+        marking it. returns the number of ids added.
+        '''
+        if not os.path.isfile(path):
+            return 0
+
+        offset = self.indexed_bytes(path)
+        size = os.path.getsize(path)
+        if size < offset:
+            # the file got truncated or replaced - start over on it
+            logging.warning(f'{path} is smaller than when we last indexed it, re-indexing all of it.')
+            offset = 0
+        if size==offset:
+            return 0
+
+        ids = []
+        with open(path, 'rb') as infile:
+            infile.seek(offset)
+            for line in infile:
+                # a partial last line is only there if we died mid-write.
+                # it gets re-fetched, and the new line starts on its own.
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                try:
+                    ids.append(str(json.loads(line)['id']))
+                except (json.JSONDecodeError, KeyError):
+                    logging.warning(f'skipping malformed line in {path}.')
+
+        self.mark(ids, status, path=path, indexed_bytes=offset)
+        if ids:
+            logging.info(f'caught up on {len(ids)} ids in {path} that were not in the index yet.')
+
+        return len(ids)
+
+    def close(self):
+        self.db.close()
+
+
+class Hydrator:
+
+    def __init__(self,
+                 client:tweepy.Client,
+                 tweets_path:str,
+                 max_in_flight:int=4,
+                 batch_size:int=BATCH_SIZE,
+                 max_retries:int=3,
+                 retry_backoff:float=30.0,
+                 budget:TokenBucket=None,
+                 domains_session:dict=None,
+                 entities_session:dict=None,
+                 report_interval:float=60.0):
+        '''
+        args:
+            - client: an authenticated `tweepy.Client`, shared by all requests
+            - tweets_path: str, the outfile. the id index and errors file
+              live next to it (`<outfile>.ids.sqlite`, `<outfile>.errors`)
+            - max_in_flight: int, `get_tweets` requests running at once
+            - batch_size: int, ids per request, at most 100
+            - max_retries: int, retries per batch on server/network errors
+            - retry_backoff: float, seconds before the first retry, doubled
+              for every further one
+            - budget: shared `TokenBucket`. defaults to the tweet lookup
+              endpoint's app-auth limit, unless the client is a
+              `rate_limit.GovernedClient`, which does its own pacing.
+            - domains_session/entities_session: optional dicts that get the
+              domain/entity counts of everything we hydrate
+            - report_interval: float, seconds between progress log lines
+        '''
+        if not 0 < batch_size <= BATCH_SIZE:
+            raise ValueError(f'batch_size must be between 1 and {BATCH_SIZE}.')
+
+        self.client = client
+        self.tweets_path = tweets_path
+        self.errors_path = errors_path(tweets_path)
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        if budget is None and getattr(client, 'governor', None) is None:
+            budget = TokenBucket(*ENDPOINT_LIMITS['get_tweets'])
+        self.budget = budget
+        self.domains_session = domains_session
+        self.entities_session = entities_session
+        self.report_interval = report_interval
+
+        self.counters = {'skipped': 0, 'requested': 0, 'requests': 0, 'errors': 0}
+
+    def _fetch(self, ids:list):
+        '''
+        one `get_tweets` call, retried with exponential backoff. runs on
+        the worker threads.
+        '''
+        for attempt in range(self.max_retries+1):
+            if self.budget is not None:
+                self.budget.acquire()
+            try:
+                return self.client.get_tweets(ids=ids,
+                                              expansions=EXPANSIONS,
+                                              tweet_fields=TWEET_FIELDS,
+                                              media_fields=MEDIA_FIELDS,
+                                              user_fields=USER_FIELDS)
+            except RETRYABLE as e:
+                if attempt==self.max_retries:
+                    raise
+                wait_for = self.retry_backoff*2**attempt
+                logging.warning(f'get_tweets failed for a batch of {len(ids)} ids ({e}). retrying in {wait_for} seconds.')
+                time.sleep(wait_for)
+
+    def _batches(self, ids, index:IdIndex, pending:set):
+        '''
+        batches of ids we still need: not in the index, not already in
+        flight, and not repeated within the batch
+        '''
+        batch = []
+        candidates = []
+
+        def take():
+            done = index.done(candidates)
+            for tweet_id in candidates:
+                if tweet_id in done or tweet_id in pending or tweet_id in batch:
+                    self.counters['skipped'] += 1
+                else:
+                    batch.append(tweet_id)
+            candidates.clear()
+
+        for tweet_id in ids:
+            candidates.append(tweet_id)
+            if len(candidates) >= self.batch_size:
+                take()
+            if len(batch) >= self.batch_size:
+                yield batch[:self.batch_size]
+                # `take` can overshoot by less than one batch
+                batch = batch[self.batch_size:]
+
+        take()
+        while batch:
+            yield batch[:self.batch_size]
+            batch = batch[self.batch_size:]
+
+    def _write(self, response, ids:list, index:IdIndex, writer:JsonlWriter, error_writer:JsonlWriter):
+        '''
+        writes one batch's tweets and errors, then marks its ids done.
+        runs on the main thread only.
+        '''
+        records = normalize_response(response,
+                                     domains_session=self.domains_session,
+                                     entities_session=self.entities_session,
+                                     counters=self.counters)
+        errors = error_records(response, ids)
+
+        for record in records:
+            writer.write(record)
+        for error in errors:
+            error_writer.write(error)
+        writer.flush()
+        error_writer.flush()
+
+        index.mark([str(record['id']) for record in records], FOUND,
+                   path=self.tweets_path, indexed_bytes=writer.manifest.bytes)
+        index.mark([error['id'] for error in errors], ERROR,
+                   path=self.errors_path, indexed_bytes=error_writer.manifest.bytes)
+        self.counters['errors'] += len(errors)
+
+    def run(self, ids) -> dict:
+        '''
+        hydrates `ids` (any iterable, e.g. `read_ids(path)`), skipping the
+        ones a previous run already got to.
+
+        returns:
+            - counters dict: `tweets` written, `errors` (unresolvable ids),
+              `skipped` (already done or repeated), `requested`, `requests`
+        '''
+        index = IdIndex(index_path(self.tweets_path))
+        index.catch_up(self.tweets_path, FOUND)
+        index.catch_up(self.errors_path, ERROR)
+        logging.info(f'hydrating into {self.tweets_path}, {len(index)} ids already done: {index.counts()}')
+
+        writer = JsonlWriter(self.tweets_path)
+        error_writer = JsonlWriter(self.errors_path, time_field=None)
+
+        in_flight = {}
+        pending = set()
+        last_report = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+                batches = self._batches(ids, index, pending)
+                while True:
+                    # keep the pool full, without reading further ahead
+                    for batch in batches:
+                        in_flight[pool.submit(self._fetch, batch)] = batch
+                        pending.update(batch)
+                        self.counters['requested'] += len(batch)
+                        if len(in_flight) >= self.max_in_flight:
+                            break
+                    if not in_flight:
+                        break
+
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        batch = in_flight.pop(future)
+                        self._write(future.result(), batch, index, writer, error_writer)
+                        pending.difference_update(batch)
+                        self.counters['requests'] += 1
+
+                    if time.monotonic() - last_report >= self.report_interval:
+                        logging.info(f'hydration progress: {self.counters}')
+                        last_report = time.monotonic()
+        finally:
+            # stop handing out work if a batch failed for good. batches
+            # still in flight get written if they come back.
+            for future in in_flight:
+                future.cancel()
+            for future, batch in in_flight.items():
+                if not future.cancelled() and future.exception() is None:
+                    self._write(future.result(), batch, index, writer, error_writer)
+                    self.counters['requests'] += 1
+            writer.close()
+            error_writer.close()
+            index.close()
+
+        logging.info(f'hydration done: {self.counters}')
+
+        return self.counters
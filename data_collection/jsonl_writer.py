@@ -0,0 +1,214 @@
+# jsonl_writer.py
+
+# DATA COLLECTION: SHARED
+# a buffered, batched writer for our newline-delimited json outfiles.
+# every collector used to do `open(path, 'a')` + `write` + close for every
+# single tweet, which at stream peaks left us bound on syscalls and
+# open/close. this keeps one file handle open per outfile and buffers
+# serialised records in memory, flushing them:
+# - once a size threshold (n records or n bytes) is hit
+# - once a time threshold since the last flush has passed
+# - at shutdown (explicit close, context-manager exit or interpreter exit)
+# every flush also updates a sidecar manifest next to the outfile (n
+# records, time range, first/last id, ...), see `manifest.py`.
+
+# usage:
+#   with JsonlWriter(path) as writer:
+#       writer.write(tweet_dict)
+
+############
+# IMPORTS
+############
+import os
+import json
+import atexit
+import logging
+import threading
+import time
+from manifest import Manifest, load_manifest
+
+############
+# CONSTANTS
+############
+FSYNC_POLICIES = ['never', 'flush', 'close']
+
+############
+# THE THING!
+############
+class JsonlWriter:
+
+    def __init__(self,
+                 path:str,
+                 flush_records:int=1000,
+                 flush_bytes:int=1024*1024,
+                 flush_interval:float=5.0,
+                 fsync:str='never',
+                 mode:str='a',
+                 background_flush:bool=True,
+                 manifest:bool=True,
+                 time_field:str='created_at',
+                 id_field:str='id'):
+        '''
+        keeps `path` open and buffers json lines in memory.
+
+        args:
+            - path: str, full path to the jsonl outfile
+            - flush_records: int, flush once this many records are buffered
+            - flush_bytes: int, flush once the buffer holds roughly this many bytes
+            - flush_interval: float, seconds after which a non-empty buffer
+              gets flushed. set to 0/None to disable time-based flushing.
+            - fsync: str, one of `never`, `flush` (fsync after every flush)
+              or `close` (fsync once when the writer is closed)
+            - mode: str, file mode to open `path` with. `a` or `w`.
+            - background_flush: bool, whether to run a daemon thread that
+              honours `flush_interval` even when no new records come in
+              (e.g. a quiet stream). without it, the time threshold is only
+              checked on `write`.
+            - manifest: bool, whether to keep a sidecar manifest
+            - time_field/id_field: str, the record fields the manifest takes
+              its time range and first/last id from
+        '''
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'fsync must be one of {FSYNC_POLICIES}.')
+
+        if mode not in ['a', 'w']:
+            raise ValueError(f'mode must be either `a` or `w`.')
+
+        self.path = path
+        self.flush_records = flush_records
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        # in append mode, pick up the existing file's manifest before we
+        # add to the file
+        self.manifest = None
+        if manifest:
+            if mode=='a':
+                self.manifest = load_manifest(path, time_field=time_field, id_field=id_field)
+            else:
+                self.manifest = Manifest(path, time_field=time_field, id_field=id_field)
+                self.manifest.save()
+
+        self._file = open(path, mode, encoding='utf-8')
+        self._buffer = []
+        self._buffer_records = []
+        self._buffer_bytes = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self.closed = False
+
+        # some counters - handy for logging/benchmarking
+        self.n_records = 0
+        self.n_flushes = 0
+
+        # make sure whatever's in the buffer lands if the process exits
+        # without us closing explicitly
+        atexit.register(self.close)
+
+        self._stop = threading.Event()
+        self._flusher = None
+        if background_flush and flush_interval:
+            self._flusher = threading.Thread(target=self._flush_periodically,
+                                             name=f'JsonlWriter-{os.path.basename(path)}',
+                                             daemon=True)
+            self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def write(self, record:dict):
+        '''
+        serialises `record` to json and adds it to the buffer
+        '''
+        self.write_line(json.dumps(record)+'\n', record=record)
+
+    def write_line(self, line:str, record:dict=None):
+        '''
+        adds an already serialised, newline-terminated line to the buffer.
+        pass the `record` it was serialised from if you have it, otherwise
+        the manifest has to parse the line again.
+        '''
+        with self._lock:
+            if self.closed:
+                raise ValueError(f'writer for {self.path} is already closed.')
+
+            if self.manifest is not None:
+                self._buffer_records.append(record if record is not None else json.loads(line))
+            self._buffer.append(line)
+            self._buffer_bytes += len(line.encode('utf-8'))
+            self.n_records += 1
+
+            if len(self._buffer) >= self.flush_records or self._buffer_bytes >= self.flush_bytes:
+                self._flush()
+            elif self.flush_interval and (time.monotonic() - self._last_flush) >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        '''
+        writes out the buffer and flushes the file handle
+        '''
+        with self._lock:
+            if not self.closed:
+                self._flush()
+
+    def close(self):
+        '''
+        flushes whatever is left, fsyncs if requested and closes the file.
+        safe to call more than once.
+        '''
+        with self._lock:
+            if self.closed:
+                return
+            self._flush()
+            if self.manifest is not None:
+                self.manifest.save()
+            if self.fsync=='close':
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self.closed = True
+
+        self._stop.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+
+        atexit.unregister(self.close)
+        logging.debug(f'closed {self.path} after writing {self.n_records} records in {self.n_flushes} flushes.')
+
+    def _flush(self):
+        '''
+        the actual flush. callers must hold the lock.
+        '''
+        if self._buffer:
+            data = ''.join(self._buffer)
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync=='flush':
+                os.fsync(self._file.fileno())
+            self._buffer = []
+            self._buffer_bytes = 0
+            self.n_flushes += 1
+
+            # the manifest only ever describes what's made it to the file
+            if self.manifest is not None:
+                for record in self._buffer_records:
+                    self.manifest.add(record)
+                self.manifest.add_bytes(data.encode('utf-8'))
+                self.manifest.save()
+                self._buffer_records = []
+        self._last_flush = time.monotonic()
+
+    def _flush_periodically(self):
+        '''
+        background loop: flush a stale buffer every `flush_interval` seconds
+        '''
+        while not self._stop.wait(self.flush_interval):
+            with self._lock:
+                if self.closed:
+                    return
+                if self._buffer and (time.monotonic() - self._last_flush) >= self.flush_interval:
+                    self._flush()
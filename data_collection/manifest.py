@@ -0,0 +1,242 @@
+# manifest.py
+
+# DATA COLLECTION: SHARED
+# sidecar manifests for our jsonl data files. a handful of code paths used
+# to open whole data files just to learn simple facts about them - the
+# newest post in a reddit dir, the last tweet in a search file, the number
+# of lines. every `JsonlWriter` now keeps a small `<file>.manifest` next to
+# its outfile with:
+# - n records and byte size
+# - min/max timestamp (`created_at` for tweets, `created_utc` for reddit)
+# - first and last id
+# - a crc32 checksum of the content
+# the manifest is rewritten on every flush and only ever describes what's
+# on disk, so it can't run ahead of the data.
+
+# timestamps are compared as strings. that's correct for the formats we
+# write (iso 8601 for tweets, `%Y/%m/%d %H:%M:%S` for reddit) and saves us
+# parsing a date per record.
+
+# the coverage helpers at the bottom answer questions across a directory
+# (what's the newest record, which files cover a time range, how many
+# records) from the manifests alone.
+
+############
+# IMPORTS
+############
+import os
+import glob
+import json
+import logging
+import zlib
+
+############
+# CONSTANTS
+############
+MANIFEST_SUFFIX = '.manifest'
+
+############
+# THE THING!
+############
+class Manifest:
+
+    def __init__(self, path:str, time_field:str='created_at', id_field:str='id'):
+        '''
+        args:
+            - path: str, the data file this manifest describes
+            - time_field: str, record field holding its timestamp
+            - id_field: str, record field holding its id
+        '''
+        self.path = path
+        self.time_field = time_field
+        self.id_field = id_field
+
+        self.n_records = 0
+        self.bytes = 0
+        self.min_time = None
+        self.max_time = None
+        self.first_id = None
+        self.last_id = None
+        self.crc32 = 0
+
+    def add(self, record:dict):
+        '''
+        accounts for one record. callers add `record`'s bytes separately,
+        see `add_bytes`.
+        '''
+        self.n_records += 1
+
+        record_id = record.get(self.id_field)
+        if record_id is not None:
+            if self.first_id is None:
+                self.first_id = record_id
+            self.last_id = record_id
+
+        record_time = record.get(self.time_field)
+        if isinstance(record_time, str):
+            if self.min_time is None or record_time < self.min_time:
+                self.min_time = record_time
+            if self.max_time is None or record_time > self.max_time:
+                self.max_time = record_time
+
+    def add_bytes(self, data:bytes):
+        '''
+        accounts for `data` having been appended to the file
+        '''
+        self.bytes += len(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+
+    def to_dict(self) -> dict:
+        return {
+            'path': os.path.basename(self.path),
+            'n_records': self.n_records,
+            'bytes': self.bytes,
+            'time_field': self.time_field,
+            'min_time': self.min_time,
+            'max_time': self.max_time,
+            'first_id': self.first_id,
+            'last_id': self.last_id,
+            'crc32': self.crc32
+        }
+
+    @classmethod
+    def from_dict(cls, path:str, state:dict):
+        manifest = cls(path, time_field=state['time_field'])
+        for key in ['n_records', 'bytes', 'min_time', 'max_time', 'first_id', 'last_id', 'crc32']:
+            setattr(manifest, key, state[key])
+
+        return manifest
+
+    def save(self):
+        '''
+        writes the manifest next to its data file, atomically
+        '''
+        write_manifest(self.path, self.to_dict())
+
+
+############
+# FUNCTIONS
+############
+def manifest_path(path:str) -> str:
+    return path+MANIFEST_SUFFIX
+
+
+def read_manifest(path:str):
+    '''
+    the manifest of data file `path`, or None if it has none
+    '''
+    try:
+        with open(manifest_path(path), 'r') as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(path:str, state:dict):
+    '''
+    writes manifest `state` for data file `path`. tmp file + rename, so a
+    crash never leaves a half-written manifest.
+    '''
+    out_path = manifest_path(path)
+    tmp_path = out_path+'.tmp'
+    with open(tmp_path, 'w') as o:
+        o.write(json.dumps(state))
+    os.replace(tmp_path, out_path)
+
+
+def build_manifest(path:str, time_field:str='created_at', id_field:str='id', save:bool=True) -> Manifest:
+    '''
+    builds a manifest by reading data file `path` once. for files written
+    before we had manifests, or whose manifest doesn't match them any more.
+    '''
+    manifest = Manifest(path, time_field=time_field, id_field=id_field)
+    with open(path, 'rb') as infile:
+        for line in infile:
+            manifest.add_bytes(line)
+            if line.strip():
+                try:
+                    manifest.add(json.loads(line))
+                except json.JSONDecodeError:
+                    logging.warning(f'skipping malformed line in {path}.')
+
+    if save:
+        manifest.save()
+
+    return manifest
+
+
+def load_manifest(path:str, time_field:str='created_at', id_field:str='id') -> Manifest:
+    '''
+    the manifest of data file `path`, ready to be added to. rebuilt from
+    the file if it's missing or its size doesn't match the file's.
+    '''
+    if not os.path.isfile(path):
+        return Manifest(path, time_field=time_field, id_field=id_field)
+
+    state = read_manifest(path)
+    if state is not None and state['bytes']==os.path.getsize(path) and state['time_field']==time_field:
+        manifest = Manifest.from_dict(path, state)
+        manifest.id_field = id_field
+        return manifest
+
+    logging.info(f'manifest for {path} is missing or stale, rebuilding it.')
+    return build_manifest(path, time_field=time_field, id_field=id_field)
+
+
+############
+# COVERAGE
+############
+def directory_manifests(directory:str, build_missing:bool=False, time_field:str='created_at', pattern:str='*.json') -> list:
+    '''
+    the manifests of all data files in `directory`.
+
+    args:
+        - build_missing: bool, build (and save) manifests for data files
+          matching `pattern` that don't have one yet. this reads those
+          files once; afterwards, they're covered by their manifest.
+    '''
+    directory = os.path.join(directory, '')
+    manifests = []
+    seen = set()
+    for path in sorted(glob.glob(directory+'*'+MANIFEST_SUFFIX)):
+        with open(path, 'r') as infile:
+            state = json.load(infile)
+        manifests.append(state)
+        seen.add(path[:-len(MANIFEST_SUFFIX)])
+
+    if build_missing:
+        for path in sorted(glob.glob(directory+pattern)):
+            if path not in seen and os.path.isfile(path):
+                manifests.append(build_manifest(path, time_field=time_field).to_dict())
+
+    return manifests
+
+
+def coverage(directory:str, build_missing:bool=False, time_field:str='created_at') -> dict:
+    '''
+    what's in `directory`: n files, records and bytes, and the overall
+    min/max timestamp. None timestamps if no file has any.
+    '''
+    manifests = directory_manifests(directory, build_missing=build_missing, time_field=time_field)
+    min_times = [m['min_time'] for m in manifests if m['min_time'] is not None]
+    max_times = [m['max_time'] for m in manifests if m['max_time'] is not None]
+
+    return {
+        'files': len(manifests),
+        'n_records': sum(m['n_records'] for m in manifests),
+        'bytes': sum(m['bytes'] for m in manifests),
+        'min_time': min(min_times) if min_times else None,
+        'max_time': max(max_times) if max_times else None
+    }
+
+
+def files_covering(directory:str, start:str, end:str, build_missing:bool=False, time_field:str='created_at') -> list:
+    '''
+    data files in `directory` holding records with timestamps in
+    [start, end]. `start`/`end` must be in the files' timestamp format.
+    '''
+    directory = os.path.join(directory, '')
+    manifests = directory_manifests(directory, build_missing=build_missing, time_field=time_field)
+
+    return [directory+m['path'] for m in manifests
+            if m['min_time'] is not None and m['min_time'] <= end and m['max_time'] >= start]
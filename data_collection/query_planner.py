@@ -0,0 +1,103 @@
+# query_planner.py
+
+# DATA COLLECTION: SHARED
+# turning a search terms file into as few twitter queries (or stream rules)
+# as the api's length limits allow. our scripts used to build one query
+# from the first five lines of the terms file, and silently drop the rest.
+
+# packing is first-fit decreasing: longest terms first, each into the first
+# query it still fits in. that's within 11/9 of the optimal number of
+# queries, and for our term lists it's usually optimal.
+
+# terms are OR-ed, each wrapped in parentheses, the way we've always built
+# our queries: `(world cup) OR (qatar) OR (#fifaworldcup)`.
+
+############
+# CONSTANTS
+############
+# max query length of the recent search endpoint (512 for essential and
+# elevated access, 1024 for academic research)
+MAX_QUERY_LENGTH = 512
+
+# max length of a filtered stream rule (essential/elevated)
+MAX_RULE_LENGTH = 512
+
+JOINER = ' OR '
+
+############
+# FUNCTIONS
+############
+def read_terms(search_terms_path:str) -> list:
+    '''
+    reads a search terms file, one term per line. drops blank lines and
+    terms that only differ in case from an earlier one - twitter matches
+    keywords case-insensitively, so they'd only repeat a match.
+    '''
+    terms = []
+    seen = set()
+    with open(search_terms_path, 'r') as infile:
+        for line in infile:
+            term = line.strip()
+            if term and term.lower() not in seen:
+                seen.add(term.lower())
+                terms.append(term)
+
+    return terms
+
+
+def clause(term:str) -> str:
+    return '('+term+')'
+
+
+def pack_terms(terms:list, max_length:int=MAX_QUERY_LENGTH, suffix:str='') -> list:
+    '''
+    packs `terms` into the fewest groups whose OR-ed query fits `max_length`.
+
+    args:
+        - suffix: str, appended to every query (e.g. ` -is:retweet`); counts
+          towards the length. the OR-ed terms get wrapped in parentheses
+          when there is one.
+
+    returns:
+        - list of lists of terms, one per query. terms keep their original
+          order within a group.
+    '''
+    budget = max_length - len(suffix) - (2 if suffix else 0)
+    order = {term: i for i, term in enumerate(terms)}
+
+    groups = []
+    lengths = []
+    for term in sorted(terms, key=len, reverse=True):
+        size = len(clause(term))
+        if size > budget:
+            raise ValueError(f'search term `{term}` is too long for a query of at most {max_length} characters.')
+
+        for i, group in enumerate(groups):
+            if lengths[i] + len(JOINER) + size <= budget:
+                group.append(term)
+                lengths[i] += len(JOINER) + size
+                break
+        else:
+            groups.append([term])
+            lengths.append(size)
+
+    return [sorted(group, key=order.get) for group in groups]
+
+
+def join_terms(terms:list, suffix:str='') -> str:
+    '''
+    one query from a group of terms
+    '''
+    query = JOINER.join(clause(term) for term in terms)
+    if suffix:
+        query = '('+query+')'+suffix
+
+    return query
+
+
+def plan_queries(terms:list, max_length:int=MAX_QUERY_LENGTH, suffix:str='') -> list:
+    '''
+    all `terms`, packed into the fewest queries of at most `max_length`
+    characters. see `pack_terms`.
+    '''
+    return [join_terms(group, suffix=suffix) for group in pack_terms(terms, max_length=max_length, suffix=suffix)]
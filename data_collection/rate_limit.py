@@ -0,0 +1,345 @@
+# rate_limit.py
+
+# DATA COLLECTION: SHARED
+# pacing for our twitter api calls. `tweepy.Client(wait_on_rate_limit=True)`
+# only sleeps once a 429 has arrived; when several windows/jobs share one
+# quota, we'd rather pace requests up front.
+
+# `TokenBucket` is a plain in-process token bucket: `capacity` requests per
+# `per_seconds`, refilled continuously. every api call does `acquire()` first.
+# `RateLimitGovernor` (below) does the same across processes, driven by the
+# api's own rate-limit headers.
+
+############
+# IMPORTS
+############
+import os
+import re
+import contextlib
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+import tweepy
+
+############
+# CONSTANTS
+############
+# app-auth limits for the endpoints we use: (requests, per seconds)
+ENDPOINT_LIMITS = {
+    'search_recent_tweets': (450, 15*60),
+    'get_tweets': (300, 15*60)
+}
+
+############
+# THE THING!
+############
+class TokenBucket:
+
+    def __init__(self, capacity:int, per_seconds:float):
+        '''
+        args:
+            - capacity: int, max number of requests in a burst / per window
+            - per_seconds: float, length of the rate-limit window in seconds
+        '''
+        if capacity < 1:
+            raise ValueError(f'capacity must be at least 1.')
+
+        self.capacity = capacity
+        self.rate = capacity/per_seconds
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        # stats
+        self.n_acquired = 0
+        self.waited = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated)*self.rate)
+        self._updated = now
+
+    def acquire(self, n:int=1):
+        '''
+        blocks until `n` tokens are available, then takes them
+        '''
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    self.n_acquired += n
+                    return
+                wait = (n - self.tokens)/self.rate
+                self.waited += wait
+
+            time.sleep(wait)
+
+
+############
+# CROSS-PROCESS GOVERNOR
+############
+# `TokenBucket` only paces the threads of one process, and only on limits we
+# hard-code. when streaming, search and by-id jobs run side by side they all
+# draw on the same app quota, so `RateLimitGovernor` keeps per-endpoint state
+# in a small sqlite db that every process opens:
+# - every response's `x-rate-limit-limit/remaining/reset` headers overwrite
+#   our own bookkeeping, so we follow the api's view of the quota
+# - every request first reserves one of the remaining calls. what's left is
+#   spread evenly over the time until reset, so we never run into a 429
+# - sqlite's `BEGIN IMMEDIATE` serialises reservations across processes
+
+# `GovernedClient`/`GovernedStreamingClient` are drop-in tweepy clients that
+# route every api call through a governor.
+
+RATE_LIMIT_DB = os.getenv('RATE_LIMIT_DB', '../data/rate_limits.sqlite')
+
+# default rate-limit window, until the api tells us otherwise
+DEFAULT_WINDOW = 15*60
+
+# path segments that are ids (after the `/2` version prefix), so all
+# `/2/users/:id/...` calls count against the same endpoint
+ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS endpoints (
+    endpoint TEXT PRIMARY KEY,
+    rate_limit INTEGER,
+    remaining INTEGER,
+    reset REAL,
+    next_at REAL NOT NULL DEFAULT 0,
+    requests INTEGER NOT NULL DEFAULT 0,
+    waits INTEGER NOT NULL DEFAULT 0,
+    waited REAL NOT NULL DEFAULT 0,
+    n_429 INTEGER NOT NULL DEFAULT 0,
+    updated REAL
+)
+'''
+
+
+def endpoint_key(method:str, route:str) -> str:
+    '''
+    e.g. `GET /2/users/:id/tweets` for `GET /2/users/12345/tweets`
+    '''
+    version, _, path = route.lstrip('/').partition('/')
+    return f'{method.upper()} /{version}{ID_SEGMENT.sub("/:id", "/"+path)}'
+
+
+class RateLimitGovernor:
+
+    def __init__(self,
+                 path:str=RATE_LIMIT_DB,
+                 spread:bool=True,
+                 reserve:int=0,
+                 timeout:float=60.0):
+        '''
+        args:
+            - path: str, the shared sqlite db. every process pointing at the
+              same file shares the same quota.
+            - spread: bool, spread the remaining calls evenly until reset.
+              if False, calls go out as fast as the quota allows and only
+              wait once it's used up.
+            - reserve: int, calls per window we leave untouched, e.g. for
+              jobs that don't go through a governor
+            - timeout: float, seconds to wait on another process' lock
+        '''
+        self.path = path
+        self.spread = spread
+        self.reserve = reserve
+        self.timeout = timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with self._transaction() as db:
+            db.execute(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        '''
+        one connection per thread - sqlite connections can't be shared
+        '''
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _row(self, db, endpoint:str, now:float) -> dict:
+        '''
+        the endpoint's state, created on first use. an expired window gets
+        refilled with the full limit.
+        '''
+        row = db.execute('SELECT * FROM endpoints WHERE endpoint=?', (endpoint,)).fetchone()
+        if row is None:
+            db.execute('INSERT INTO endpoints (endpoint, updated) VALUES (?, ?)', (endpoint, now))
+            row = db.execute('SELECT * FROM endpoints WHERE endpoint=?', (endpoint,)).fetchone()
+
+        row = dict(row)
+        if row['reset'] is not None and now >= row['reset']:
+            row['remaining'] = row['rate_limit']
+            row['reset'] = None
+
+        return row
+
+    def acquire(self, endpoint:str):
+        '''
+        blocks until `endpoint` has a call to spare, then reserves it.
+        endpoints we've not seen a response from yet go straight through.
+        '''
+        waited = 0.0
+        while True:
+            now = time.time()
+            with self._transaction() as db:
+                row = self._row(db, endpoint, now)
+                remaining = row['remaining']
+
+                if remaining is None:
+                    wait = 0.0
+                elif remaining - self.reserve <= 0:
+                    wait = (row['reset'] or now + DEFAULT_WINDOW) - now
+                else:
+                    wait = max(0.0, row['next_at'] - now)
+
+                if wait <= 0:
+                    next_at = now
+                    if remaining is not None:
+                        remaining -= 1
+                        if self.spread and row['reset'] is not None:
+                            next_at = now + (row['reset'] - now)/max(1, remaining - self.reserve)
+                    db.execute('''UPDATE endpoints
+                                  SET remaining=?, reset=?, next_at=?, requests=requests+1,
+                                      waits=waits+?, waited=waited+?, updated=?
+                                  WHERE endpoint=?''',
+                               (remaining, row['reset'], next_at, int(waited > 0), waited, now, endpoint))
+                    return
+
+            # the wait may be cut short by a response updating our state,
+            # so we check back at least every DEFAULT_WINDOW/15 seconds
+            wait = min(wait, DEFAULT_WINDOW/15)
+            if waited==0 and wait > 1:
+                logging.info(f'rate limit: waiting {round(wait, 1)}s for {endpoint}.')
+            time.sleep(wait)
+            waited += wait
+
+    def update(self, endpoint:str, headers, status:int=None):
+        '''
+        takes the api's view of the quota from a response's headers. within
+        one window we keep the lower `remaining`, as other processes may
+        have reserved calls the api hasn't seen yet.
+        '''
+        try:
+            limit = int(headers['x-rate-limit-limit'])
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset = float(headers['x-rate-limit-reset'])
+        except (KeyError, TypeError, ValueError):
+            limit = remaining = reset = None
+
+        now = time.time()
+        with self._transaction() as db:
+            row = self._row(db, endpoint, now)
+            if remaining is not None:
+                if row['reset']==reset and row['remaining'] is not None:
+                    remaining = min(remaining, row['remaining'])
+                row.update({'rate_limit': limit, 'remaining': remaining, 'reset': reset})
+            if status==429:
+                row['remaining'] = 0
+                # never retry a 429 straight away, even if the reset it
+                # came with has already passed
+                row['reset'] = max(row['reset'] or now + DEFAULT_WINDOW, now + 1)
+                row['n_429'] += 1
+                logging.warning(f'rate limit: 429 on {endpoint}, reset at {datetime.datetime.fromtimestamp(row["reset"])}.')
+
+            db.execute('''UPDATE endpoints
+                          SET rate_limit=?, remaining=?, reset=?, n_429=?, updated=?
+                          WHERE endpoint=?''',
+                       (row['rate_limit'], row['remaining'], row['reset'], row['n_429'], now, endpoint))
+
+    def stats(self) -> dict:
+        '''
+        per-endpoint state and utilization, across all processes sharing
+        the db. `utilization` is the share of the current window's quota
+        that's been used.
+        '''
+        now = time.time()
+        out = {}
+        for row in self._connection().execute('SELECT * FROM endpoints ORDER BY endpoint'):
+            row = dict(row)
+            if row['reset'] is not None and now >= row['reset']:
+                row['remaining'] = row['rate_limit']
+            used = None
+            if row['rate_limit'] and row['remaining'] is not None:
+                used = round((row['rate_limit'] - row['remaining'])/row['rate_limit'], 3)
+            out[row['endpoint']] = {
+                'limit': row['rate_limit'],
+                'remaining': row['remaining'],
+                'reset_in': None if row['reset'] is None else max(0, round(row['reset'] - now)),
+                'utilization': used,
+                'requests': row['requests'],
+                'waits': row['waits'],
+                'seconds_waited': round(row['waited'], 1),
+                'n_429': row['n_429']
+            }
+
+        return out
+
+    def log_stats(self):
+        for endpoint, stats in self.stats().items():
+            logging.info(f'rate limit stats for {endpoint}: {stats}')
+
+
+class GovernedMixin:
+    '''
+    routes every api call of a tweepy client through a `RateLimitGovernor`.
+    mix in before the tweepy class, e.g. `class X(GovernedMixin, tweepy.Client)`.
+
+    with `wait_on_rate_limit=True`, a 429 that still slips through is
+    waited out by the governor (so the wait is shared with every other
+    process) rather than by tweepy.
+    '''
+
+    def __init__(self, *args, governor:RateLimitGovernor=None, wait_on_rate_limit:bool=False, **kwargs):
+        self.governor = governor or RateLimitGovernor()
+        self.wait_for_governor = wait_on_rate_limit
+        super().__init__(*args, wait_on_rate_limit=False, **kwargs)
+
+    def request(self, method, route, params=None, json=None, user_auth=False):
+        endpoint = endpoint_key(method, route)
+        while True:
+            self.governor.acquire(endpoint)
+            try:
+                response = super().request(method, route, params=params, json=json, user_auth=user_auth)
+            except tweepy.TooManyRequests as e:
+                self.governor.update(endpoint, e.response.headers, status=429)
+                if not self.wait_for_governor:
+                    raise
+                continue
+            except tweepy.HTTPException as e:
+                self.governor.update(endpoint, e.response.headers, status=e.response.status_code)
+                raise
+
+            self.governor.update(endpoint, response.headers, status=response.status_code)
+            return response
+
+
+class GovernedClient(GovernedMixin, tweepy.Client):
+    pass
+
+
+class GovernedStreamingClient(GovernedMixin, tweepy.StreamingClient):
+    pass
@@ -0,0 +1,142 @@
+# reddit_async.py
+
+# DATA COLLECTION: REDDIT
+# collecting new posts from all our subreddits at once. `get_reddit_posts.py`
+# used to go through the subreddits one by one and sleep 30 seconds after
+# each, so every sub we added made the run longer - no matter how few new
+# posts it had.
+
+# here, every subreddit gets its own coroutine on one shared asyncpraw
+# client:
+# - asyncpraw's rate limiter follows reddit's `x-ratelimit-*` headers and
+#   is shared by every request of the client, so all subs draw on the same
+#   budget and nothing waits longer than the limit makes it
+# - `max_concurrent` caps how many listings are paged through at once
+# - author fields come from one shared `AuthorCache` (see
+#   `reddit_authors.py`), with misses fetched in bulk per page of posts
+# - every sub reports its latency: time to its first page, and in total
+
+# needs asyncpraw (`pip install asyncpraw`), unlike the rest of our reddit code.
+
+############
+# IMPORTS
+############
+import asyncio
+import datetime as dt
+import logging
+import time
+import asyncpraw
+from jsonl_writer import JsonlWriter
+from reddit_normalization import reddit_post_to_dict
+from reddit_authors import AuthorCache, BULK_LIMIT
+
+############
+# CONSTANTS
+############
+# the most reddit hands out per listing
+LISTING_LIMIT = 1000
+
+############
+# FUNCTIONS
+############
+async def collect_subreddit(reddit:asyncpraw.Reddit,
+                            sub:str,
+                            outfile:str,
+                            cutoff:dt.datetime,
+                            semaphore:asyncio.Semaphore,
+                            cache:AuthorCache,
+                            limit:int=LISTING_LIMIT) -> dict:
+    '''
+    collects `sub`'s posts newer than `cutoff` into `outfile`.
+
+    returns:
+        - dict with `sub`, `posts`, `status`, `first_page_seconds` (time to
+          the first post of the listing) and `seconds` (in total)
+    '''
+    stats = {'sub': sub, 'posts': 0, 'status': 'running', 'first_page_seconds': None, 'seconds': None}
+
+    async with semaphore:
+        start = time.monotonic()
+        logging.info(f'now collecting posts in subreddit {sub}')
+
+        # only opened once there's a new post, so we don't leave empty files
+        writer = None
+        batch = []
+
+        async def write_batch():
+            nonlocal writer
+            authors = await cache.resolve_async(reddit, batch)
+            if writer is None:
+                writer = JsonlWriter(outfile, time_field='created_utc')
+            for post in batch:
+                writer.write(reddit_post_to_dict(post, authors=authors))
+            stats['posts'] += len(batch)
+            batch.clear()
+
+        try:
+            subreddit = await reddit.subreddit(sub)
+            async for post in subreddit.new(limit=limit):
+                if stats['first_page_seconds'] is None:
+                    stats['first_page_seconds'] = round(time.monotonic() - start, 3)
+
+                if dt.datetime.fromtimestamp(post.created) < cutoff:
+                    logging.info(f'no new posts retrievable from {sub}.')
+                    break
+
+                batch.append(post)
+                if len(batch) >= BULK_LIMIT:
+                    await write_batch()
+
+            if batch:
+                await write_batch()
+            stats['status'] = 'done'
+        except Exception as e:
+            # one failing sub shouldn't take the others down
+            stats['status'] = 'failed'
+            logging.exception(f'collecting posts for {sub} failed: {e}')
+        finally:
+            if writer is not None:
+                writer.close()
+            stats['seconds'] = round(time.monotonic() - start, 3)
+
+    logging.info(f'collected a total of {stats["posts"]} posts for {sub} in {stats["seconds"]}s (first page after {stats["first_page_seconds"]}s).')
+
+    return stats
+
+
+async def collect_subreddits(subreddits:list,
+                             outfiles:dict,
+                             cutoffs:dict,
+                             reddit_kwargs:dict,
+                             max_concurrent:int=None,
+                             limit:int=LISTING_LIMIT,
+                             cache:AuthorCache=None) -> list:
+    '''
+    collects all `subreddits` concurrently, on one client.
+
+    args:
+        - outfiles/cutoffs: dicts, sub -> its outfile/oldest post datetime to keep
+        - reddit_kwargs: dict, passed to `asyncpraw.Reddit` (client_id, ...)
+        - max_concurrent: int, subs collected at once. defaults to all of them.
+        - cache: `AuthorCache` for author fields, defaults to the shared one
+
+    returns:
+        - list of per-sub stats dicts, see `collect_subreddit`
+    '''
+    semaphore = asyncio.Semaphore(max_concurrent or max(len(subreddits), 1))
+    if cache is None:
+        cache = AuthorCache()
+    start = time.monotonic()
+
+    async with asyncpraw.Reddit(**reddit_kwargs) as reddit:
+        report = await asyncio.gather(*[collect_subreddit(reddit, sub, outfiles[sub], cutoffs[sub],
+                                                          semaphore=semaphore, cache=cache, limit=limit)
+                                        for sub in subreddits])
+
+    total = round(time.monotonic() - start, 3)
+    slowest = max(report, key=lambda stats: stats['seconds'], default=None)
+    logging.info(f'collected {sum(stats["posts"] for stats in report)} posts from {len(report)} subreddits in {total}s. slowest sub: {slowest["sub"] if slowest else None} ({slowest["seconds"] if slowest else None}s).')
+
+    cache.log_stats()
+
+    return report
@@ -0,0 +1,217 @@
+# reddit_authors.py
+
+# DATA COLLECTION: REDDIT
+# author fields for our reddit posts, without a request per post.
+# `reddit_post_to_dict` used to read five attributes off the lazy
+# `post.author`, which made praw fetch the whole redditor for every single
+# post - hundreds of times over for our most prolific posters.
+
+# `AuthorCache` instead:
+# - keeps the author fields we write out in a small sqlite db keyed by
+#   username, shared by all subreddits and all runs
+# - entries expire after `ttl` seconds (karma moves), and once the cache
+#   holds `max_entries` the least recently used ones get evicted
+# - resolves all misses of a batch of posts in one request to reddit's
+#   bulk user data endpoint (`/api/user_data_by_account_ids`, 100 accounts
+#   per request), using the `author_fullname` every listed post carries
+
+# the bulk endpoint doesn't know everything a full fetch does:
+# - `total_karma` is link + comment karma (no awarder/awardee karma)
+# - `verified` isn't in it, so it comes out as None
+# authors it doesn't return (suspended, deleted since) get cached with
+# only their name, so we don't keep asking.
+
+############
+# IMPORTS
+############
+import os
+import json
+import logging
+import sqlite3
+import time
+
+############
+# CONSTANTS
+############
+AUTHOR_CACHE_DB = os.getenv('AUTHOR_CACHE_DB', '../data/reddit_authors.sqlite')
+
+# a day - long enough to cover many runs, short enough for karma to stay current
+DEFAULT_TTL = 24*60*60
+DEFAULT_MAX_ENTRIES = 100000
+
+# max account ids per bulk user data request
+BULK_LIMIT = 100
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS authors (
+        name TEXT PRIMARY KEY,
+        fields TEXT NOT NULL,
+        fetched REAL NOT NULL,
+        used REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS authors_used ON authors (used)'
+]
+
+############
+# FUNCTIONS
+############
+def partial_to_fields(name:str, fullname:str, partial) -> dict:
+    '''
+    our author fields (see `reddit_normalization.CORE_USER_FIELDS`) from a
+    bulk user data entry, or from nothing if the endpoint didn't return one
+    '''
+    fields = {'name': name, 'id': None, 'total_karma': None, 'verified': None, 'created_utc': None}
+    if partial is not None:
+        fields.update({
+            'name': getattr(partial, 'name', name),
+            'id': fullname.split('_', 1)[-1],
+            'total_karma': getattr(partial, 'link_karma', 0) + getattr(partial, 'comment_karma', 0),
+            'created_utc': getattr(partial, 'created_utc', None)
+        })
+
+    return fields
+
+
+def post_authors(posts:list) -> dict:
+    '''
+    username -> account fullname (`t2_...`) for the authors of `posts`.
+    deleted authors have neither, and get skipped.
+    '''
+    authors = {}
+    for post in posts:
+        fullname = getattr(post, 'author_fullname', None)
+        if post.author is not None and fullname:
+            authors[post.author.name] = fullname
+
+    return authors
+
+
+############
+# THE THING!
+############
+class AuthorCache:
+
+    def __init__(self,
+                 path:str=AUTHOR_CACHE_DB,
+                 ttl:float=DEFAULT_TTL,
+                 max_entries:int=DEFAULT_MAX_ENTRIES):
+        '''
+        args:
+            - path: str, the sqlite db. every run pointing at the same file
+              shares the same cache.
+            - ttl: float, seconds after which an entry gets re-fetched
+            - max_entries: int, entries to keep. the least recently used
+              go first.
+
+        only use it from one thread (asyncio tasks on one loop are fine).
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.db = sqlite3.connect(path)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+        # some counters - handy for logging
+        self.stats = {'hits': 0, 'misses': 0, 'requests': 0, 'evicted': 0}
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM authors').fetchone()[0]
+
+    def get_many(self, names:list) -> dict:
+        '''
+        username -> fields for the `names` we have fresh entries for.
+        counts as a use for LRU.
+        '''
+        now = time.time()
+        names = list(set(names))
+        out = {}
+        for i in range(0, len(names), 500):
+            chunk = names[i:i+500]
+            rows = self.db.execute(f'SELECT name, fields FROM authors WHERE name IN ({",".join("?"*len(chunk))}) AND fetched >= ?',
+                                   chunk+[now-self.ttl])
+            out.update({name: json.loads(fields) for name, fields in rows})
+
+        with self.db:
+            self.db.executemany('UPDATE authors SET used=? WHERE name=?', [(now, name) for name in out])
+
+        self.stats['hits'] += len(out)
+        self.stats['misses'] += len(names) - len(out)
+
+        return out
+
+    def put_many(self, authors:dict):
+        '''
+        stores username -> fields, then evicts down to `max_entries`
+        '''
+        now = time.time()
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO authors (name, fields, fetched, used) VALUES (?, ?, ?, ?)',
+                                [(name, json.dumps(fields), now, now) for name, fields in authors.items()])
+
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                self.db.execute('DELETE FROM authors WHERE name IN (SELECT name FROM authors ORDER BY used LIMIT ?)', (excess,))
+                self.stats['evicted'] += excess
+
+    def _plan(self, posts:list):
+        '''
+        (cached fields, {username: fullname} still to fetch) for `posts`
+        '''
+        authors = post_authors(posts)
+        cached = self.get_many(list(authors))
+        missing = {name: fullname for name, fullname in authors.items() if name not in cached}
+
+        return cached, missing
+
+    def _store(self, cached:dict, missing:dict, partials:dict) -> dict:
+        fetched = {name: partial_to_fields(name, fullname, partials.get(fullname))
+                   for name, fullname in missing.items()}
+        if fetched:
+            self.put_many(fetched)
+        cached.update(fetched)
+
+        return cached
+
+    def resolve(self, reddit, posts:list) -> dict:
+        '''
+        username -> author fields for everyone who wrote one of `posts`,
+        fetching the misses in bulk with a praw `reddit` instance
+        '''
+        cached, missing = self._plan(posts)
+
+        partials = {}
+        fullnames = list(missing.values())
+        for i in range(0, len(fullnames), BULK_LIMIT):
+            self.stats['requests'] += 1
+            for partial in reddit.redditors.partial_redditors(fullnames[i:i+BULK_LIMIT]):
+                partials[partial.fullname] = partial
+
+        return self._store(cached, missing, partials)
+
+    async def resolve_async(self, reddit, posts:list) -> dict:
+        '''
+        `resolve` for an asyncpraw `reddit` instance
+        '''
+        cached, missing = self._plan(posts)
+
+        partials = {}
+        fullnames = list(missing.values())
+        for i in range(0, len(fullnames), BULK_LIMIT):
+            self.stats['requests'] += 1
+            async for partial in reddit.redditors.partial_redditors(fullnames[i:i+BULK_LIMIT]):
+                partials[partial.fullname] = partial
+
+        return self._store(cached, missing, partials)
+
+    def log_stats(self):
+        logging.info(f'author cache: {len(self)} entries, {self.stats}')
+
+    def close(self):
+        self.db.close()
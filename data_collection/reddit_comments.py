@@ -0,0 +1,148 @@
+# reddit_comments.py
+
+# DATA COLLECTION: REDDIT
+# collecting the comments of selected submissions (e.g. match threads) -
+# we only used to keep the submissions themselves.
+
+# `collect_comments` fetches several submissions at once on one asyncpraw
+# client (sharing its rate limiter, like `reddit_async.py`), and for each:
+# - walks the comment forest breadth first, writing comments out in
+#   batches as it goes, rather than building the full tree with
+#   `replace_more` + `list()` and holding it until the end
+# - expands "load more comments" stubs one at a time, up to a
+#   `replace_more` budget per submission (the same `limit`/`threshold`
+#   semantics as praw's `replace_more`). what's left unexpanded gets
+#   counted, so we know how much of a thread we've got
+# - takes author fields from the shared `AuthorCache`, in bulk per batch
+# - pulls urls out of comment bodies with our usual url pattern
+
+# needs asyncpraw (`pip install asyncpraw`), unlike the sequential reddit code.
+
+############
+# IMPORTS
+############
+import asyncio
+import logging
+import time
+from collections import deque
+import asyncpraw
+from asyncpraw.models import MoreComments
+from jsonl_writer import JsonlWriter
+from reddit_authors import AuthorCache, BULK_LIMIT
+from reddit_normalization import reddit_comment_to_dict
+
+############
+# CONSTANTS
+############
+# "load more comments" stubs we expand per submission, by default. each
+# one is a request.
+DEFAULT_REPLACE_MORE = 32
+
+############
+# FUNCTIONS
+############
+async def collect_submission(reddit:asyncpraw.Reddit,
+                             submission_id:str,
+                             writer:JsonlWriter,
+                             cache:AuthorCache,
+                             replace_more:int=DEFAULT_REPLACE_MORE,
+                             threshold:int=0) -> dict:
+    '''
+    writes all comments of one submission we can get within the budget.
+
+    args:
+        - replace_more: int, max number of "load more comments" stubs to
+          expand. None expands all of them, 0 none.
+        - threshold: int, only expand stubs standing for at least this many
+          comments
+
+    returns:
+        - dict with `submission`, `comments` written, `expanded` stubs,
+          `unexpanded` comments (as reddit counts them) and `seconds`
+    '''
+    start = time.monotonic()
+    stats = {'submission': submission_id, 'comments': 0, 'expanded': 0, 'unexpanded': 0, 'seconds': None}
+
+    submission = await reddit.submission(submission_id)
+    queue = deque(submission.comments)
+    # the forest stays around through `queue` only as long as we need it
+    del submission
+
+    batch = []
+
+    async def write_batch():
+        authors = await cache.resolve_async(reddit, batch)
+        for comment in batch:
+            writer.write(reddit_comment_to_dict(comment, authors=authors))
+        stats['comments'] += len(batch)
+        batch.clear()
+
+    while queue:
+        item = queue.popleft()
+        if isinstance(item, MoreComments):
+            within_budget = replace_more is None or stats['expanded'] < replace_more
+            if within_budget and item.count >= threshold:
+                stats['expanded'] += 1
+                queue.extend(await item.comments())
+            else:
+                stats['unexpanded'] += item.count
+            continue
+
+        batch.append(item)
+        queue.extend(item.replies)
+        if len(batch) >= BULK_LIMIT:
+            await write_batch()
+
+    if batch:
+        await write_batch()
+
+    stats['seconds'] = round(time.monotonic() - start, 3)
+    logging.info(f'collected {stats["comments"]} comments for submission {submission_id} in {stats["seconds"]}s, expanding {stats["expanded"]} stubs. {stats["unexpanded"]} comments left unexpanded.')
+
+    return stats
+
+
+async def collect_comments(submission_ids:list,
+                           outfile:str,
+                           reddit_kwargs:dict,
+                           max_concurrent:int=4,
+                           replace_more:int=DEFAULT_REPLACE_MORE,
+                           threshold:int=0,
+                           cache:AuthorCache=None) -> list:
+    '''
+    collects the comments of `submission_ids`, `max_concurrent` at a time,
+    into one jsonl `outfile`.
+
+    args:
+        - reddit_kwargs: dict, passed to `asyncpraw.Reddit` (client_id, ...)
+        - replace_more/threshold: see `collect_submission`
+        - cache: `AuthorCache` for author fields, defaults to the shared one
+
+    returns:
+        - list of per-submission stats dicts, see `collect_submission`.
+          failed submissions have a `status` of `failed`.
+    '''
+    if cache is None:
+        cache = AuthorCache()
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def collect(reddit, writer, submission_id):
+        async with semaphore:
+            try:
+                stats = await collect_submission(reddit, submission_id, writer, cache,
+                                                 replace_more=replace_more, threshold=threshold)
+                stats['status'] = 'done'
+            except Exception as e:
+                # one failing submission shouldn't take the others down
+                logging.exception(f'collecting comments for submission {submission_id} failed: {e}')
+                stats = {'submission': submission_id, 'status': 'failed', 'error': repr(e)}
+        return stats
+
+    with JsonlWriter(outfile, time_field='created_utc') as writer:
+        async with asyncpraw.Reddit(**reddit_kwargs) as reddit:
+            report = await asyncio.gather(*[collect(reddit, writer, submission_id) for submission_id in submission_ids])
+
+    logging.info(f'collected {sum(stats.get("comments", 0) for stats in report)} comments from {len(report)} submissions.')
+    cache.log_stats()
+
+    return report
@@ -0,0 +1,155 @@
+# reddit_normalization.py
+
+# DATA COLLECTION: REDDIT
+# turning reddit posts and comments into the dicts we write out. used to
+# live in `get_reddit_posts.py`; it's shared now that posts come from
+# either praw or asyncpraw (see `reddit_async.py`), and comments from
+# `reddit_comments.py`.
+
+############
+# IMPORTS
+############
+import datetime as dt
+import praw
+from prawcore.exceptions import NotFound
+from tweet_normalization import extract_urls
+
+# asyncpraw is only needed for `get_reddit_posts.py --async`
+try:
+    import asyncpraw
+    SUBMISSION_TYPES = (praw.models.reddit.submission.Submission, asyncpraw.models.reddit.submission.Submission)
+    COMMENT_TYPES = (praw.models.reddit.comment.Comment, asyncpraw.models.reddit.comment.Comment)
+except ImportError:
+    SUBMISSION_TYPES = (praw.models.reddit.submission.Submission,)
+    COMMENT_TYPES = (praw.models.reddit.comment.Comment,)
+
+############
+# CONSTANTS
+############
+TIME_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+CORE_FIELDS = ['id', 'created_utc', 'title', 'selftext', 'domain', 'url', 'num_comments', 'score', 'ups', 'downs', 'author']
+CORE_USER_FIELDS = ['name', 'id', 'total_karma', 'verified', 'created_utc']
+CORE_COMMENT_FIELDS = ['id', 'created_utc', 'body', 'score', 'parent_id', 'link_id', 'depth', 'controversiality']
+
+############
+# FUNCTIONS
+############
+def get_user_attribute(user:praw.models.reddit.redditor.Redditor,
+                       attribute:str):
+    '''
+    helper function for getting user-level attributes from a praw
+    redditor object. this function avoids breaking code due to
+    missing attributes when throwing an attribute error
+    '''
+    try:
+        val = getattr(user, attribute, None)
+    except NotFound:
+        val = None
+
+    return val
+
+
+def reddit_post_to_dict(post:praw.models.reddit.submission.Submission,
+                        custom_fields:list=None,
+                        overwrite_core_fields:bool=False,
+                        convert_timestamp:bool=True,
+                        authors:dict=None) -> dict:
+    '''
+    function that converts an object of the praw.submission type
+    into a dict. this is useful primarily in order to serialise this
+    to json and write out to file.
+
+    asyncpraw submissions work too. asyncpraw doesn't fetch lazily, so
+    pass their `authors`.
+
+    args:
+        - post, a submission ('post') in a subreddit retrieved via praw
+        - custom_fields, a list of strings containing additional fields returned by
+          praw which are to be retained
+        - overwrite_core_fields, bool, indicates whether core (standard) fields
+          of the output dict are to be retained, or whether they should be replaced
+          entirely by 'custom_fields'
+        - authors, dict, username -> author fields (see `reddit_authors.AuthorCache`).
+          if given, author fields come from here rather than from `post.author`,
+          which saves praw fetching every post's author.
+    '''
+    if not isinstance(post, SUBMISSION_TYPES):
+        raise TypeError('post must be a praw submission object')
+
+    if overwrite_core_fields:
+        if not custom_fields:
+            raise ValueError('custom_fields is not defined')
+
+    core_fields = list(CORE_FIELDS)
+    if overwrite_core_fields:
+        core_fields = custom_fields
+    elif isinstance(custom_fields, list) and len(custom_fields)>0:
+        core_fields += custom_fields
+
+    tmp_dict = vars(post)
+    out = {field:tmp_dict[field] for field in core_fields if field in tmp_dict.keys()}
+
+    if 'created_utc' in out.keys():
+        if convert_timestamp:
+            out['created_utc'] = dt.datetime.fromtimestamp(out['created_utc']).strftime(TIME_FORMAT)
+
+    if 'author' in out.keys():
+        # we will now process the author object and append to our out object
+        if authors is not None:
+            user = authors.get(post.author.name, {}) if post.author is not None else {}
+            user_dict = {'user_'+field:user.get(field) for field in CORE_USER_FIELDS}
+        else:
+            user_dict = {'user_'+field:get_user_attribute(user=post.author, attribute=field) for field in CORE_USER_FIELDS}
+
+        del out['author']
+
+        out.update(user_dict)
+
+        if convert_timestamp:
+            if 'user_created_utc' in out.keys() and isinstance(out['user_created_utc'], float):
+                out['user_created_utc'] = dt.datetime.fromtimestamp(out['user_created_utc']).strftime(TIME_FORMAT)
+
+    return out
+
+
+def reddit_comment_to_dict(comment:praw.models.reddit.comment.Comment,
+                           authors:dict=None,
+                           convert_timestamp:bool=True) -> dict:
+    '''
+    the comment counterpart of `reddit_post_to_dict`. adds the sub's name
+    and the urls in the comment's body (extracted the same way as from
+    tweet texts). `link_id` is the fullname of the comment's submission,
+    `parent_id` the fullname of the comment or submission it replies to.
+
+    args:
+        - comment, a praw/asyncpraw comment
+        - authors, dict, username -> author fields (see `reddit_authors.AuthorCache`).
+          without it, author fields come from the lazy `comment.author` (praw only)
+    '''
+    if not isinstance(comment, COMMENT_TYPES):
+        raise TypeError('comment must be a praw comment object')
+
+    tmp_dict = vars(comment)
+    out = {field:tmp_dict[field] for field in CORE_COMMENT_FIELDS if field in tmp_dict.keys()}
+    # str() of the lazy subreddit object is its name, no fetch needed
+    out['subreddit'] = str(comment.subreddit)
+
+    urls = extract_urls(out.get('body') or '')
+    if urls:
+        out['urls'] = urls
+
+    if convert_timestamp and 'created_utc' in out.keys():
+        out['created_utc'] = dt.datetime.fromtimestamp(out['created_utc']).strftime(TIME_FORMAT)
+
+    if authors is not None:
+        user = authors.get(comment.author.name, {}) if comment.author is not None else {}
+        user_dict = {'user_'+field:user.get(field) for field in CORE_USER_FIELDS}
+    else:
+        user_dict = {'user_'+field:get_user_attribute(user=comment.author, attribute=field) for field in CORE_USER_FIELDS}
+    out.update(user_dict)
+
+    if convert_timestamp and isinstance(out['user_created_utc'], float):
+        out['user_created_utc'] = dt.datetime.fromtimestamp(out['user_created_utc']).strftime(TIME_FORMAT)
+
+    return out
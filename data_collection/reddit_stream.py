@@ -0,0 +1,227 @@
+# reddit_stream.py
+
+# DATA COLLECTION: REDDIT
+# collecting reddit posts continuously. `get_reddit_posts.py` polls each
+# subreddit's `new` listing from cron and stops at the newest post we
+# already have - but a listing only goes back 1000 posts, so in busy
+# periods whatever came in before that between two runs is lost for good.
+
+# `stream_subreddits` instead keeps one submission stream open across all
+# our subreddits:
+# - on start, it catches up on each sub's `new` listing down to where the
+#   last run stopped, then switches to the stream
+# - posts go to one `RotatingWriter` per sub, so a new file starts every
+#   hour (by default) in the sub's usual out dir
+# - posts get deduplicated by id against the most recent ids per sub,
+#   across restarts
+# - where we're up to lives in a small state file (newest post and recent
+#   ids per sub), rather than being re-derived from our data files. it's
+#   saved after every response from reddit, once the posts it covers have
+#   been flushed to disk, so it never runs ahead of the data.
+# - dropped connections/server errors get retried with exponential backoff
+
+############
+# IMPORTS
+############
+import os
+import json
+import logging
+import datetime as dt
+import time
+from collections import deque
+import praw
+from prawcore.exceptions import RequestException, ResponseException, ServerError
+from rotating_writer import RotatingWriter
+from reddit_authors import AuthorCache, BULK_LIMIT
+from reddit_normalization import reddit_post_to_dict
+
+############
+# CONSTANTS
+############
+# ids per sub we dedup against. the stream replays at most the last 100
+# posts across all subs when it (re)connects.
+RECENT_IDS = 1000
+
+# the most reddit hands out per listing
+LISTING_LIMIT = 1000
+
+# reconnect backoff, in seconds: starts at MIN, doubles up to MAX
+MIN_BACKOFF = 1
+MAX_BACKOFF = 320
+
+RETRYABLE = (RequestException, ResponseException, ServerError)
+
+############
+# THE THING!
+############
+class StreamState:
+
+    def __init__(self, path:str, max_recent:int=RECENT_IDS):
+        '''
+        per sub: the creation time of the newest post we've written, and
+        the ids of the last `max_recent` posts. kept in a json file at `path`.
+        '''
+        self.path = path
+        self.max_recent = max_recent
+        self.newest = {}
+        self.recent = {}
+        self._recent_sets = {}
+
+        if os.path.isfile(path):
+            with open(path, 'r') as infile:
+                state = json.load(infile)
+            for sub, sub_state in state['subreddits'].items():
+                self.newest[sub] = sub_state['newest']
+                self.recent[sub] = deque(sub_state['recent'], maxlen=max_recent)
+                self._recent_sets[sub] = set(self.recent[sub])
+
+    def cutoff(self, sub:str) -> dt.datetime:
+        '''
+        the newest post we've got for `sub`, None if we've got none
+        '''
+        if self.newest.get(sub) is None:
+            return None
+
+        return dt.datetime.fromtimestamp(self.newest[sub])
+
+    def seen(self, sub:str, post_id:str) -> bool:
+        return post_id in self._recent_sets.get(sub, ())
+
+    def add(self, sub:str, post):
+        if sub not in self.recent:
+            self.recent[sub] = deque(maxlen=self.max_recent)
+            self._recent_sets[sub] = set()
+
+        recent = self.recent[sub]
+        if len(recent)==recent.maxlen:
+            self._recent_sets[sub].discard(recent[0])
+        recent.append(post.id)
+        self._recent_sets[sub].add(post.id)
+
+        if self.newest.get(sub) is None or post.created > self.newest[sub]:
+            self.newest[sub] = post.created
+
+    def save(self):
+        '''
+        writes the state atomically, so a crash mid-write leaves the
+        previous one intact
+        '''
+        state = {
+            'updated': dt.datetime.now().isoformat(),
+            'subreddits': {sub: {'newest': self.newest.get(sub), 'recent': list(self.recent.get(sub, []))}
+                           for sub in set(self.newest) | set(self.recent)}
+        }
+        tmp_path = self.path+'.tmp'
+        with open(tmp_path, 'w') as o:
+            o.write(json.dumps(state))
+        os.replace(tmp_path, self.path)
+
+
+def stream_subreddits(reddit:praw.Reddit,
+                      subreddits:list,
+                      out_dirs:dict,
+                      state:StreamState,
+                      cutoffs:dict=None,
+                      cache:AuthorCache=None,
+                      rotate_minutes:int=60,
+                      kill_time:float=0,
+                      catch_up:bool=True) -> dict:
+    '''
+    streams new posts from all `subreddits` until `kill_time` minutes
+    have passed, or forever if it's 0.
+
+    args:
+        - out_dirs: dict, sub -> dir its files go to, as `{sub}_{stamp}.json`
+        - state: `StreamState`, where the last run stopped and this one is up to
+        - cutoffs: dict, sub -> datetime of the newest post we've got, for
+          subs the state doesn't know yet (e.g. from `extract_newest_date`)
+        - cache: `AuthorCache` for author fields, defaults to the shared one
+        - rotate_minutes: int, start a new file per sub every n minutes
+        - catch_up: bool, go through each sub's `new` listing down to its
+          cutoff before streaming
+
+    returns:
+        - dict, sub -> n posts written
+    '''
+    if cache is None:
+        cache = AuthorCache()
+    cutoffs = {sub: state.cutoff(sub) or (cutoffs or {}).get(sub) for sub in subreddits}
+    # the stream gives us display names, which needn't match our casing
+    subs_by_name = {sub.lower(): sub for sub in subreddits}
+    deadline = time.monotonic() + kill_time*60 if kill_time else None
+
+    writers = {sub: RotatingWriter(out_dirs[sub], sub+'_', rotate_minutes=rotate_minutes, time_field='created_utc')
+               for sub in subreddits}
+    counts = {sub: 0 for sub in subreddits}
+    batch = []
+
+    def keep(post) -> str:
+        '''
+        the sub `post` goes to, None if we've already got it
+        '''
+        sub = subs_by_name.get(post.subreddit.display_name.lower())
+        if sub is None or state.seen(sub, post.id):
+            return None
+        if cutoffs[sub] is not None and dt.datetime.fromtimestamp(post.created) < cutoffs[sub]:
+            return None
+        return sub
+
+    def write_batch():
+        if batch:
+            authors = cache.resolve(reddit, [post for _, post in batch])
+            for sub, post in batch:
+                writers[sub].write(reddit_post_to_dict(post, authors=authors))
+                state.add(sub, post)
+                counts[sub] += 1
+            batch.clear()
+        # the data first, then the state saying we've got it
+        for writer in writers.values():
+            writer.flush()
+        state.save()
+
+    def add(post):
+        sub = keep(post)
+        # a sub's listing/the stream can repeat a post within a batch
+        if sub is not None and not any(post.id==queued.id for _, queued in batch):
+            batch.append((sub, post))
+        if len(batch) >= BULK_LIMIT:
+            write_batch()
+
+    try:
+        if catch_up:
+            for sub in subreddits:
+                logging.info(f'catching up on {sub} down to {cutoffs[sub]}.')
+                for post in reddit.subreddit(sub).new(limit=LISTING_LIMIT):
+                    if cutoffs[sub] is not None and dt.datetime.fromtimestamp(post.created) < cutoffs[sub]:
+                        break
+                    add(post)
+                write_batch()
+            logging.info(f'caught up: {counts}')
+
+        backoff = MIN_BACKOFF
+        while deadline is None or time.monotonic() < deadline:
+            try:
+                # pause_after=-1: a None after every response, so we write
+                # and save state per response, and notice the deadline
+                stream = reddit.subreddit('+'.join(subreddits)).stream.submissions(pause_after=-1)
+                for post in stream:
+                    if post is None:
+                        write_batch()
+                        backoff = MIN_BACKOFF
+                        if deadline is not None and time.monotonic() >= deadline:
+                            break
+                        continue
+                    add(post)
+            except RETRYABLE as e:
+                write_batch()
+                logging.warning(f'submission stream dropped ({e}). reconnecting in {backoff} seconds.')
+                time.sleep(backoff)
+                backoff = min(backoff*2, MAX_BACKOFF)
+    finally:
+        write_batch()
+        for writer in writers.values():
+            writer.close()
+        logging.info(f'stopped streaming. posts written per sub: {counts}')
+        cache.log_stats()
+
+    return counts
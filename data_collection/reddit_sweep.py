@@ -0,0 +1,121 @@
+# reddit_sweep.py
+
+# DATA COLLECTION: REDDIT
+# getting past the 1000 post cap of a subreddit listing. on heavy days
+# (r/soccer on a match day) `new(limit=1000)` doesn't reach back to the
+# newest post of our last run, and whatever's in between is lost.
+
+# a sweep goes through several listings of a sub - `new`, `hot`, `rising`,
+# `top` and `controversial` of the day - each capped separately, so
+# together they reach posts `new` alone can't. posts get merged through an
+# in-memory id set, seeded with the ids we've already collected in the
+# sweep window (read from the files the manifests say cover it), so only
+# new posts get written.
+
+# every listing reports how many posts it went through and how many new
+# ones it added on top of the listings before it - `new` goes first, so
+# the others show the coverage they add to what we used to get.
+
+############
+# IMPORTS
+############
+import json
+import logging
+import datetime as dt
+import praw
+from manifest import files_covering
+from reddit_normalization import TIME_FORMAT
+
+############
+# CONSTANTS
+############
+# in this order - each listing gets credited for what the ones before it missed
+LISTINGS = ['new', 'hot', 'rising', 'top', 'controversial']
+
+# the most reddit hands out per listing
+LISTING_LIMIT = 1000
+
+############
+# FUNCTIONS
+############
+def known_ids(sub_dir:str, since:dt.datetime) -> set:
+    '''
+    ids of the posts we've already collected in `sub_dir` that were
+    created since `since`. only opens the files whose manifests say they
+    hold such posts.
+    '''
+    ids = set()
+    for path in files_covering(sub_dir, since.strftime(TIME_FORMAT), dt.datetime.max.strftime(TIME_FORMAT),
+                               build_missing=True, time_field='created_utc'):
+        with open(path, 'r') as infile:
+            for line in infile:
+                if line.strip():
+                    ids.add(json.loads(line)['id'])
+
+    return ids
+
+
+def listing(subreddit:praw.models.Subreddit, name:str, limit:int=LISTING_LIMIT):
+    '''
+    one of the `LISTINGS` of `subreddit`. `top`/`controversial` are of the day.
+    '''
+    if name in ['top', 'controversial']:
+        return getattr(subreddit, name)(time_filter='day', limit=limit)
+
+    return getattr(subreddit, name)(limit=limit)
+
+
+def sweep(subreddit:praw.models.Subreddit,
+          known:set,
+          since:dt.datetime,
+          report:dict,
+          listings:list=LISTINGS,
+          limit:int=LISTING_LIMIT):
+    '''
+    yields every post in `listings` of `subreddit` that was created since
+    `since` and isn't in `known` yet - each only once. adds their ids to
+    `known`.
+
+    args:
+        - known: set of post ids we've already got, see `known_ids`
+        - report: dict, gets `{listing: {'seen': n, 'new': n}}` filled in
+    '''
+    for name in listings:
+        stats = report[name] = {'seen': 0, 'new': 0}
+        for post in listing(subreddit, name, limit=limit):
+            if dt.datetime.fromtimestamp(post.created) < since:
+                # `new` is sorted by time, so the rest is older still
+                if name=='new':
+                    break
+                continue
+
+            stats['seen'] += 1
+            if post.id in known:
+                continue
+
+            known.add(post.id)
+            stats['new'] += 1
+            yield post
+
+        logging.info(f'{subreddit.display_name} {name}: {stats["new"]} new posts out of {stats["seen"]} in the sweep window.')
+
+
+def coverage_report(reports:dict) -> dict:
+    '''
+    totals per listing across all subs, with each listing's share of the
+    new posts
+
+    args:
+        - reports: dict, sub -> the `report` filled in by `sweep`
+    '''
+    totals = {name: {'seen': 0, 'new': 0} for name in LISTINGS}
+    for report in reports.values():
+        for name, stats in report.items():
+            totals[name]['seen'] += stats['seen']
+            totals[name]['new'] += stats['new']
+
+    n_new = sum(stats['new'] for stats in totals.values())
+    for stats in totals.values():
+        stats['share'] = round(stats['new']/n_new, 3) if n_new else 0.0
+
+    return totals
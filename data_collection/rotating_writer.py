@@ -0,0 +1,153 @@
+# rotating_writer.py
+
+# DATA COLLECTION: SHARED
+# a jsonl writer for collectors that never stop (our twitter and reddit
+# streams): rather than one outfile per run, it moves on to a new file on
+# the clock (e.g. on the hour) and/or once a file gets too big. each file
+# is a regular `JsonlWriter` outfile, with its own manifest.
+
+############
+# IMPORTS
+############
+import os
+import json
+import logging
+import datetime
+import threading
+from jsonl_writer import JsonlWriter
+from tweet_normalization import check_path_exists
+
+############
+# CONSTANTS
+############
+STAMP_FORMAT = '%Y_%m_%d-%H_%M_%S'
+
+############
+# THE THING!
+############
+class RotatingWriter:
+
+    def __init__(self,
+                 out_dir:str,
+                 prefix:str,
+                 rotate_minutes:int=0,
+                 rotate_bytes:int=0,
+                 on_record=None,
+                 on_rotate=None,
+                 **writer_kwargs):
+        '''
+        a `JsonlWriter` that moves on to a new file every `rotate_minutes`
+        (aligned to the clock, so 60 rotates on the hour) and/or once a
+        file holds `rotate_bytes`. files are named
+        `{out_dir}{prefix}{segment start:STAMP_FORMAT}.json`.
+
+        args:
+            - rotate_minutes/rotate_bytes: int, 0 to not rotate on time/size
+            - on_record: optional callable, gets every record before it's
+              written - in the same segment it's written to
+            - on_rotate: optional callable, gets the segment dict (`path`,
+              `stamp`, `started`, `ended`, `n_records`, `bytes`) of every
+              file we're done with, including the last one on `close`
+            - writer_kwargs: passed on to every `JsonlWriter`
+        '''
+        self.out_dir = os.path.join(out_dir, '')
+        self.prefix = prefix
+        self.rotate_minutes = rotate_minutes
+        self.rotate_bytes = rotate_bytes
+        self.on_record = on_record
+        self.on_rotate = on_rotate
+        self.writer_kwargs = writer_kwargs
+
+        self._lock = threading.RLock()
+        self.closed = False
+        self.n_rotations = 0
+        self.segment = None
+        self._open(datetime.datetime.now())
+
+        # rotates quiet streams on time, too
+        self._stop = threading.Event()
+        self._timer = None
+        if rotate_minutes:
+            self._timer = threading.Thread(target=self._rotate_on_time, name='RotatingWriter', daemon=True)
+            self._timer.start()
+
+    def _open(self, now:datetime.datetime):
+        stamp = now.strftime(STAMP_FORMAT)
+        # size-based rotations can come more than once a second
+        if self.segment is not None and self.segment['stamp'].startswith(stamp):
+            stamp = f'{stamp}-{self.n_rotations+1}'
+        path = check_path_exists(f'{self.out_dir}{self.prefix}{stamp}.json')
+        self.writer = JsonlWriter(path, **self.writer_kwargs)
+        self.segment = {'path': path, 'stamp': stamp, 'started': now, 'ended': None, 'n_records': 0, 'bytes': 0}
+
+        self.next_rotation = None
+        if self.rotate_minutes:
+            interval = self.rotate_minutes*60
+            self.next_rotation = datetime.datetime.fromtimestamp((now.timestamp()//interval + 1)*interval)
+
+    def _close_segment(self, now:datetime.datetime):
+        self.writer.close()
+        self.segment['ended'] = now
+        if self.on_rotate is not None:
+            self.on_rotate(self.segment)
+
+    def _maybe_rotate(self):
+        '''
+        callers must hold the lock
+        '''
+        now = datetime.datetime.now()
+        due = self.next_rotation is not None and now >= self.next_rotation
+        full = self.rotate_bytes and self.segment['bytes'] >= self.rotate_bytes
+        if due or full:
+            self._close_segment(now)
+            self._open(now)
+            self.n_rotations += 1
+            logging.info(f'rotated tweet file, now writing to {self.segment["path"]}.')
+
+    def _rotate_on_time(self):
+        while True:
+            with self._lock:
+                if self.closed:
+                    return
+                self._maybe_rotate()
+                wait = (self.next_rotation - datetime.datetime.now()).total_seconds()
+            if self._stop.wait(min(max(wait, 0.1), 60)):
+                return
+
+    def write(self, record:dict):
+        self.write_line(json.dumps(record)+'\n', record=record)
+
+    def write_line(self, line:str, record:dict=None):
+        with self._lock:
+            if self.closed:
+                raise ValueError(f'rotating writer for {self.out_dir}{self.prefix}* is already closed.')
+            self._maybe_rotate()
+
+            if record is None:
+                record = json.loads(line)
+            if self.on_record is not None:
+                self.on_record(record)
+
+            self.writer.write_line(line, record=record)
+            self.segment['n_records'] += 1
+            self.segment['bytes'] += len(line.encode('utf-8'))
+
+    def flush(self):
+        with self._lock:
+            if not self.closed:
+                self.writer.flush()
+
+    def close(self):
+        '''
+        closes the current file (with its `on_rotate`). safe to call more
+        than once.
+        '''
+        with self._lock:
+            if self.closed:
+                return
+            self._close_segment(datetime.datetime.now())
+            self.closed = True
+
+        self._stop.set()
+        if self._timer is not None and self._timer is not threading.current_thread():
+            self._timer.join()
@@ -0,0 +1,650 @@
+# search_scheduler.py
+
+# DATA COLLECTION: SHARED
+# running twitter searches over several time windows from within one
+# process. `get_mers_tweets.py` and `get_final_tweets.py` used to loop over
+# `os.system('python3 get_tweets_search.py ...')`, which re-imported tweepy,
+# re-authenticated and re-read the search terms for every window, ran them
+# strictly one after the other, and aborted the whole run on the first failure.
+
+# here:
+# - `build_windows` turns a campaign spec (start, window size, count) into
+#   the same list-of-dicts `time_chunks` our scripts have always used
+# - `build_queries` packs all our search terms into as few queries as the
+#   query length limit allows
+# - `search_window` collects one window: paginate, normalise, write. with
+#   several queries, they run concurrently and get merged by tweet id
+# - `SearchScheduler` runs the windows concurrently on one shared client and
+#   one shared rate-limit budget, retries failed windows and logs progress
+
+############
+# IMPORTS
+############
+import os
+import json
+import logging
+import datetime
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+import tweepy
+from jsonl_writer import JsonlWriter
+from manifest import manifest_path, write_manifest
+from query_planner import plan_queries, read_terms, JOINER, MAX_QUERY_LENGTH
+from heavy_hitters import new_counter, restore_counts
+from rate_limit import TokenBucket, ENDPOINT_LIMITS
+from tweet_normalization import (normalize_response, sort_counts, total_domain_entity_counts,
+                                 EXPANSIONS, TWEET_FIELDS, MEDIA_FIELDS, USER_FIELDS)
+
+############
+# CONSTANTS
+############
+# the search endpoint rejects end times too close to now
+MIN_END_TIME_LAG = datetime.timedelta(seconds=30)
+
+# pages between checkpoints of the domain/entity counts. the pages in
+# between get recounted from the tweet file on resume.
+COUNTS_EVERY = 20
+
+# what we retry a window on
+RETRYABLE = (tweepy.TwitterServerError, tweepy.TooManyRequests, requests.exceptions.RequestException)
+
+############
+# FUNCTIONS
+############
+def build_queries(search_terms_path:str, max_length:int=MAX_QUERY_LENGTH) -> list:
+    '''
+    all terms of a search terms file (one per line), packed into the fewest
+    `(term) OR (term) ...` queries the endpoint's length limit allows.
+    see `query_planner.py`.
+    '''
+    return plan_queries(read_terms(search_terms_path), max_length=max_length)
+
+
+def build_windows(start:datetime.datetime,
+                  window:datetime.timedelta,
+                  count:int,
+                  tweets_dir:str,
+                  meta_dir:str,
+                  prefix:str='tweets_',
+                  stamp_format:str='%Y_%m_%d-%H_%M_%S',
+                  step:datetime.timedelta=None) -> list:
+    '''
+    builds `count` consecutive search windows of length `window`, starting
+    at `start`, each with its own tweet and meta outfiles.
+
+    args:
+        - step: time between window starts. defaults to `window`.
+        - prefix/stamp_format: tweet outfiles are named
+          `{tweets_dir}{prefix}{start:stamp_format}.json`
+
+    returns:
+        - list of dicts with keys `start_time`, `end_time`, `tweets_path`,
+          `domains_path`, `entities_path`
+    '''
+    step = step or window
+    tweets_dir = os.path.join(tweets_dir, '')
+    meta_dir = os.path.join(meta_dir, '')
+
+    windows = []
+    for i in range(count):
+        window_start = start + i*step
+        stamp = window_start.strftime('%Y_%m_%d-%H_%M_%S')
+        windows.append({
+            'start_time': window_start,
+            'end_time': window_start + window,
+            'tweets_path': tweets_dir+prefix+window_start.strftime(stamp_format)+'.json',
+            'domains_path': meta_dir+'domains_'+stamp+'.json',
+            'entities_path': meta_dir+'entities_'+stamp+'.json'
+        })
+
+    return windows
+
+
+def clip_window(window:dict, now:datetime.datetime=None):
+    '''
+    clips a window's end time to just before now. returns None for
+    windows that start in the future. naive datetimes are taken as utc,
+    the same as tweepy does.
+    '''
+    start_time = window['start_time']
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if start_time.tzinfo is None:
+            now = now.replace(tzinfo=None)
+    latest = now - MIN_END_TIME_LAG
+
+    if start_time >= latest:
+        return None
+    if window['end_time'] > latest:
+        window = dict(window, end_time=latest)
+
+    return window
+
+
+def paced(method, budget:TokenBucket):
+    '''
+    wraps a client method so every call first takes a token from `budget`.
+    keeps the method's name, which tweepy's Paginator looks at to decide
+    between `next_token` and `pagination_token`.
+    '''
+    if budget is None:
+        return method
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        budget.acquire()
+        return method(*args, **kwargs)
+
+    return wrapper
+
+
+def checkpoint_path(window:dict) -> str:
+    '''
+    where a window's pagination checkpoint lives: next to its tweet file,
+    unless the window names one
+    '''
+    return window.get('checkpoint_path') or window['tweets_path']+'.checkpoint'
+
+
+def load_checkpoint(path:str, query:str, window:dict):
+    '''
+    reads a window's checkpoint. returns None if there's none, or if it
+    belongs to a different query or window start (e.g. the search terms
+    changed) - its `next_token` would be meaningless then.
+    '''
+    try:
+        with open(path, 'r') as infile:
+            checkpoint = json.load(infile)
+    except FileNotFoundError:
+        return None
+
+    if checkpoint['query']!=query or checkpoint['start_time']!=window['start_time'].isoformat():
+        logging.warning(f'ignoring checkpoint {path}, it is for a different query or window.')
+        return None
+
+    return checkpoint
+
+
+def save_checkpoint(path:str, checkpoint:dict):
+    '''
+    writes a checkpoint atomically, so a crash mid-write leaves the
+    previous one intact
+    '''
+    tmp_path = path+'.tmp'
+    with open(tmp_path, 'w') as o:
+        o.write(json.dumps(checkpoint))
+    os.replace(tmp_path, path)
+
+
+def recount(tweets_path:str, start:int, end:int, domains_session, entities_session):
+    '''
+    adds the domain/entity counts of the tweets between byte `start` and
+    byte `end` of a tweet file to the session counters - for the pages a
+    resumed window wrote after its last counts checkpoint
+    '''
+    with open(tweets_path, 'rb') as infile:
+        infile.seek(start)
+        for line in infile:
+            if start >= end:
+                break
+            start += len(line)
+            out = json.loads(line)
+            if 'domains' in out:
+                total_domain_entity_counts(domains_tweet=out['domains'],
+                                           domains_session=domains_session,
+                                           entities_tweet=out['entities'],
+                                           entities_session=entities_session)
+
+
+def last_page_done(checkpoint:dict) -> bool:
+    '''
+    whether a checkpoint already has a window's last page in it - pages
+    collected, and no token for a next one
+    '''
+    return checkpoint['pages'] > 0 and checkpoint['next_token'] is None
+
+
+def next_token(page):
+    '''
+    the paginator's token for the page after `page`, None on the last one
+    '''
+    meta = page.get('meta', {}) if isinstance(page, dict) else (page.meta or {})
+    return meta.get('next_token')
+
+
+def search_query(client:tweepy.Client,
+                 query:str,
+                 window:dict,
+                 max_pages:int=1000,
+                 budget:TokenBucket=None,
+                 top_k:int=0,
+                 mode:str='a',
+                 progress:dict=None) -> dict:
+    '''
+    collects all tweets matching one `query` in one time window: paginates the
+    recent search endpoint, normalises every page, writes tweets to the
+    window's tweet file and domain/entity counts to its meta files.
+
+    after every page, the paginator's `next_token`, the window bounds, our
+    counters and the tweet file's size go to a checkpoint file (see
+    `checkpoint_path`). the domain/entity counts only go in every
+    `COUNTS_EVERY` pages, with the tweet file size they cover. if there is
+    a checkpoint, we pick up from the next page: the tweet file gets cut
+    back to the checkpointed size, so a page written after the last
+    checkpoint doesn't end up in there twice, and the tweets written since
+    the counts were checkpointed get counted again from the file. a
+    finished window's checkpoint stays around, marked `done`, so running
+    it again is a no-op.
+
+    args:
+        - window: dict, as built by `build_windows`
+        - budget: optional shared `TokenBucket`, one token per page request
+        - top_k: see `heavy_hitters.new_counter`
+        - mode: `a` to resume from the checkpoint (or append to the tweet
+          file if there's none), `w` to start the window afresh
+        - progress: optional dict that gets `pages` and `tweets` updated
+          as we go, for progress reporting
+
+    returns:
+        - counters dict (`tweets`, `unresolved_authors`, `pages`)
+    '''
+    progress = progress if progress is not None else {}
+    path = checkpoint_path(window)
+
+    checkpoint = load_checkpoint(path, query, window) if mode=='a' else None
+    if checkpoint is None:
+        appending = mode=='a' and os.path.isfile(window['tweets_path'])
+        if appending and os.path.getsize(window['tweets_path']):
+            logging.warning(f'{window["tweets_path"]} exists without a checkpoint - appending to it.')
+        checkpoint = {
+            'query': query,
+            'start_time': window['start_time'].isoformat(),
+            'end_time': window['end_time'].isoformat(),
+            'next_token': None,
+            'done': False,
+            'pages': 0,
+            'tweets': 0,
+            'unresolved_authors': 0,
+            'offset': None,
+            'manifest': None,
+            'domains': None,
+            'entities': None,
+            'counts_offset': os.path.getsize(window['tweets_path']) if appending else 0
+        }
+    elif checkpoint['done']:
+        logging.info(f'window starting {window["start_time"]} is already complete, see {path}.')
+    elif last_page_done(checkpoint):
+        logging.info(f'window starting {window["start_time"]} got its last page before stopping, finishing it up.')
+    else:
+        logging.info(f'resuming window starting {window["start_time"]} from page {checkpoint["pages"]+1}.')
+
+    domains = restore_counts(checkpoint['domains'], top_k)
+    entities = restore_counts(checkpoint['entities'], top_k)
+    counters = {key: checkpoint[key] for key in ('tweets', 'unresolved_authors', 'pages')}
+    progress.update({'pages': counters['pages'], 'tweets': counters['tweets']})
+
+    if checkpoint['done']:
+        return counters
+
+    # drop whatever got written after the last checkpoint, and put the
+    # tweet file's manifest back to match
+    if checkpoint['offset'] is not None and os.path.isfile(window['tweets_path']):
+        with open(window['tweets_path'], 'r+b') as f:
+            f.truncate(checkpoint['offset'])
+        if checkpoint.get('manifest') is not None:
+            write_manifest(window['tweets_path'], checkpoint['manifest'])
+        counts_offset = checkpoint.get('counts_offset')
+        if counts_offset is not None and counts_offset < checkpoint['offset']:
+            recount(window['tweets_path'], counts_offset, checkpoint['offset'], domains, entities)
+
+    # the last page made it in, we just didn't get to finish up. a `None`
+    # token would have the paginator start over from page 1.
+    if not last_page_done(checkpoint):
+        search = paced(client.search_recent_tweets, budget)
+
+        # we page over the checkpoint's bounds, not the window's: a window
+        # clipped to `now` gets a new end time on every run, and a
+        # `next_token` is only valid for the exact query it came from
+        with JsonlWriter(window['tweets_path'], mode=mode) as writer:
+            for page in tweepy.Paginator(search,
+                                         query=query,
+                                         start_time=datetime.datetime.fromisoformat(checkpoint['start_time']),
+                                         end_time=datetime.datetime.fromisoformat(checkpoint['end_time']),
+                                         expansions=EXPANSIONS,
+                                         tweet_fields=TWEET_FIELDS,
+                                         media_fields=MEDIA_FIELDS,
+                                         user_fields=USER_FIELDS,
+                                         max_results=100,
+                                         limit=max(0, max_pages - counters['pages']),
+                                         pagination_token=checkpoint['next_token']):
+                records = normalize_response(page,
+                                             domains_session=domains,
+                                             entities_session=entities,
+                                             counters=counters)
+                for out in records:
+                    writer.write(out)
+
+                counters['pages'] += 1
+                progress['pages'] = counters['pages']
+                progress['tweets'] = counters['tweets']
+
+                writer.flush()
+                checkpoint.update(counters)
+                checkpoint.update({
+                    'next_token': next_token(page),
+                    'offset': os.path.getsize(window['tweets_path']),
+                    'manifest': writer.manifest.to_dict()
+                })
+                if counters['pages'] % COUNTS_EVERY==0:
+                    checkpoint.update({
+                        'domains': sort_counts(domains),
+                        'entities': sort_counts(entities),
+                        'counts_offset': checkpoint['offset']
+                    })
+                save_checkpoint(path, checkpoint)
+
+                logging.info(f'window starting {window["start_time"]}: on page {counters["pages"]} out of {max_pages}. n tweets collected so far: {counters["tweets"]}.')
+
+    with open(window['domains_path'], 'w') as o:
+        o.write(json.dumps(sort_counts(domains)))
+
+    with open(window['entities_path'], 'w') as o:
+        o.write(json.dumps(sort_counts(entities)))
+
+    checkpoint.update(counters)
+    checkpoint['done'] = True
+    save_checkpoint(path, checkpoint)
+
+    return counters
+
+
+def part_window(window:dict, i:int) -> dict:
+    '''
+    the window of the `i`-th query of a multi-query search: its own tweet,
+    meta and checkpoint files, next to the window's tweet file
+    '''
+    part_path = f'{window["tweets_path"]}.part{i}'
+    return dict(window,
+                tweets_path=part_path,
+                domains_path=part_path+'.domains',
+                entities_path=part_path+'.entities',
+                checkpoint_path=part_path+'.checkpoint')
+
+
+def merge_parts(window:dict, parts:list, top_k:int=0) -> dict:
+    '''
+    merges the part files of a multi-query search into the window's tweet
+    file, keeping the first copy of every tweet id, and recounts domains
+    and entities on the deduplicated tweets
+
+    returns:
+        - counters dict (`tweets`, `unresolved_authors`, `duplicates`)
+    '''
+    domains = new_counter(top_k)
+    entities = new_counter(top_k)
+    counters = {'tweets': 0, 'unresolved_authors': 0, 'duplicates': 0}
+    seen = set()
+
+    with JsonlWriter(window['tweets_path'], mode='w') as writer:
+        for part in parts:
+            with open(part['tweets_path'], 'r') as infile:
+                for line in infile:
+                    record = json.loads(line)
+                    if record['id'] in seen:
+                        counters['duplicates'] += 1
+                        continue
+                    seen.add(record['id'])
+
+                    writer.write_line(line, record=record)
+                    counters['tweets'] += 1
+                    if not record.get('user'):
+                        counters['unresolved_authors'] += 1
+                    if 'domains' in record:
+                        total_domain_entity_counts(domains_tweet=record['domains'],
+                                                   domains_session=domains,
+                                                   entities_tweet=record['entities'],
+                                                   entities_session=entities)
+
+    with open(window['domains_path'], 'w') as o:
+        o.write(json.dumps(sort_counts(domains)))
+
+    with open(window['entities_path'], 'w') as o:
+        o.write(json.dumps(sort_counts(entities)))
+
+    return counters
+
+
+def search_window(client:tweepy.Client,
+                  query,
+                  window:dict,
+                  max_pages:int=1000,
+                  budget:TokenBucket=None,
+                  top_k:int=0,
+                  mode:str='a',
+                  progress:dict=None,
+                  max_concurrent:int=None) -> dict:
+    '''
+    collects all tweets matching `query` in one time window.
+
+    `query` is a query string, or a list of them (see `build_queries`). a
+    single query goes straight to `search_query`. several queries run
+    concurrently over the window, each into its own checkpointed part
+    file; once they're all done, the parts get merged into the window's
+    tweet file, deduplicated by tweet id, and removed.
+
+    args:
+        - max_concurrent: int, queries run at once. defaults to all of them.
+        - everything else: see `search_query`. `max_pages` applies per query.
+
+    returns:
+        - counters dict (`tweets`, `unresolved_authors`, `pages`, and
+          `duplicates` for several queries)
+    '''
+    queries = [query] if isinstance(query, str) else list(query)
+    if len(queries)==1:
+        return search_query(client, queries[0], window,
+                            max_pages=max_pages, budget=budget, top_k=top_k,
+                            mode=mode, progress=progress)
+
+    progress = progress if progress is not None else {}
+    path = checkpoint_path(window)
+    combined = JOINER.join(queries)
+
+    # the merged window has a checkpoint too, so a rerun skips it
+    checkpoint = load_checkpoint(path, combined, window) if mode=='a' else None
+    if checkpoint is not None and checkpoint['done']:
+        logging.info(f'window starting {window["start_time"]} is already complete, see {path}.')
+        progress.update({'pages': checkpoint['pages'], 'tweets': checkpoint['tweets']})
+        return {key: checkpoint[key] for key in ('tweets', 'unresolved_authors', 'pages', 'duplicates')}
+
+    parts = [part_window(window, i) for i in range(len(queries))]
+    part_progress = [{} for _ in queries]
+
+    logging.info(f'window starting {window["start_time"]}: running {len(queries)} queries.')
+    with ThreadPoolExecutor(max_workers=max_concurrent or len(queries)) as pool:
+        futures = [pool.submit(search_query, client, q, part,
+                               max_pages=max_pages, budget=budget, top_k=top_k,
+                               mode=mode, progress=part_progress[i])
+                   for i, (q, part) in enumerate(zip(queries, parts))]
+        pages = sum(future.result()['pages'] for future in futures)
+
+    counters = merge_parts(window, parts, top_k=top_k)
+    counters['pages'] = pages
+    progress.update({'pages': pages, 'tweets': counters['tweets']})
+    logging.info(f'window starting {window["start_time"]}: merged {len(queries)} queries into {counters["tweets"]} tweets, dropping {counters["duplicates"]} duplicates.')
+
+    save_checkpoint(path, dict(counters,
+                               query=combined,
+                               start_time=window['start_time'].isoformat(),
+                               end_time=window['end_time'].isoformat(),
+                               done=True))
+
+    for part in parts:
+        for part_path in [part['tweets_path'], manifest_path(part['tweets_path']),
+                          part['domains_path'], part['entities_path'], part['checkpoint_path']]:
+            if os.path.isfile(part_path):
+                os.remove(part_path)
+
+    return counters
+
+
+############
+# THE THING!
+############
+class SearchScheduler:
+
+    def __init__(self,
+                 client:tweepy.Client,
+                 query:str,
+                 windows:list,
+                 max_concurrent:int=4,
+                 max_pages:int=1000,
+                 max_retries:int=3,
+                 retry_backoff:float=30.0,
+                 budget:TokenBucket=None,
+                 top_k:int=0,
+                 report_interval:float=60.0):
+        '''
+        args:
+            - client: one authenticated `tweepy.Client`, shared by all windows
+            - query: str, the search query, or a list of queries (see
+              `build_queries`) that each window runs concurrently
+            - windows: list of window dicts, see `build_windows`
+            - max_concurrent: int, number of windows collected at once
+            - max_pages: int, page limit per window
+            - max_retries: int, retries per window after a failed attempt
+            - retry_backoff: float, seconds before the first retry, doubled
+              for every further one
+            - budget: shared `TokenBucket`. defaults to the recent search
+              endpoint's app-auth limit, unless the client is a
+              `rate_limit.GovernedClient`, which does its own pacing.
+            - top_k: see `heavy_hitters.new_counter`
+            - report_interval: float, seconds between progress log lines
+        '''
+        self.client = client
+        self.query = query
+        self.max_concurrent = max_concurrent
+        self.max_pages = max_pages
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.governor = getattr(client, 'governor', None)
+        if budget is None and self.governor is None:
+            budget = TokenBucket(*ENDPOINT_LIMITS['search_recent_tweets'])
+        self.budget = budget
+        self.top_k = top_k
+        self.report_interval = report_interval
+
+        self.windows = []
+        for window in windows:
+            clipped = clip_window(window)
+            if clipped is None:
+                logging.info(f'skipping window starting {window["start_time"]}, it is in the future.')
+                continue
+            self.windows.append(clipped)
+
+        # one progress entry per window
+        self.progress = [{'start_time': str(window['start_time']),
+                          'end_time': str(window['end_time']),
+                          'tweets_path': window['tweets_path'],
+                          'status': 'pending',
+                          'attempts': 0,
+                          'pages': 0,
+                          'tweets': 0,
+                          'seconds': None,
+                          'error': None} for window in self.windows]
+
+        self._done = threading.Event()
+
+    def _run_window(self, i:int) -> dict:
+        '''
+        collects window `i`, retrying with exponential backoff. a retry
+        picks up from the window's last checkpoint, see `search_window`.
+        '''
+        window = self.windows[i]
+        progress = self.progress[i]
+        start = time.monotonic()
+
+        for attempt in range(self.max_retries+1):
+            progress['attempts'] = attempt+1
+            progress['status'] = 'running'
+            try:
+                search_window(self.client, self.query, window,
+                              max_pages=self.max_pages,
+                              budget=self.budget,
+                              top_k=self.top_k,
+                              progress=progress)
+                progress['status'] = 'done'
+                progress['error'] = None
+                break
+            except RETRYABLE as e:
+                progress['error'] = repr(e)
+                if attempt==self.max_retries:
+                    progress['status'] = 'failed'
+                    logging.error(f'window starting {window["start_time"]} failed after {attempt+1} attempts: {e}')
+                    break
+                wait = self.retry_backoff*2**attempt
+                progress['status'] = 'retrying'
+                logging.warning(f'window starting {window["start_time"]} failed ({e}). retrying in {wait} seconds.')
+                time.sleep(wait)
+            except Exception as e:
+                progress['status'] = 'failed'
+                progress['error'] = repr(e)
+                logging.exception(f'window starting {window["start_time"]} failed: {e}')
+                break
+
+        progress['seconds'] = round(time.monotonic() - start, 1)
+
+        return progress
+
+    def summary(self) -> dict:
+        '''
+        totals across all windows
+        '''
+        statuses = {}
+        for progress in self.progress:
+            statuses[progress['status']] = statuses.get(progress['status'], 0) + 1
+
+        out = {
+            'windows': len(self.progress),
+            'statuses': statuses,
+            'pages': sum(progress['pages'] for progress in self.progress),
+            'tweets': sum(progress['tweets'] for progress in self.progress)
+        }
+        if self.budget is not None:
+            out['requests_paced'] = self.budget.n_acquired
+            out['seconds_waiting_for_budget'] = round(self.budget.waited, 1)
+
+        return out
+
+    def _report(self):
+        while not self._done.wait(self.report_interval):
+            logging.info(f'search progress: {self.summary()}')
+
+    def run(self) -> list:
+        '''
+        collects all windows. failed windows don't stop the others.
+
+        returns:
+            - the per-window progress report
+        '''
+        logging.info(f'running {len(self.windows)} search windows, {self.max_concurrent} at a time.')
+
+        reporter = threading.Thread(target=self._report, name='search-progress', daemon=True)
+        reporter.start()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as pool:
+            futures = [pool.submit(self._run_window, i) for i in range(len(self.windows))]
+            for future in as_completed(futures):
+                progress = future.result()
+                logging.info(f'window starting {progress["start_time"]}: {progress["status"]}, {progress["tweets"]} tweets in {progress["pages"]} pages, {progress["seconds"]}s.')
+
+        self._done.set()
+        reporter.join()
+        logging.info(f'search complete: {self.summary()}')
+        if self.governor is not None:
+            self.governor.log_stats()
+
+        return self.progress
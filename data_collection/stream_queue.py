@@ -0,0 +1,356 @@
+# stream_queue.py
+
+# DATA COLLECTION: SHARED
+# a producer/consumer pipeline for the streaming collectors.
+# tweepy calls `on_data` on the thread that reads from the socket. if we
+# decode, process and write every tweet on that thread, match-day spikes
+# slow reading down enough for twitter to drop the connection.
+# with this, `on_data` only hands the raw bytes over:
+# - a bounded in-memory queue holds raw messages
+# - a pool of processing workers turns raw messages into output records
+# - a single writer thread writes those records out (in order of completion)
+#   and is the only place session-level aggregates get touched
+
+# backpressure/overflow:
+# - `put` never blocks. once the queue reaches its high watermark, incoming
+#   messages get spilled to a file on disk instead.
+# - a re-spool thread feeds spilled messages back into the queue once it has
+#   drained below its low watermark. once the spill file has been fully
+#   re-spooled, it is removed and we go back to queueing in memory.
+# - a spill file left behind by a run that crashed gets picked up on
+#   startup and re-spooled before anything spilled after it.
+
+# NOTE: workers are threads, so cpu-heavy processing still shares the GIL.
+# what this buys us is that the socket read never waits on processing or io.
+
+############
+# IMPORTS
+############
+import os
+import json
+import logging
+import queue
+import threading
+import time
+
+############
+# CONSTANTS
+############
+# sentinel telling a worker/the writer thread to stop
+_STOP = object()
+
+############
+# THE THING!
+############
+class StreamProcessingQueue:
+
+    def __init__(self,
+                 process_func,
+                 writer,
+                 spill_path:str,
+                 n_workers:int=2,
+                 max_queue:int=10000,
+                 high_watermark:float=0.9,
+                 low_watermark:float=0.5,
+                 on_record=None,
+                 metrics_interval:float=60.0):
+        '''
+        args:
+            - process_func: callable taking the raw bytes of one message and
+              returning an output record (dict), or None to drop the message
+            - writer: a `JsonlWriter` (or anything with `write_line`/`close`)
+            - spill_path: str, full path to the overflow file
+            - n_workers: int, number of processing worker threads
+            - max_queue: int, max number of raw messages held in memory
+            - high_watermark: float, fraction of `max_queue` at which we start
+              spilling to disk
+            - low_watermark: float, fraction of `max_queue` below which spilled
+              messages get fed back into the queue
+            - on_record: optional callable, called with every processed record
+              on the (single) writer thread. use it for session aggregates.
+            - metrics_interval: float, seconds between queue-depth log lines.
+              0/None disables periodic logging.
+        '''
+        if n_workers < 1:
+            raise ValueError(f'n_workers must be at least 1.')
+
+        if not 0 < low_watermark < high_watermark <= 1:
+            raise ValueError(f'watermarks must satisfy 0 < low_watermark < high_watermark <= 1.')
+
+        self.process_func = process_func
+        self.writer = writer
+        self.on_record = on_record
+        self.spill_path = spill_path
+        self.max_queue = max_queue
+        self.high = max(1, int(max_queue*high_watermark))
+        self.low = int(max_queue*low_watermark)
+        self.metrics_interval = metrics_interval
+
+        self.raw_queue = queue.Queue(maxsize=max_queue)
+        self.out_queue = queue.Queue(maxsize=max_queue)
+
+        # spill state. `_spill_lock` guards everything below.
+        self._spill_lock = threading.Lock()
+        self._spill_out = None
+        self._spill_read_offset = 0
+        self._spill_pending = 0
+        self.spilling = False
+        self._recover_spill()
+
+        # metrics
+        self.n_enqueued = 0
+        self.n_spilled = 0
+        self.n_respooled = 0
+        self.n_processed = 0
+        self.n_dropped = 0
+        self.n_errors = 0
+        self.n_written = 0
+        self.max_depth = 0
+
+        self._stats_lock = threading.Lock()
+        self._closing = threading.Event()
+        self._closed = False
+
+        self._workers = [threading.Thread(target=self._work, name=f'stream-worker-{i}', daemon=True)
+                         for i in range(n_workers)]
+        self._writer_thread = threading.Thread(target=self._write, name='stream-writer', daemon=True)
+        self._respooler = threading.Thread(target=self._respool, name='stream-respooler', daemon=True)
+        self._reporter = None
+        if metrics_interval:
+            self._reporter = threading.Thread(target=self._report, name='stream-metrics', daemon=True)
+
+        for thread in self._workers+[self._writer_thread, self._respooler]:
+            thread.start()
+        if self._reporter is not None:
+            self._reporter.start()
+
+    def _recover_spill(self):
+        '''
+        takes over the spill file of a run that didn't get to drain it:
+        cuts off a torn last line and counts the rest as pending, so it
+        gets re-spooled first and isn't mistaken for messages of ours.
+        '''
+        if not os.path.isfile(self.spill_path):
+            return
+
+        n_lines = 0
+        end = 0
+        with open(self.spill_path, 'rb') as infile:
+            offset = 0
+            for chunk in iter(lambda: infile.read(1024*1024), b''):
+                n_lines += chunk.count(b'\n')
+                last = chunk.rfind(b'\n')
+                if last >= 0:
+                    end = offset + last + 1
+                offset += len(chunk)
+        if end < offset:
+            os.truncate(self.spill_path, end)
+
+        self._spill_out = open(self.spill_path, 'ab')
+        self._spill_pending = n_lines
+        self.spilling = True
+        logging.warning(f'found {n_lines} messages left over in {self.spill_path}, re-spooling them first.')
+
+    ############
+    # producer side
+    ############
+    def put(self, data:bytes):
+        '''
+        hands a raw message over. never blocks: if the queue is at its
+        high watermark (or we're still working off a spill), the message
+        goes to the spill file instead.
+        '''
+        if self._closed:
+            raise ValueError(f'stream queue is already closed.')
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        with self._spill_lock:
+            if not self.spilling and self.raw_queue.qsize() < self.high:
+                try:
+                    self.raw_queue.put_nowait(data)
+                    self.n_enqueued += 1
+                    depth = self.raw_queue.qsize()
+                    if depth > self.max_depth:
+                        self.max_depth = depth
+                    return
+                except queue.Full:
+                    pass
+
+            if not self.spilling:
+                logging.warning(f'stream queue at {self.raw_queue.qsize()}/{self.max_queue}. spilling to {self.spill_path}.')
+                self.spilling = True
+
+            self._spill(data)
+
+    def _spill(self, data:bytes):
+        '''
+        appends one message to the spill file. callers must hold `_spill_lock`.
+        '''
+        if self._spill_out is None:
+            self._spill_out = open(self.spill_path, 'ab')
+        self._spill_out.write(data.rstrip(b'\r\n')+b'\n')
+        self._spill_pending += 1
+        self.n_spilled += 1
+
+    def _respool(self):
+        '''
+        feeds spilled messages back into the queue once it has drained
+        below the low watermark.
+        '''
+        while True:
+            with self._spill_lock:
+                pending = self._spill_pending
+                if pending==0 and self.spilling:
+                    # fully caught up - drop the spill file and go back to memory
+                    if self._spill_out is not None:
+                        self._spill_out.close()
+                        self._spill_out = None
+                        os.remove(self.spill_path)
+                    self._spill_read_offset = 0
+                    self.spilling = False
+                    logging.info(f'stream queue caught up with spill file, back to in-memory queueing.')
+
+            if pending==0:
+                if self._closing.is_set():
+                    return
+                time.sleep(0.1)
+                continue
+
+            if self.raw_queue.qsize() > self.low and not self._closing.is_set():
+                time.sleep(0.1)
+                continue
+
+            batch = self._read_spilled(max(1, self.max_queue-self.raw_queue.qsize()))
+            for data in batch:
+                # blocking here is fine, we're not on the socket thread
+                self.raw_queue.put(data)
+            self.n_respooled += len(batch)
+
+    def _read_spilled(self, n:int) -> list:
+        '''
+        reads up to `n` spilled messages from where we last left off. the
+        reading happens outside `_spill_lock`, so `put` doesn't wait on it:
+        we only read as many lines as were flushed out while we held it,
+        and only this thread ever reads.
+        '''
+        with self._spill_lock:
+            self._spill_out.flush()
+            offset = self._spill_read_offset
+            n = min(n, self._spill_pending)
+
+        out = []
+        with open(self.spill_path, 'rb') as infile:
+            infile.seek(offset)
+            while len(out) < n:
+                line = infile.readline()
+                if not line:
+                    break
+                out.append(line.rstrip(b'\n'))
+            offset = infile.tell()
+
+        with self._spill_lock:
+            self._spill_read_offset = offset
+            self._spill_pending -= len(out)
+        return out
+
+    ############
+    # consumer side
+    ############
+    def _work(self):
+        '''
+        processing worker: raw message -> record -> serialised line
+        '''
+        while True:
+            data = self.raw_queue.get()
+            if data is _STOP:
+                return
+            try:
+                record = self.process_func(data)
+            except Exception as e:
+                with self._stats_lock:
+                    self.n_errors += 1
+                logging.exception(f'error processing stream message: {e}')
+                continue
+
+            if record is None:
+                with self._stats_lock:
+                    self.n_dropped += 1
+                continue
+
+            with self._stats_lock:
+                self.n_processed += 1
+            self.out_queue.put((record, json.dumps(record)+'\n'))
+
+    def _write(self):
+        '''
+        the single writer: aggregates and writes out processed records
+        '''
+        while True:
+            item = self.out_queue.get()
+            if item is _STOP:
+                return
+            record, line = item
+            if self.on_record is not None:
+                try:
+                    self.on_record(record)
+                except Exception as e:
+                    with self._stats_lock:
+                        self.n_errors += 1
+                    logging.exception(f'error in on_record callback: {e}')
+            self.writer.write_line(line, record=record)
+            self.n_written += 1
+
+    ############
+    # metrics & shutdown
+    ############
+    def stats(self) -> dict:
+        '''
+        a snapshot of queue depths and counters
+        '''
+        return {
+            'queue_depth': self.raw_queue.qsize(),
+            'max_queue_depth': self.max_depth,
+            'out_queue_depth': self.out_queue.qsize(),
+            'spilling': self.spilling,
+            'spill_pending': self._spill_pending,
+            'n_enqueued': self.n_enqueued,
+            'n_spilled': self.n_spilled,
+            'n_respooled': self.n_respooled,
+            'n_processed': self.n_processed,
+            'n_dropped': self.n_dropped,
+            'n_errors': self.n_errors,
+            'n_written': self.n_written
+        }
+
+    def _report(self):
+        while not self._closing.wait(self.metrics_interval):
+            logging.info(f'stream queue stats: {self.stats()}')
+
+    def close(self):
+        '''
+        stops taking new messages, drains queue and spill file, then
+        stops all threads and closes the writer. safe to call more than once.
+        '''
+        if self._closed:
+            return
+        self._closed = True
+
+        # the re-spooler works off the spill file (ignoring the low
+        # watermark) and exits once there's nothing left
+        self._closing.set()
+        self._respooler.join()
+
+        for _ in self._workers:
+            self.raw_queue.put(_STOP)
+        for thread in self._workers:
+            thread.join()
+
+        self.out_queue.put(_STOP)
+        self._writer_thread.join()
+        if self._reporter is not None:
+            self._reporter.join()
+
+        self.writer.close()
+        logging.info(f'stream queue closed. final stats: {self.stats()}')
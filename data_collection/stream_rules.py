@@ -0,0 +1,102 @@
+# stream_rules.py
+
+# DATA COLLECTION: TWITTER
+# syncing the filtered stream's rules with our search terms. our streamers
+# used to delete every live rule and then add one rule per term, one
+# request each, and stop at the first error - N round trips at startup,
+# and a restart briefly left the stream without any rules.
+
+# `sync_rules` instead:
+# - packs the terms into as few rules as the rule length limit allows
+#   (see `query_planner.py`). packing is deterministic, so an unchanged
+#   terms file gives the same rules as last time.
+# - diffs them against the live rules: unchanged rules stay put
+# - adds the missing rules in one request and deletes the stale ones in
+#   another. adds go first, so the stream is never left without rules -
+#   unless that would take us over the rule cap, then deletes go first.
+
+############
+# IMPORTS
+############
+import logging
+import time
+import tweepy
+from query_planner import plan_queries, MAX_RULE_LENGTH
+
+############
+# CONSTANTS
+############
+# max number of filtered stream rules (essential access; 25 for elevated)
+MAX_RULES = 5
+
+############
+# FUNCTIONS
+############
+def check_rule_errors(response, action:str):
+    '''
+    raises if a rule request came back with errors
+    '''
+    errors = response.errors if not isinstance(response, dict) else response.get('errors')
+    if errors:
+        raise ValueError(f'failed to {action} stream rules: {errors}')
+
+
+def sync_rules(client:tweepy.StreamingClient,
+               terms:list,
+               max_length:int=MAX_RULE_LENGTH,
+               max_rules:int=MAX_RULES,
+               dry_run:bool=False) -> dict:
+    '''
+    makes the stream's live rules match `terms`, in at most two requests
+    (plus the one getting the live rules).
+
+    args:
+        - client: the streaming client
+        - terms: list of search terms, see `query_planner.read_terms`
+        - max_length: int, max length of a single rule
+        - max_rules: int, max number of rules our access level allows
+        - dry_run: bool, validate the changes with the api without applying
+
+    returns:
+        - dict with the `kept`, `added` and `deleted` rule values and the
+          `seconds` the sync took
+    '''
+    start = time.monotonic()
+
+    wanted = plan_queries(terms, max_length=max_length)
+    if len(wanted) > max_rules:
+        raise ValueError(f'{len(terms)} terms need {len(wanted)} rules, but we can only have {max_rules}.')
+
+    live = client.get_rules().data or []
+    live_values = {rule.value: rule.id for rule in live}
+
+    kept = [value for value in wanted if value in live_values]
+    to_add = [value for value in wanted if value not in live_values]
+    to_delete = [rule for rule in live if rule.value not in wanted]
+
+    def add():
+        if to_add:
+            response = client.add_rules([tweepy.StreamRule(value) for value in to_add], dry_run=dry_run)
+            check_rule_errors(response, 'add')
+
+    def delete():
+        if to_delete:
+            response = client.delete_rules([rule.id for rule in to_delete], dry_run=dry_run)
+            check_rule_errors(response, 'delete')
+
+    if len(live) + len(to_add) > max_rules:
+        delete()
+        add()
+    else:
+        add()
+        delete()
+
+    summary = {
+        'kept': kept,
+        'added': to_add,
+        'deleted': [rule.value for rule in to_delete],
+        'seconds': round(time.monotonic() - start, 3)
+    }
+    logging.info(f'synced stream rules in {summary["seconds"]}s: kept {len(kept)}, added {len(to_add)}, deleted {len(to_delete)}.')
+
+    return summary
@@ -0,0 +1,272 @@
+# stream_supervisor.py
+
+# DATA COLLECTION: TWITTER
+# the filtered-stream collector, shared by `get_tweets.py` and
+# `get_epl_tweets.py`. it used to exit after `kill_time` (only noticing
+# the deadline once the next tweet came in) and rely on cron to restart
+# it - every restart left a gap while rules got re-synced and the
+# connection re-established.
+
+# here:
+# - a `RotatingWriter` (see `rotating_writer.py`) rotates the tweet outfile
+#   on the clock (e.g. on the hour) and/or by size, without touching the
+#   connection. each rotation writes a domain/entity snapshot for the file
+#   it closes.
+# - `TweetStreamer.run` keeps the stream up: if the connection drops, it
+#   reconnects with exponential backoff and asks for `backfill_minutes`
+#   of missed tweets. with a `kill_time`, a timer stops it on the
+#   deadline rather than the next tweet.
+# - with a `DomainClassifier` (see `domain_categories.py`), every tweet
+#   with urls gets the `url_categories` they fall into.
+
+############
+# IMPORTS
+############
+import os
+import json
+import logging
+import datetime
+import threading
+import time
+from rate_limit import GovernedStreamingClient
+from rotating_writer import RotatingWriter
+from heavy_hitters import new_counter
+from stream_queue import StreamProcessingQueue
+from tweet_normalization import (normalize_stream_message, total_domain_entity_counts,
+                                 sort_counts, EXPANSIONS, TWEET_FIELDS, MEDIA_FIELDS, USER_FIELDS)
+
+############
+# CONSTANTS
+############
+# reconnect backoff, in seconds: starts at MIN, doubles up to MAX, and goes
+# back to MIN once a connection has held for STABLE seconds
+MIN_BACKOFF = 1
+MAX_BACKOFF = 320
+STABLE_CONNECTION = 300
+
+############
+# THE THING!
+############
+class TweetStreamer(GovernedStreamingClient):
+
+    def __init__(self,
+                 tweets_dir:str,
+                 meta_dir:str,
+                 prefix:str='',
+                 kill_time:int=59,
+                 time_unit:str='minutes',
+                 rotate_minutes:int=0,
+                 rotate_bytes:int=0,
+                 n_workers:int=0,
+                 max_queue:int=10000,
+                 top_k:int=0,
+                 classifier=None,
+                 **kwargs):
+        '''
+        adding custom params
+
+        tweets go to `{tweets_dir}{prefix}tweets_{stamp}.json`, with
+        domain/entity counts for every such file in
+        `{meta_dir}{prefix}domains_{stamp}.json`/`...entities_{stamp}.json`.
+
+        kill_time: stop after this long. 0/None streams until stopped.
+
+        rotate_minutes/rotate_bytes > 0 start a new tweet file (and meta
+        snapshot) every n minutes, on the clock, or every n bytes.
+
+        n_workers > 0 switches on producer/consumer mode: `on_data` only
+        enqueues the raw message, and `n_workers` processing threads
+        plus a single writer thread drain the queue. see `stream_queue.py`.
+
+        top_k > 0 counts domains/entities with bounded-memory top-k
+        counters. see `heavy_hitters.py`.
+
+        classifier: a `DomainClassifier`, to label tweets with the
+        `url_categories` of their urls. None leaves them unlabelled.
+        '''
+        self.meta_dir = os.path.join(meta_dir, '')
+        self.prefix = prefix
+        self.top_k = top_k
+        self.classifier = classifier
+
+        # timing stuff
+        self.start_time = datetime.datetime.now()
+
+        if time_unit not in ['seconds', 'minutes']:
+            raise ValueError(f'time_unit must be either `minutes` or `seconds`.')
+
+        self.kill_time = None
+        if kill_time:
+            self.kill_time = datetime.timedelta(seconds=60*kill_time if time_unit=='minutes' else kill_time)
+
+        # per-file counts, reset on every rotation
+        self.domains = new_counter(top_k)
+        self.entities = new_counter(top_k)
+
+        self.counter = 0
+        self.n_unresolved_authors = 0
+        # tweets per url category, per file
+        self.category_counts = {}
+
+        self.writer = RotatingWriter(tweets_dir, prefix+'tweets_',
+                                     rotate_minutes=rotate_minutes,
+                                     rotate_bytes=rotate_bytes,
+                                     on_record=self.count_tweet,
+                                     on_rotate=self.snapshot)
+
+        # producer/consumer mode. the spill file outlives rotations, so
+        # it's named after the stream rather than a segment - and the next
+        # run re-spools whatever a crashed one left in it.
+        self.queue = None
+        if n_workers > 0:
+            self.queue = StreamProcessingQueue(process_func=self.process_tweet,
+                                               writer=self.writer,
+                                               spill_path=self.writer.out_dir+prefix+'tweets.spill',
+                                               n_workers=n_workers,
+                                               max_queue=max_queue)
+
+        self._stopping = threading.Event()
+        self._finished = False
+
+        # using super here makes sure we get all the attributes
+        # from our super-class. we do have to pass **kwargs both in
+        # the init method and here for this to work.
+        super(TweetStreamer, self).__init__(**kwargs)
+
+    def process_tweet(self, data) -> dict:
+        '''
+        cleans a raw tweet message into the object we write out
+        '''
+        tweet = normalize_stream_message(data)
+        if self.classifier is not None and tweet is not None and 'urls' in tweet:
+            tweet['url_categories'] = self.classifier.classify_urls(tweet['urls'])
+
+        return tweet
+
+    def count_tweet(self, tweet:dict):
+        '''
+        adds a processed tweet's domains/entities to the current file's
+        counts. called by the writer, right before it writes the tweet.
+        '''
+        if not tweet['user']:
+            self.n_unresolved_authors += 1
+
+        for category in tweet.get('url_categories', ()):
+            self.category_counts[category] = self.category_counts.get(category, 0) + 1
+
+        if 'domains' in tweet.keys():
+            self.domains, self.entities = total_domain_entity_counts(domains_tweet=tweet['domains'],
+                                                                     domains_session=self.domains,
+                                                                     entities_tweet=tweet['entities'],
+                                                                     entities_session=self.entities)
+
+    def snapshot(self, segment:dict):
+        '''
+        writes the domain/entity counts of a tweet file we're done with,
+        and starts counting afresh for the next one
+        '''
+        with open(f'{self.meta_dir}{self.prefix}domains_{segment["stamp"]}.json', 'w') as o:
+            o.write(json.dumps(sort_counts(self.domains)))
+
+        with open(f'{self.meta_dir}{self.prefix}entities_{segment["stamp"]}.json', 'w') as o:
+            o.write(json.dumps(sort_counts(self.entities)))
+
+        self.domains = new_counter(self.top_k)
+        self.entities = new_counter(self.top_k)
+        logging.info(f'closed {segment["path"]} with {segment["n_records"]} tweets ({segment["started"]} to {segment["ended"]}).')
+        if self.classifier is not None:
+            logging.info(f'tweets per url category in {segment["path"]}: {self.category_counts}')
+            self.category_counts = {}
+
+    def on_data(self, data):
+        '''
+        1. clean the returned tweet object
+        2. write it out
+        in producer/consumer mode, both happen off the streaming thread.
+        '''
+        if self._stopping.is_set():
+            return
+
+        self.counter += 1
+        if self.queue is not None:
+            self.queue.put(data)
+        else:
+            tweet = self.process_tweet(data)
+            if tweet is not None:
+                self.writer.write(tweet)
+
+    def on_errors(self, errors):
+        return super().on_errors(errors)
+
+    def stop(self):
+        '''
+        stops the stream - from a timer, a signal handler or another thread
+        '''
+        self._stopping.set()
+        self.disconnect()
+
+    def finish(self):
+        '''
+        drains the queue, closes the last tweet file (writing its counts)
+        and logs our totals. safe to call more than once.
+        '''
+        if self._finished:
+            return
+        self._finished = True
+
+        if self.queue is not None:
+            self.queue.close()
+        self.writer.close()
+
+        # number of tweets collected to log file
+        logging.info(f'Collected a total of {self.counter} tweets in {self.writer.n_rotations+1} files, of which {self.n_unresolved_authors} without a resolvable author.')
+        self.governor.log_stats()
+
+    def run(self, backfill_minutes:int=0, **filter_kwargs):
+        '''
+        streams until stopped (or the kill time is up), reconnecting with
+        exponential backoff whenever the connection drops. reconnects ask
+        for `backfill_minutes` of tweets we may have missed meanwhile
+        (an academic research access feature).
+
+        construct the streamer with `max_retries=0` so dropped connections
+        come back to us, rather than tweepy reconnecting without backfill.
+        '''
+        filter_kwargs = dict({'expansions': EXPANSIONS,
+                              'tweet_fields': TWEET_FIELDS,
+                              'media_fields': MEDIA_FIELDS,
+                              'user_fields': USER_FIELDS}, **filter_kwargs)
+
+        deadline = None
+        if self.kill_time is not None:
+            deadline = threading.Timer(self.kill_time.total_seconds(), self.stop)
+            deadline.daemon = True
+            deadline.start()
+
+        backoff = MIN_BACKOFF
+        n_connections = 0
+        try:
+            while not self._stopping.is_set():
+                kwargs = dict(filter_kwargs)
+                if n_connections > 0 and backfill_minutes:
+                    kwargs['backfill_minutes'] = backfill_minutes
+                n_connections += 1
+
+                connected = time.monotonic()
+                try:
+                    self.filter(**kwargs)
+                except Exception as e:
+                    logging.exception(f'stream connection failed: {e}')
+
+                if self._stopping.is_set():
+                    break
+
+                if time.monotonic() - connected >= STABLE_CONNECTION:
+                    backoff = MIN_BACKOFF
+                logging.warning(f'stream disconnected after {round(time.monotonic() - connected)}s. reconnecting in {backoff}s (connection #{n_connections+1}).')
+                self._stopping.wait(backoff)
+                backoff = min(backoff*2, MAX_BACKOFF)
+        finally:
+            if deadline is not None:
+                deadline.cancel()
+            self.finish()
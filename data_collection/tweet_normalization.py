@@ -0,0 +1,295 @@
+# tweet_normalization.py
+
+# DATA COLLECTION: SHARED
+# the one place where raw twitter v2 api output gets turned into the
+# records we write out. every collector used to carry its own copy of
+# `check_path_exists`, `extract_urls`, `extract_count_domains_entities`,
+# `total_domain_entity_counts` and the OUT_*_FIELDS projection, each with
+# slightly different behaviour. they all import from here now, so hot-path
+# optimisations land once.
+
+# layers:
+# - `normalize_tweet`: the pure-python fast path. plain dicts in, plain dict
+#   out, no logging, no tweepy. this is what `benchmarks/bench_normalization.py`
+#   times in isolation.
+# - `normalize_page`: one pass over a page (data + includes) of plain dicts,
+#   optionally accumulating session domain/entity counts as it goes.
+# - `normalize_response`/`normalize_stream_message`: adapters for tweepy
+#   responses (search, by-id) and raw streaming messages.
+
+# urls come from the api's url entities (`unwound_url`, else `expanded_url`),
+# so we get the full target rather than the `t.co` link, including for urls
+# beyond the truncated text. regex scanning the text is only the fallback for
+# tweets without an `entities` field.
+
+############
+# IMPORTS
+############
+import os
+import re
+import json
+import logging
+from heavy_hitters import SpaceSavingCounter
+
+############
+# CONSTANTS
+############
+# fields to request from the api
+EXPANSIONS = ['author_id', 'referenced_tweets.id']
+TWEET_FIELDS = ['created_at', 'public_metrics', 'source', 'context_annotations', 'entities']
+MEDIA_FIELDS = ['media_key', 'type', 'url', 'duration_ms']
+USER_FIELDS = ['id', 'name', 'username', 'created_at', 'description', 'location', 'public_metrics', 'protected']
+
+# fields we want to retain for our json
+OUT_CORE_FIELDS = ('author_id', 'created_at', 'id', 'public_metrics', 'referenced_tweets', 'source', 'text')
+OUT_USER_FIELDS = ('created_at', 'description', 'id', 'location', 'name', 'public_metrics', 'username')
+
+# only used as a fallback, for tweets that come without url entities
+URL_PATTERN = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+
+############
+# FUNCTIONS
+############
+def check_path_exists(filepath:str):
+    '''
+    checks if a supplied filepath
+    (dir + filename) exists. if the full path
+    with file is not a file, checks for
+    just the dir path and creates file if exists,
+    raises error if not
+
+    args:
+        - filepath: str, full file path
+    '''
+    if filepath is None:
+        raise TypeError(f'specified path is None.')
+
+    if not isinstance(filepath, str):
+        raise TypeError(f'filepath object must be str. Please re-specify.')
+
+    if os.path.isdir(filepath):
+        raise ValueError(f'Need to provide a full path to a file, not a dir.')
+
+    if not os.path.isfile(filepath):
+        # check if everything before the last `/` is a dir
+        concat = os.path.dirname(filepath) or '.'
+        if not os.path.isdir(concat):
+            raise NotADirectoryError(f'Directory path {concat} does not exist. Please re-specify `out_path`.')
+        logging.info(f'{concat}, the dir for specified filepath is a directory, but file {os.path.basename(filepath)} does not exist. Thats fine for us.')
+
+    return filepath
+
+
+def extract_urls(tweet_text:str) -> list:
+    '''
+    extracts urls from tweet text
+    returns all urls in tweet text in list
+    '''
+    return URL_PATTERN.findall(tweet_text)
+
+
+def extract_entity_urls(tweet:dict) -> list:
+    '''
+    the urls in a tweet, taken from its url entities. prefers
+    `unwound_url` (the final target, where twitter resolved it), then
+    `expanded_url`, then the `t.co` url itself.
+
+    returns None if the tweet has no `entities` field at all, so callers
+    can fall back to `extract_urls`.
+    '''
+    entities = tweet.get('entities')
+    if entities is None:
+        return None
+
+    return [url.get('unwound_url') or url.get('expanded_url') or url['url']
+            for url in entities.get('urls') or []]
+
+
+def extract_count_domains_entities(context_field:list):
+    '''
+    extracts the counts of domains and entities in
+    a given tweet.
+
+    returns:
+        - domains, dict
+        - entities, dict
+    '''
+    domains = {}
+    entities = {}
+
+    for context in context_field:
+        domain = context['domain']['name']
+        entity = context['entity']['name']
+        domains[domain] = domains.get(domain, 0) + 1
+        entities[entity] = entities.get(entity, 0) + 1
+
+    return domains, entities
+
+
+def total_domain_entity_counts(domains_tweet:dict,
+                               domains_session:dict,
+                               entities_tweet:dict,
+                               entities_session:dict):
+    '''
+    accumulates counts for domains and entities
+    for the entire session. every domain/entity counts
+    once per tweet it appears in. the session counters can be
+    plain dicts or `SpaceSavingCounter`s (see `heavy_hitters.py`).
+    '''
+    if isinstance(domains_session, SpaceSavingCounter):
+        domains_session.update(domains_tweet)
+        entities_session.update(entities_tweet)
+        return domains_session, entities_session
+
+    for domain in domains_tweet:
+        domains_session[domain] = domains_session.get(domain, 0) + 1
+
+    for entity in entities_tweet:
+        entities_session[entity] = entities_session.get(entity, 0) + 1
+
+    return domains_session, entities_session
+
+
+def project(source:dict, fields:tuple) -> dict:
+    '''
+    the subset of `source` with keys in `fields`, in `fields` order
+    '''
+    return {field: source[field] for field in fields if field in source}
+
+
+def index_users(includes:dict) -> dict:
+    '''
+    the users in the `includes` of a page, by id - indexed once per page, so
+    joining tweets to their authors is a dict lookup rather than a scan
+    '''
+    return {user['id']: user for user in (includes or {}).get('users') or []}
+
+
+def normalize_tweet(tweet:dict, user:dict=None) -> dict:
+    '''
+    the fast path: turns one raw tweet dict (and its author's raw user
+    dict, if we have it) into an output record.
+
+    args:
+        - tweet: dict, a tweet as returned in the `data` part of a v2 response
+        - user: dict, the author object from `includes.users`, or None.
+          unresolved authors get an empty `user` dict.
+    '''
+    out = {field: tweet[field] for field in OUT_CORE_FIELDS if field in tweet}
+
+    urls = extract_entity_urls(tweet)
+    if urls is None:
+        urls = URL_PATTERN.findall(tweet['text'])
+    if urls:
+        out['urls'] = urls
+
+    context = tweet.get('context_annotations')
+    if context:
+        out['domains'], out['entities'] = extract_count_domains_entities(context)
+
+    out['user'] = {} if user is None else project(user, OUT_USER_FIELDS)
+
+    return out
+
+
+def normalize_page(data:list,
+                   includes:dict=None,
+                   domains_session:dict=None,
+                   entities_session:dict=None,
+                   counters:dict=None) -> list:
+    '''
+    turns a page of raw tweets into output records in one pass.
+
+    args:
+        - data: list of raw tweet dicts
+        - includes: dict, the `includes` part of the response, with lists
+          of raw dicts. its users get indexed once per page, see `index_users`.
+        - domains_session/entities_session: optional dicts that get the
+          domain/entity counts of this page added to them in place
+        - counters: optional dict, gets `tweets` and `unresolved_authors`
+          (tweets whose author isn't in `includes.users`) added to it
+    '''
+    users = index_users(includes)
+    count = domains_session is not None and entities_session is not None
+
+    # projected user dicts get reused for every tweet by the same author
+    projected_users = {}
+    n_unresolved = 0
+
+    records = []
+    for tweet in data:
+        author_id = tweet.get('author_id')
+        projected = projected_users.get(author_id)
+        if projected is None:
+            user = users.get(author_id)
+            if user is None:
+                n_unresolved += 1
+                logging.debug(f'unable to find user object for tweet {tweet["id"]}.')
+                projected = {}
+            else:
+                projected = projected_users[author_id] = project(user, OUT_USER_FIELDS)
+
+        out = normalize_tweet(tweet)
+        out['user'] = projected
+
+        if count and 'domains' in out:
+            total_domain_entity_counts(domains_tweet=out['domains'],
+                                       domains_session=domains_session,
+                                       entities_tweet=out['entities'],
+                                       entities_session=entities_session)
+        records.append(out)
+
+    if counters is not None:
+        counters['tweets'] = counters.get('tweets', 0) + len(records)
+        counters['unresolved_authors'] = counters.get('unresolved_authors', 0) + n_unresolved
+
+    return records
+
+
+def response_to_dicts(response):
+    '''
+    unpacks a tweepy `Response` into (data, includes) of plain dicts
+    '''
+    data = [tweet.data for tweet in (response.data or [])]
+    includes = {key: [obj.data for obj in objs] for key, objs in (response.includes or {}).items()}
+
+    return data, includes
+
+
+def normalize_response(response,
+                       domains_session:dict=None,
+                       entities_session:dict=None,
+                       counters:dict=None) -> list:
+    '''
+    `normalize_page` for a tweepy `Response` (search, by-id, paginator pages)
+    '''
+    data, includes = response_to_dicts(response)
+
+    return normalize_page(data, includes,
+                          domains_session=domains_session,
+                          entities_session=entities_session,
+                          counters=counters)
+
+
+def normalize_stream_message(message, counters:dict=None) -> dict:
+    '''
+    `normalize_page` for a single raw message from the filtered stream.
+    returns None for messages without tweet data (e.g. keep-alives, errors).
+    '''
+    obj = json.loads(message)
+    if 'data' not in obj:
+        return None
+
+    return normalize_page([obj['data']], obj.get('includes'), counters=counters)[0]
+
+
+def sort_counts(counts:dict) -> dict:
+    '''
+    domain/entity counts, highest first - the way we write them out.
+    top-k counters get written out with their error bounds, so they
+    can be merged later.
+    '''
+    if isinstance(counts, SpaceSavingCounter):
+        return counts.to_dict()
+
+    return dict(sorted(counts.items(), key=lambda x:x[1], reverse=True))
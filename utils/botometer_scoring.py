@@ -0,0 +1,237 @@
+# botometer_scoring.py
+
+# UTILS: TWITTER.
+# scoring twitter users with botometer, without losing hours of work to a
+# crash. `run_botometer.py` used to score users strictly one after the
+# other and only write anything once it was done with all of them.
+
+# `score_users`:
+# - skips users whose result is already in the outfile, so a rerun into
+#   the same outfile picks up where the last one stopped
+# - reuses results from a persistent `ScoreCache` (sqlite, shared by all
+#   runs) while they're younger than the cache's ttl - scores barely
+#   move from one week to the next, and every call costs api quota
+# - scores the rest with a bounded number of calls in flight, retrying
+#   transient failures (rate limits, server/network errors)
+# - appends every result to the jsonl outfile as soon as it's in, as
+#   `{"user_id": ..., "scored_at": ..., "cached": bool, "result": {...}}`,
+#   or with an `error` rather than a `result` for users botometer can't
+#   score (protected, suspended, no tweets, ...). users we only gave up on
+#   after transient failures get `"transient": true`, and another go on
+#   the next run.
+
+############
+# IMPORTS
+############
+import os
+import json
+import logging
+import sqlite3
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+
+############
+# CONSTANTS
+############
+SCORE_CACHE_DB = os.getenv('SCORE_CACHE_DB', '../data/botometer_scores.sqlite')
+
+# 30 days
+DEFAULT_TTL = 30*24*60*60
+
+# http statuses worth retrying on
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scores (
+    user_id TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    scored REAL NOT NULL
+)
+'''
+
+############
+# FUNCTIONS
+############
+def done_users(outfile:str) -> set:
+    '''
+    ids of the users already in a jsonl `outfile`: scored, or failed for
+    good. users that only failed on transient errors (we ran out of
+    retries) and a partial last line (we died mid-write) don't count.
+    '''
+    done = set()
+    if not os.path.isfile(outfile):
+        return done
+
+    with open(outfile, 'r') as infile:
+        for line in infile:
+            if not line.endswith('\n'):
+                break
+            try:
+                record = json.loads(line)
+                if not record.get('transient'):
+                    done.add(str(record['user_id']))
+            except (json.JSONDecodeError, KeyError, TypeError):
+                raise ValueError(f'{outfile} is not one of our jsonl score files - please pick a new outfile.')
+
+    return done
+
+
+def is_transient(error:Exception) -> bool:
+    '''
+    whether a failed call is worth retrying
+    '''
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+
+    return status in RETRY_STATUSES
+
+
+############
+# THE THING!
+############
+class ScoreCache:
+
+    def __init__(self, path:str=SCORE_CACHE_DB, ttl:float=DEFAULT_TTL):
+        '''
+        botometer results by user id, in a sqlite db at `path`. results
+        older than `ttl` seconds count as missing. only use it from one
+        thread.
+        '''
+        self.path = path
+        self.ttl = ttl
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.db = sqlite3.connect(path)
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def get(self, user_id:str):
+        '''
+        (result, scored timestamp) for `user_id`, None if there's no fresh one
+        '''
+        row = self.db.execute('SELECT result, scored FROM scores WHERE user_id=? AND scored >= ?',
+                              (str(user_id), time.time()-self.ttl)).fetchone()
+        if row is None:
+            return None
+
+        return json.loads(row[0]), row[1]
+
+    def put(self, user_id:str, result:dict, scored:float):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO scores (user_id, result, scored) VALUES (?, ?, ?)',
+                            (str(user_id), json.dumps(result), scored))
+
+    def close(self):
+        self.db.close()
+
+
+def score_users(bom,
+                user_ids:list,
+                outfile:str,
+                cache:ScoreCache,
+                max_concurrent:int=4,
+                max_retries:int=3,
+                retry_backoff:float=30.0) -> dict:
+    '''
+    scores `user_ids` into `outfile`, see the top of this file.
+
+    args:
+        - bom: a `botometer.Botometer`
+        - user_ids: list of user ids. duplicates get scored once.
+        - outfile: str, the jsonl outfile. appended to, never overwritten.
+        - cache: `ScoreCache`
+        - max_concurrent: int, botometer calls in flight at once
+        - max_retries: int, retries per user on transient failures
+        - retry_backoff: float, seconds before the first retry, doubled
+          for every further one
+
+    returns:
+        - counters dict: `scored`, `cached`, `failed`, `skipped` (already
+          in the outfile) and `duplicates`
+    '''
+    counters = {'scored': 0, 'cached': 0, 'failed': 0, 'skipped': 0, 'duplicates': 0}
+
+    done = done_users(outfile)
+    todo = []
+    seen = set()
+    for user_id in user_ids:
+        key = str(user_id)
+        if key in seen:
+            counters['duplicates'] += 1
+        elif key in done:
+            counters['skipped'] += 1
+        else:
+            todo.append(user_id)
+        seen.add(key)
+
+    def check(user_id):
+        for attempt in range(max_retries+1):
+            try:
+                return bom.check_account(user_id)
+            except Exception as e:
+                if attempt==max_retries or not is_transient(e):
+                    raise
+                wait = retry_backoff*2**attempt
+                logging.warning(f'scoring user {user_id} failed ({e}). retrying in {wait} seconds.')
+                time.sleep(wait)
+
+    with open(outfile, 'a', encoding='utf-8') as o:
+
+        def write(record:dict):
+            o.write(json.dumps(record)+'\n')
+            o.flush()
+
+        to_score = []
+        for user_id in todo:
+            hit = cache.get(user_id)
+            if hit is None:
+                to_score.append(user_id)
+                continue
+            result, scored = hit
+            write({'user_id': user_id,
+                   'scored_at': datetime.datetime.fromtimestamp(scored).isoformat(),
+                   'cached': True,
+                   'result': result})
+            counters['cached'] += 1
+
+        logging.info(f'scoring {len(to_score)} users, {counters}')
+
+        with ThreadPoolExecutor(max_workers=max_concurrent) as pool:
+            futures = {pool.submit(check, user_id): user_id for user_id in to_score}
+            try:
+                for future in as_completed(futures):
+                    user_id = futures[future]
+                    scored = time.time()
+                    record = {'user_id': user_id,
+                              'scored_at': datetime.datetime.fromtimestamp(scored).isoformat(),
+                              'cached': False}
+                    try:
+                        record['result'] = future.result()
+                        cache.put(user_id, record['result'], scored)
+                        counters['scored'] += 1
+                    except Exception as e:
+                        record['error'] = repr(e)
+                        record['transient'] = is_transient(e)
+                        counters['failed'] += 1
+                        logging.warning(f'could not score user {user_id}: {e}')
+                    write(record)
+
+                    n_done = counters['scored'] + counters['failed']
+                    if n_done % 100==0:
+                        logging.info(f'scored {n_done} of {len(to_score)} users.')
+            except BaseException:
+                # e.g. ctrl-c: don't wait for the users nobody started on yet
+                for future in futures:
+                    future.cancel()
+                raise
+
+    logging.info(f'done scoring: {counters}')
+
+    return counters
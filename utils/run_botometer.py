@@ -10,18 +10,42 @@
 # - RapidAPI acc, with subscription to Botometer
 # - Twitter API credentials 
 
-# NL, 12/01/23
+# NL, 12/01/23 -- scoring now runs through `score_users` in
+# `botometer_scoring.py`: several users at once, results appended to the
+# (jsonl) outfile as they come in, cached across runs, and a rerun into
+# the same outfile picks up where the last one stopped.
 
 ############
 # IMPORTS
 ############
 import os
+import sys
 from dotenv import load_dotenv
 import argparse
+import datetime
 import json
+import logging
 import pandas as pd
-import random
 import botometer 
+from botometer_scoring import ScoreCache, score_users, SCORE_CACHE_DB
+from user_sampling import sample_json_lines, sample_csv, STRATA
+
+############
+# FUNCTIONS
+############
+def read_user_ids(path:str, file_type:str, field:str):
+    '''
+    yields the user id of every row/line of `path`, without reading the
+    whole file into memory
+    '''
+    if file_type=='csv':
+        for chunk in pd.read_csv(path, usecols=[field], chunksize=100000):
+            yield from chunk[field]
+    elif file_type=='json':
+        with open(path, 'r') as infile:
+            for line in infile:
+                yield json.loads(line)[field]
+
 
 ############
 # CLI 
@@ -34,8 +58,9 @@ parser.add_argument("-i", "--infile", dest = "infile",
                     containing ids of twitter users.""")
 
 parser.add_argument('-o', '--outfile', dest='outfile',
-                    help='''full path to the destination file. for now
-                    files will be written out to json.''')
+                    help='''full path to the destination file. results get
+                    appended to it as json lines, one per user. if it
+                    exists, users already in it get skipped.''')
 
 parser.add_argument("-f", "--file_type", dest = "file_type", 
                     choices=["csv", "json"],
@@ -54,7 +79,40 @@ parser.add_argument("-r", "--random_sample", dest = "random_sample",
                     action='store_true',
                     help="""a flag indicating whether to produce a random
                     sample of twitter users rather than sequentially running through
-                    all available user_ids (up to our max iterations).""")
+                    all available user_ids (up to our max iterations). the
+                    sample is uniform over distinct users, and drawn in one
+                    pass with memory bounded by its size.""")
+
+parser.add_argument("-s", "--stratify", dest = "stratify",
+                    choices=STRATA, default=None,
+                    help="""with --random_sample, split the sample evenly
+                    across followers count buckets or days, rather than
+                    sampling uniformly over all distinct users.""")
+
+parser.add_argument("--followers_field", dest = "followers_field",
+                    default="followers_count",
+                    help="name of the field/column holding users' followers count")
+
+parser.add_argument("--time_field", dest = "time_field",
+                    default="created_at",
+                    help="name of the field/column holding the tweets' timestamps")
+
+parser.add_argument("--seed", dest = "seed",
+                    default=None,
+                    help="seed for --random_sample, for a reproducible sample")
+
+parser.add_argument("-c", "--max_concurrent", dest = "max_concurrent",
+                    default=4,
+                    help="number of users to score at once")
+
+parser.add_argument("--cache_path", dest = "cache_path",
+                    default=SCORE_CACHE_DB,
+                    help="sqlite file caching botometer results across runs")
+
+parser.add_argument("--cache_days", dest = "cache_days",
+                    default=30,
+                    help="""days for which a cached result gets reused rather
+                    than scoring the user again.""")
 
 parser.add_argument("-l", "--log_to_stdout", dest = "log_to_stdout", 
 					action = "store_true",
@@ -66,6 +124,24 @@ args = parser.parse_args()
 ############
 # INIT 
 ############
+TODAY = datetime.datetime.now().strftime('%Y_%m_%d-%H_%M_%S')
+LOG_FILE_PATH = f'../data/logfiles/twitter/botometer_{TODAY}.log'
+LOG_FORMAT = '%(asctime)s [%(filename)s:%(lineno)s - %(funcName)20s() ] - %(name)s - %(levelname)s - %(message)s'
+
+# Logger
+file_handler = logging.FileHandler(filename=LOG_FILE_PATH)
+stdout_handler = logging.StreamHandler(sys.stdout)
+
+if args.log_to_stdout:
+	handlers = [file_handler, stdout_handler]
+else: 
+	handlers = [file_handler]
+
+logging.basicConfig(
+    level=logging.INFO, 
+    format=LOG_FORMAT,
+    handlers=handlers)
+
 # creds & auth
 load_dotenv()
 BOTOMETER_TOKEN = os.getenv('BOTOMETER_TOKEN')
@@ -80,31 +156,43 @@ bom = botometer.Botometer(wait_on_ratelimit=True,
                           rapidapi_key=BOTOMETER_TOKEN,
                           **TWITTER_APP_AUTH)
 
-# let's get our file read in to memory, and build a list of user-ids
-print(args.infile)
-
-if args.file_type=='csv':
-    tmp_df = pd.read_csv(args.infile)
-    user_list = list(set(tmp_df[args.user_id_field]))
-elif args.file_type=='json':
-    with open(args.infile, 'r') as infile:
-        user_list = [json.loads(line)[args.user_id_field] for line in infile]
+# let's go through our file and build a list of distinct user-ids
+logging.info(f'reading user ids from {args.infile}')
+MAX_USERS = int(args.max_iterations)
 
 # random sample? 
 if args.random_sample:
-    user_list = random.sample(user_list, int(args.max_iterations))
+    sample = sample_json_lines if args.file_type=='json' else sample_csv
+    sampler = sample(args.infile,
+                     MAX_USERS,
+                     user_id_field=args.user_id_field,
+                     stratify=args.stratify,
+                     followers_field=args.followers_field,
+                     time_field=args.time_field,
+                     seed=args.seed)
+    user_list = sampler.sample()
+    logging.info(f'sampled {len(user_list)} users out of {sampler.n_offered} rows, seed {sampler.seed}. per stratum: {sampler.stratum_sizes()}')
 else:
-    user_list = user_list[:args.max_iterations]
+    # the first MAX_USERS distinct users - no need to read any further
+    user_list = []
+    seen = set()
+    for user_id in read_user_ids(args.infile, args.file_type, args.user_id_field):
+        if user_id not in seen:
+            seen.add(user_id)
+            user_list.append(user_id)
+            if len(user_list) >= MAX_USERS:
+                break
 
 ############
 # THE THING 
 ############
-out = []
-for result in bom.check_accounts_in(user_list):
-    out.append(result)
-
-with open(args.outfile, 'w') as outfile:
-    json.dump(out, outfile)
+cache = ScoreCache(args.cache_path, ttl=float(args.cache_days)*24*60*60)
+score_users(bom,
+            user_list,
+            outfile=args.outfile,
+            cache=cache,
+            max_concurrent=int(args.max_concurrent))
+cache.close()
 
 # print(user_list)
 # tmp = bom.check_account(user_list[0])
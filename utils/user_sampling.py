@@ -0,0 +1,293 @@
+# user_sampling.py
+
+# UTILS: TWITTER.
+# picking a random sample of users from our tweet files in one pass, with
+# memory bounded by the sample size. `run_botometer.py --random_sample`
+# used to `json.loads` every line of the input, keep every user id, and
+# only then `random.sample` - gigabytes of ram to pick 100 accounts.
+
+# how:
+# - only the fields we need get pulled out of each line, with a regex
+#   rather than a full json decode. lines the regex can't handle fall
+#   back to `json.loads`.
+# - every user gets a pseudo-random priority from a (seeded) hash of its
+#   id, and we keep the `n` users with the lowest priorities (a bottom-k
+#   sample). a user that tweets a thousand times has the same priority
+#   every time, so the sample is uniform over *distinct* users, not over
+#   tweets - and it never holds more than `n` ids.
+# - stratified sampling keeps a bottom-k sample per stratum (followers
+#   count bucket, or day). `n` is split evenly across the strata seen so
+#   far; when a new one shows up, the others shrink to make room. a
+#   bottom-k sample shrunk to k' is still a bottom-k' sample, so that's
+#   exact. priorities are drawn per stratum, so the strata get sampled
+#   independently; a user in several strata (active on several days) can
+#   still be picked in more than one - they're only scored once. strata
+#   with fewer users than their share leave the sample that much short.
+#   with more strata than `n`, only the `n` strata holding the lowest
+#   priorities get a user each, so the sample never exceeds `n`.
+
+############
+# IMPORTS
+############
+import re
+import json
+import heapq
+import random
+import hashlib
+import pandas as pd
+
+############
+# CONSTANTS
+############
+STRATA = ['followers', 'day']
+
+# lower bounds of our followers count buckets
+FOLLOWER_BUCKETS = [0, 100, 1000, 10000, 100000, 1000000]
+
+############
+# FUNCTIONS
+############
+def field_pattern(field:str):
+    '''
+    matches the first `"field": value` in a json line, nested or not.
+    our tweet records put the tweet's own fields before the `user`
+    object, so e.g. `created_at` is the tweet's, not the account's.
+    '''
+    return re.compile(r'"'+re.escape(field)+r'":\s*"?([^",}\s]+)')
+
+
+def find_field(record, field:str):
+    '''
+    the first value of `field` in a decoded record, depth first - the
+    slow path for lines `field_pattern` doesn't match
+    '''
+    if isinstance(record, dict):
+        if field in record and not isinstance(record[field], (dict, list)):
+            return record[field]
+        values = record.values()
+    elif isinstance(record, list):
+        values = record
+    else:
+        return None
+
+    for value in values:
+        found = find_field(value, field)
+        if found is not None:
+            return found
+
+    return None
+
+
+def follower_bucket(followers) -> str:
+    '''
+    e.g. `1000-9999` for 4711 followers, `1000000+` for the biggest accounts
+    '''
+    try:
+        followers = int(followers)
+    except (TypeError, ValueError):
+        return 'unknown'
+
+    for lower, upper in zip(FOLLOWER_BUCKETS, FOLLOWER_BUCKETS[1:]):
+        if followers < upper:
+            return f'{lower}-{upper-1}'
+
+    return f'{FOLLOWER_BUCKETS[-1]}+'
+
+
+def stratum_of(stratify:str, followers=None, created_at=None) -> str:
+    if stratify=='followers':
+        return follower_bucket(followers)
+    if stratify=='day':
+        return str(created_at)[:10] if created_at is not None else 'unknown'
+    return None
+
+
+############
+# THE THING!
+############
+class BottomK:
+
+    def __init__(self, capacity:int):
+        '''
+        the `capacity` items with the lowest priorities offered so far.
+        offering the same item again is a no-op.
+        '''
+        self.capacity = capacity
+        # max-heap (by negated priority) of what we keep
+        self._heap = []
+        self._members = set()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def offer(self, item, priority:float):
+        if item in self._members:
+            return
+        if len(self._heap) < self.capacity:
+            heapq.heappush(self._heap, (-priority, item))
+            self._members.add(item)
+        elif self._heap and priority < -self._heap[0][0]:
+            _, dropped = heapq.heapreplace(self._heap, (-priority, item))
+            self._members.discard(dropped)
+            self._members.add(item)
+
+    def lowest(self) -> float:
+        '''
+        the lowest priority we keep, None if we keep nothing
+        '''
+        return -max(self._heap)[0] if self._heap else None
+
+    def shrink(self, capacity:int):
+        self.capacity = capacity
+        while len(self._heap) > capacity:
+            _, dropped = heapq.heappop(self._heap)
+            self._members.discard(dropped)
+
+    def items(self) -> list:
+        '''
+        what we keep, lowest priority first
+        '''
+        return [item for _, item in sorted(self._heap, reverse=True)]
+
+
+class UserSampler:
+
+    def __init__(self, n:int, stratify:str=None, seed=None):
+        '''
+        args:
+            - n: int, sample size
+            - stratify: str, None for a uniform sample over distinct users,
+              `followers` to stratify by followers count bucket, `day` to
+              stratify by the day of the tweet
+            - seed: anything hashable. the same seed on the same input
+              gives the same sample. random if None.
+        '''
+        if stratify is not None and stratify not in STRATA:
+            raise ValueError(f'stratify must be one of {STRATA}.')
+
+        self.n = n
+        self.stratify = stratify
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.strata = {}
+        self.n_offered = 0
+
+    def priority(self, user_id, stratum:str=None) -> float:
+        '''
+        a uniform pseudo-random number in [0, 1), fixed per user, stratum and seed
+        '''
+        digest = hashlib.blake2b(f'{self.seed}:{stratum}:{user_id}'.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')/2**64
+
+    def _rebalance(self):
+        '''
+        splits `n` evenly across the strata we've got. never below 1, so
+        with more strata than `n` we keep one candidate per stratum -
+        `sample` picks among them.
+        '''
+        base, extra = divmod(self.n, len(self.strata))
+        for i, sample in enumerate(self.strata.values()):
+            sample.shrink(max(base + (1 if i < extra else 0), 1))
+
+    def offer(self, user_id, stratum:str=None):
+        self.n_offered += 1
+        sample = self.strata.get(stratum)
+        if sample is None:
+            sample = self.strata[stratum] = BottomK(self.n)
+            self._rebalance()
+        sample.offer(str(user_id), self.priority(user_id, stratum))
+
+    def sample(self) -> list:
+        '''
+        the sampled user ids, distinct across strata. never more than `n`.
+        '''
+        strata = sorted(self.strata, key=str)
+        if len(strata) > self.n:
+            # one user each for the `n` strata with the lowest priorities,
+            # none for the rest
+            by_lowest = sorted(strata, key=lambda stratum: self.strata[stratum].lowest())
+            strata = sorted(by_lowest[:self.n], key=str)
+
+        out = []
+        seen = set()
+        for stratum in strata:
+            for user_id in self.strata[stratum].items():
+                if user_id not in seen:
+                    seen.add(user_id)
+                    out.append(user_id)
+
+        return out
+
+    def stratum_sizes(self) -> dict:
+        return {stratum: len(sample) for stratum, sample in self.strata.items()}
+
+
+def sample_json_lines(path:str,
+                      n:int,
+                      user_id_field:str='author_id',
+                      stratify:str=None,
+                      followers_field:str='followers_count',
+                      time_field:str='created_at',
+                      seed=None) -> UserSampler:
+    '''
+    one pass over a jsonl file of tweets, see `UserSampler`. only the
+    fields we need get decoded.
+    '''
+    sampler = UserSampler(n, stratify=stratify, seed=seed)
+    fields = [user_id_field]
+    if stratify=='followers':
+        fields.append(followers_field)
+    elif stratify=='day':
+        fields.append(time_field)
+    patterns = [field_pattern(field) for field in fields]
+
+    with open(path, 'r') as infile:
+        for line in infile:
+            values = []
+            for pattern in patterns:
+                match = pattern.search(line)
+                values.append(match.group(1) if match and match.group(1)!='null' else None)
+
+            if None in values and line.strip():
+                record = json.loads(line)
+                values = [find_field(record, field) for field in fields]
+            if values[0] is None:
+                continue
+
+            stratum = None
+            if stratify=='followers':
+                stratum = stratum_of(stratify, followers=values[1])
+            elif stratify=='day':
+                stratum = stratum_of(stratify, created_at=values[1])
+            sampler.offer(values[0], stratum)
+
+    return sampler
+
+
+def sample_csv(path:str,
+               n:int,
+               user_id_field:str='author_id',
+               stratify:str=None,
+               followers_field:str='followers_count',
+               time_field:str='created_at',
+               seed=None,
+               chunksize:int=100000) -> UserSampler:
+    '''
+    `sample_json_lines` for a csv of tweets. only the columns we need get
+    read, a chunk at a time.
+    '''
+    sampler = UserSampler(n, stratify=stratify, seed=seed)
+    extra = {'followers': followers_field, 'day': time_field}.get(stratify)
+    columns = [user_id_field] + ([extra] if extra else [])
+
+    for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+        for row in chunk.itertuples(index=False):
+            if pd.isna(row[0]):
+                continue
+            stratum = None
+            if stratify=='followers':
+                stratum = stratum_of(stratify, followers=None if pd.isna(row[1]) else row[1])
+            elif stratify=='day':
+                stratum = stratum_of(stratify, created_at=None if pd.isna(row[1]) else row[1])
+            sampler.offer(row[0], stratum)
+
+    return sampler